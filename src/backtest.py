@@ -0,0 +1,706 @@
+import argparse
+import bisect
+import csv
+import datetime as dt
+import heapq
+import itertools
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from .strategy import VolumeSideStrategy
+from .tick_store import SIDES, TickStore
+
+
+# Rows of the store converted to Python values at a time while replaying
+REPLAY_CHUNK = 65536
+
+# Parameters a sweep can vary, and their defaults
+PARAMETERS = {
+	'ignore_cutoff': .01,
+	'depth': 50,
+	'gdax_min_trade_size_btc': .001,
+	'size_factor': .995,
+}
+
+# Columns of the results table, after the parameters
+RESULT_COLUMNS = (
+	'pnl_usd', 'orders', 'filled_orders', 'fill_rate', 'volume_btc', 'rejects',
+	'time_to_fill_s', 'decision_p50_us', 'decision_p99_us', 'cpu_s',
+)
+
+SIDE_NAMES = {code: name for name, code in SIDES.items()}
+
+
+class BacktestAccount:
+
+	def __init__(self, usd, btc):
+		"""
+		Holdings of a backtest, standing in for GDAXAccount.
+
+		Parameters:
+			usd: float
+				Starting USD.
+			btc: float
+				Starting BTC.
+		"""
+
+		self.usd = usd
+		self.btc = btc
+
+
+class BacktestOrder:
+
+	def __init__(self, order_type, price, size, strategy):
+		"""
+		Order placed during a backtest, with the attributes strategies look
+		at on a live Order.
+
+		Parameters:
+			order_type: string
+				'buy' or 'sell'.
+			price: float
+				Price of the order.
+			size: float
+				Size of the order.
+			strategy: Strategy
+				Strategy that placed it.
+		"""
+
+		self.order_type = order_type
+		self.price = price
+		self.size = size
+		self.strategy = strategy
+		# Set once the exchange would have acknowledged the order
+		self.order_id = None
+		self.live_time = None
+		self.cancel_requested = False
+		self.cumulative_filled = 0.0
+		self.done = False
+
+	def keep_queue_position(self, book):
+		"""
+		Backtests don't model queue positions, so an order its strategy
+		would cancel is never kept.
+
+		Parameters:
+			book: Backtest
+				Current book.
+
+		Returns:
+			keep: bool
+				Always False.
+		"""
+
+		return False
+
+
+class ReplayData:
+
+	def __init__(self, root, product, start, end, levels, order_paths=None):
+		"""
+		Recorded market data a backtest replays, memory mapped from a
+		TickStore so every process of a sweep reads the same pages. Each
+		day of the range stays a slice of that day's files and the days
+		are replayed one after another, since joining them would copy the
+		whole range into every process.
+
+		Parameters:
+			root: string
+				Directory of the TickStore.
+			product: string
+				e.g. 'BTC-USD'.
+			start, end: datetime.datetime
+				UTC time range to replay.
+			levels: int
+				Levels per side the store's depth snapshots were recorded with.
+			order_paths: list
+				.npy files of merge_order() for each day of the range, as
+				written by save_orders(), memory mapped. Computed here if
+				not given.
+		"""
+
+		store = TickStore(root, levels)
+		self.changes = store.query_days(product, 'changes', start, end)
+		self.trades = store.query_days(product, 'trades', start, end)
+		# Only the first snapshot is used
+		depth = [
+			part for part in store.query_days(product, 'depth', start, end)
+			if len(part['time_ns'])
+		]
+		self.depth = depth[0] if depth else store.query(product, 'depth', start, end)
+		if order_paths is not None:
+			self.orders = [np.load(path, mmap_mode='r') for path in order_paths]
+		else:
+			self.orders = [
+				merge_order(changes['time_ns'], trades['time_ns'])
+				for changes, trades in zip(self.changes, self.trades)
+			]
+		prices = [trades['price'] for trades in self.trades if len(trades['price'])]
+		self.last_price = float(prices[-1][-1]) if prices else 0.0
+
+	def events(self):
+		"""
+		Yields every change and trade in time order, a chunk of memory
+		mapped rows at a time.
+
+		Returns:
+			events: generator
+				(time_ns, is_trade, side, price, size) tuples.
+		"""
+
+		for changes, trades, order in zip(self.changes, self.trades, self.orders):
+			n_changes = len(changes['time_ns'])
+			for first in range(0, len(order), REPLAY_CHUNK):
+				index = np.asarray(order[first:first + REPLAY_CHUNK])
+				is_trade = index >= n_changes
+				change_rows = index[~is_trade]
+				trade_rows = index[is_trade] - n_changes
+
+				columns = []
+				for name in ('time_ns', 'side', 'price', 'size'):
+					values = np.empty(len(index), dtype=changes[name].dtype)
+					values[~is_trade] = changes[name][change_rows]
+					values[is_trade] = trades[name][trade_rows]
+					columns.append(values.tolist())
+				yield from zip(columns[0], is_trade.tolist(), *columns[1:])
+
+
+def merge_order(change_times, trade_times):
+	"""
+	Replay order of changes and trades.
+
+	Parameters:
+		change_times: numpy.ndarray
+			time_ns of the changes table.
+		trade_times: numpy.ndarray
+			time_ns of the trades table.
+
+	Returns:
+		order: numpy.ndarray
+			Indices into changes followed by trades, sorted by time. Changes
+			go first on ties.
+	"""
+
+	return np.argsort(np.concatenate((change_times, trade_times)), kind='stable')
+
+
+def save_orders(root, product, start, end, levels, directory):
+	"""
+	Computes merge_order() for each day of a range and saves it, for
+	ReplayData to memory map.
+
+	Parameters:
+		root, product, start, end, levels:
+			As passed to ReplayData.
+		directory: string
+			Where to write the files.
+
+	Returns:
+		order_paths: list
+			.npy file of each day, in order.
+	"""
+
+	store = TickStore(root, levels)
+	order_paths = []
+	for i, (changes, trades) in enumerate(zip(
+			store.query_days(product, 'changes', start, end, columns=[]),
+			store.query_days(product, 'trades', start, end, columns=[]))):
+		order_paths.append(os.path.join(directory, f'order_{i}.npy'))
+		np.save(order_paths[-1], merge_order(changes['time_ns'], trades['time_ns']))
+
+	return order_paths
+
+
+class Backtest:
+
+	def __init__(
+			self, data, ignore_cutoff=.01, depth=50, gdax_min_trade_size_btc=.001,
+			size_factor=.995, usd=1000.0, btc=0.0, latency=.05):
+		"""
+		Replays recorded market data through VolumeSideStrategy. The book is
+		rebuilt from the raw level2 changes the way OrderBookWebSocket
+		builds it, so ignore_cutoff and depth act on it as they would live.
+		Orders are acknowledged and canceled latency after being sent and
+		fill when a trade prints at or through their price on their side,
+		ignoring their place in the queue.
+
+		Also serves as the book passed to the strategy, with the same best
+		price and recent_price attributes as OrderBookWebSocket.
+
+		Parameters:
+			data: ReplayData
+				Market data to replay.
+			ignore_cutoff: float
+				Changes further than this fraction from recent_price are
+				ignored.
+			depth: int
+				Levels kept per side.
+			gdax_min_trade_size_btc, size_factor: float
+				Passed to VolumeSideStrategy.
+			usd, btc: float
+				Starting holdings.
+			latency: float
+				Seconds from an order or cancel being sent to it taking effect.
+		"""
+
+		self.data = data
+		self.ignore_cutoff = ignore_cutoff
+		self.depth = depth
+		self.latency_ns = int(latency * 1e9)
+		self.account = BacktestAccount(usd, btc)
+		self.start_value = (usd, btc)
+		self.strategy = VolumeSideStrategy(
+			self.account, gdax_min_trade_size_btc=gdax_min_trade_size_btc,
+			size_factor=size_factor
+		)
+		# Ascending prices and price -> size, per side
+		self.buy_prices, self.buy_sizes = [], {}
+		self.sell_prices, self.sell_sizes = [], {}
+		self.best_buy_price = self.best_buy_size = 0.0
+		self.best_sell_price = self.best_sell_size = 0.0
+		self.recent_price = 0.0
+		self.recent_price_lower = self.recent_price_upper = 0.0
+		self.last_trade_price = None
+		# (time_ns, seq, action, order) of acks and cancels in flight
+		self.in_flight = []
+		self.seq = 0
+		self.orders = 0
+		self.filled_orders = 0
+		self.rejects = 0
+		self.volume = 0.0
+		self.time_to_fill = []
+		self.decision_times = []
+
+	def run(self):
+		"""
+		Replays the data from its first depth snapshot on.
+
+		Returns:
+			result: dict
+				The RESULT_COLUMNS.
+		"""
+
+		run_start = time.process_time()
+		start_ns = self.load_snapshot()
+		for time_ns, is_trade, side, price, size in self.data.events():
+			if time_ns < start_ns:
+				continue
+			while self.in_flight and self.in_flight[0][0] <= time_ns:
+				due_ns, _, action, order = heapq.heappop(self.in_flight)
+				action(due_ns, order)
+			if is_trade:
+				self.on_trade(time_ns, SIDE_NAMES.get(side), price, size)
+			else:
+				self.on_change(time_ns, SIDE_NAMES.get(side), price, size)
+
+		return self.result(time.process_time() - run_start)
+
+	def load_snapshot(self):
+		"""
+		Starts the book from the first recorded depth snapshot.
+
+		Returns:
+			time_ns: int
+				Time of the snapshot, 0 if there is none and the book starts
+				empty.
+		"""
+
+		depth = self.data.depth
+		if not len(depth['time_ns']):
+			return 0
+
+		for prices, sizes, book_prices, book_sizes in (
+				(depth['bid_prices'][0], depth['bid_sizes'][0], self.buy_prices, self.buy_sizes),
+				(depth['ask_prices'][0], depth['ask_sizes'][0], self.sell_prices, self.sell_sizes)):
+			for price, size in zip(prices.tolist(), sizes.tolist()):
+				if size:
+					book_sizes[price] = size
+			book_prices.extend(sorted(book_sizes))
+		for price in self.buy_prices[:-self.depth]:
+			del self.buy_sizes[price]
+		del self.buy_prices[:-self.depth]
+		for price in self.sell_prices[self.depth:]:
+			del self.sell_sizes[price]
+		del self.sell_prices[self.depth:]
+		self.update_best('buy')
+		self.update_best('sell')
+		self.update_recent_price()
+
+		return int(depth['time_ns'][0])
+
+	def on_change(self, time_ns, side, price, size):
+		"""
+		Applies a level2 change the way OrderBookWebSocket.on_message()
+		does and lets the strategy decide on the new book.
+
+		Returns:
+			None
+		"""
+
+		if side == 'buy':
+			prices, sizes = self.buy_prices, self.buy_sizes
+		else:
+			prices, sizes = self.sell_prices, self.sell_sizes
+
+		if size != 0:
+			if self.recent_price_lower < price < self.recent_price_upper:
+				if price not in sizes:
+					bisect.insort(prices, price)
+				sizes[price] = size
+		elif price in sizes:
+			del sizes[price]
+			prices.remove(price)
+
+		# Best buy prices are at the end, best sell prices at the start
+		if side == 'buy':
+			while len(prices) > self.depth:
+				del sizes[prices.pop(0)]
+		else:
+			while len(prices) > self.depth:
+				del sizes[prices.pop()]
+		self.update_best(side)
+		self.update_recent_price()
+
+		if self.best_buy_price and self.best_sell_price:
+			decision_start = time.perf_counter()
+			intents = self.strategy.on_book_update(self)
+			self.decision_times.append(time.perf_counter() - decision_start)
+			self.execute(time_ns, intents)
+
+	def on_trade(self, time_ns, side, price, size):
+		"""
+		Fills live orders on the trade's maker side at or through its price.
+
+		Parameters:
+			side: string
+				Maker's side.
+
+		Returns:
+			None
+		"""
+
+		self.last_trade_price = price
+		for order in tuple(self.strategy.open_orders):
+			if order.order_id is None or order.done or order.order_type != side:
+				continue
+			if (side == 'buy' and price > order.price) or (side == 'sell' and price < order.price):
+				continue
+
+			amount = min(size, order.size - order.cumulative_filled)
+			size -= amount
+			order.cumulative_filled += amount
+			self.volume += amount
+			if side == 'buy':
+				self.account.usd -= order.price * amount
+				self.account.btc += amount
+			else:
+				self.account.usd += order.price * amount
+				self.account.btc -= amount
+			if order.cumulative_filled >= order.size:
+				order.done = True
+				self.filled_orders += 1
+				self.time_to_fill.append((time_ns - order.live_time) / 1e9)
+				self.strategy.open_orders.discard(order)
+			self.execute(time_ns, self.strategy.on_fill(order, amount))
+			if size <= 0:
+				break
+
+	def execute(self, time_ns, intents):
+		"""
+		Sends a strategy's OrderIntents, which take effect latency later.
+
+		Returns:
+			None
+		"""
+
+		for intent in intents:
+			if intent.action == 'order':
+				order = BacktestOrder(
+					intent.order_type, intent.price, intent.size, self.strategy
+				)
+				self.strategy.open_orders.add(order)
+				self.orders += 1
+				self.schedule(time_ns, self.on_ack, order)
+			elif intent.action == 'cancel' and not intent.order.cancel_requested:
+				intent.order.cancel_requested = True
+				self.schedule(time_ns, self.on_cancel, intent.order)
+
+	def schedule(self, time_ns, action, order):
+		"""
+		Calls action(due time, order) latency after time_ns.
+
+		Returns:
+			None
+		"""
+
+		self.seq += 1
+		heapq.heappush(self.in_flight, (time_ns + self.latency_ns, self.seq, action, order))
+
+	def on_ack(self, time_ns, order):
+		"""
+		The exchange accepts the order, or rejects it for insufficient
+		funds.
+
+		Returns:
+			None
+		"""
+
+		if order.order_type == 'buy':
+			funded = order.price * order.size <= self.account.usd
+		else:
+			funded = order.size <= self.account.btc
+		if not funded:
+			order.done = True
+			self.rejects += 1
+			self.strategy.open_orders.discard(order)
+			self.strategy.on_reject(order, {'OrdStatus': 'Rejected', 'Text': 'Insufficient funds'})
+			return
+
+		order.order_id = str(self.orders)
+		order.live_time = time_ns
+
+	def on_cancel(self, time_ns, order):
+		"""
+		The exchange cancels what is left of the order.
+
+		Returns:
+			None
+		"""
+
+		if not order.done:
+			order.done = True
+			self.strategy.open_orders.discard(order)
+
+	def update_best(self, side):
+		"""
+		Updates one side's best price and size after a change.
+
+		Parameters:
+			side: string
+				'buy' or 'sell'.
+
+		Returns:
+			None
+		"""
+
+		if side == 'buy':
+			if self.buy_prices:
+				self.best_buy_price = self.buy_prices[-1]
+				self.best_buy_size = self.buy_sizes[self.best_buy_price]
+			else:
+				self.best_buy_price = self.best_buy_size = 0.0
+		elif self.sell_prices:
+			self.best_sell_price = self.sell_prices[0]
+			self.best_sell_size = self.sell_sizes[self.best_sell_price]
+		else:
+			self.best_sell_price = self.best_sell_size = 0.0
+
+	def update_recent_price(self):
+		"""
+		Same as OrderBookWebSocket.update_recent_price() with matches
+		subscribed and no volatility widening.
+
+		Returns:
+			None
+		"""
+
+		if self.last_trade_price is not None:
+			self.recent_price = self.last_trade_price
+		else:
+			self.recent_price = (self.best_buy_price + self.best_sell_price) / 2
+		self.recent_price_lower = (1 - self.ignore_cutoff) * self.recent_price
+		self.recent_price_upper = (1 + self.ignore_cutoff) * self.recent_price
+
+	def result(self, cpu_time):
+		"""
+		Parameters:
+			cpu_time: float
+				CPU seconds the replay took.
+
+		Returns:
+			result: dict
+				The RESULT_COLUMNS. pnl_usd compares the final holdings to the
+				starting ones, both valued at the last trade price.
+		"""
+
+		price = self.data.last_price
+		usd, btc = self.start_value
+		if self.decision_times:
+			p50, p99 = np.percentile(self.decision_times, [50, 99]) * 1e6
+		else:
+			p50 = p99 = 0.0
+
+		return {
+			'pnl_usd': self.account.usd + self.account.btc * price - usd - btc * price,
+			'orders': self.orders,
+			'filled_orders': self.filled_orders,
+			'fill_rate': self.filled_orders / self.orders if self.orders else 0.0,
+			'volume_btc': self.volume,
+			'rejects': self.rejects,
+			'time_to_fill_s': float(np.mean(self.time_to_fill)) if self.time_to_fill else 0.0,
+			'decision_p50_us': float(p50),
+			'decision_p99_us': float(p99),
+			'cpu_s': cpu_time,
+		}
+
+
+# Set in each sweep process by load_replay_data()
+replay_data = None
+
+
+def load_replay_data(root, product, start, end, levels, order_paths):
+	"""
+	Process pool initializer that memory maps the replay data once per
+	process.
+
+	Returns:
+		None
+	"""
+
+	global replay_data
+	replay_data = ReplayData(root, product, start, end, levels, order_paths)
+
+
+def run_backtest(params, backtest_kwargs):
+	"""
+	Runs one backtest over the process's replay data.
+
+	Parameters:
+		params: dict
+			Swept PARAMETERS.
+		backtest_kwargs: dict
+			Other Backtest arguments.
+
+	Returns:
+		row: dict
+			params followed by the result.
+	"""
+
+	return {**params, **Backtest(replay_data, **params, **backtest_kwargs).run()}
+
+
+def sweep(root, product, start, end, grid, processes=None, levels=10, **backtest_kwargs):
+	"""
+	Runs a backtest for every combination of parameters in grid, spread
+	over a process pool. The market data is never copied to the processes:
+	each one memory maps the store's column files, plus the replay order
+	of each day computed here once, and so shares their pages with the
+	others.
+
+	Parameters:
+		root: string
+			Directory of the TickStore.
+		product: string
+			e.g. 'BTC-USD'.
+		start, end: datetime.datetime
+			UTC time range to replay.
+		grid: dict
+			PARAMETERS name -> list of values to try. Parameters left out
+			keep their defaults.
+		processes: int
+			Size of the pool, the number of CPUs by default.
+		levels: int
+			Levels per side the store's depth snapshots were recorded with.
+		backtest_kwargs:
+			Other Backtest arguments, the same for every run.
+
+	Returns:
+		table: list
+			One row per combination, in grid order.
+	"""
+
+	names = list(grid)
+	combinations = [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+	with tempfile.TemporaryDirectory() as tmp:
+		order_paths = save_orders(root, product, start, end, levels, tmp)
+		with multiprocessing.Pool(
+				processes, initializer=load_replay_data,
+				initargs=(root, product, start, end, levels, order_paths)) as pool:
+			return pool.starmap(
+				run_backtest, [(params, backtest_kwargs) for params in combinations],
+				chunksize=1
+			)
+
+
+def format_table(table):
+	"""
+	Parameters:
+		table: list
+			Rows as returned by sweep().
+
+	Returns:
+		text: string
+			Aligned columns, one line per row.
+	"""
+
+	if not table:
+		return ''
+
+	columns = list(table[0])
+	cells = [columns] + [
+		[f'{row[c]:.6g}' if isinstance(row[c], float) else str(row[c]) for c in columns]
+		for row in table
+	]
+	widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+
+	return '\n'.join(
+		'  '.join(cell.rjust(width) for cell, width in zip(line, widths)) for line in cells
+	)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(
+		description='Sweep VolumeSideStrategy parameters over recorded market data.'
+	)
+	parser.add_argument('--store', required=True, help='tick_store_path the data was recorded to')
+	parser.add_argument('--product', default='BTC-USD')
+	parser.add_argument('--start', type=dt.datetime.fromisoformat, help='UTC, e.g. 2018-05-01T00:00')
+	parser.add_argument('--end', type=dt.datetime.fromisoformat, help='UTC, exclusive')
+	parser.add_argument('--levels', type=int, default=10, help='tick_store_levels the data was recorded with')
+	parser.add_argument('--ignore-cutoff', type=float, nargs='+', default=[PARAMETERS['ignore_cutoff']])
+	parser.add_argument('--depth', type=int, nargs='+', default=[PARAMETERS['depth']])
+	parser.add_argument(
+		'--min-trade-size', type=float, nargs='+',
+		default=[PARAMETERS['gdax_min_trade_size_btc']]
+	)
+	parser.add_argument('--size-factor', type=float, nargs='+', default=[PARAMETERS['size_factor']])
+	parser.add_argument('--usd', type=float, default=1000.0, help='Starting USD')
+	parser.add_argument('--btc', type=float, default=0.0, help='Starting BTC')
+	parser.add_argument('--latency', type=float, default=.05, help='Order and cancel latency in seconds')
+	parser.add_argument('--processes', type=int, help='Defaults to the number of CPUs')
+	parser.add_argument('--out', help='CSV file to also write the table to')
+	args = parser.parse_args()
+
+	first, last = TickStore(args.store, args.levels).span(args.product)
+	if first is None:
+		parser.error(f'nothing recorded for {args.product} in {args.store}')
+	start = args.start or first
+	end = args.end or last
+
+	sweep_start = time.perf_counter()
+	table = sweep(
+		args.store, args.product, start, end, {
+			'ignore_cutoff': args.ignore_cutoff,
+			'depth': args.depth,
+			'gdax_min_trade_size_btc': args.min_trade_size,
+			'size_factor': args.size_factor,
+		},
+		processes=args.processes, levels=args.levels, usd=args.usd, btc=args.btc,
+		latency=args.latency
+	)
+	wall_time = time.perf_counter() - sweep_start
+
+	print(format_table(table))
+	print(
+		f'{len(table)} runs in {wall_time:.1f}s, '
+		f'{sum(row["cpu_s"] for row in table) / wall_time:.1f} CPUs busy on average'
+	)
+	if args.out:
+		with open(args.out, 'w', newline='') as f:
+			writer = csv.DictWriter(f, fieldnames=list(table[0]))
+			writer.writeheader()
+			writer.writerows(table)
@@ -0,0 +1,395 @@
+import collections
+import threading
+import time
+
+
+# Sums of level hashes wrap at 64 bits
+MASK = (1 << 64) - 1
+
+
+def level_hash(side, price, size):
+	"""
+	Hash of one price level. Levels are combined by adding their hashes, so
+	a level can be taken out again by subtracting its hash.
+
+	Parameters:
+		side: string
+			'buy' or 'sell'.
+		price: float
+			Price of the level.
+		size: float
+			Size at the level.
+
+	Returns:
+		level_hash: int
+			64 bit hash.
+	"""
+
+	return hash((side, float(price), float(size))) & MASK
+
+
+def top_levels_hash(bids, asks, levels):
+	"""
+	Checksum of the top levels of a book computed from scratch, e.g. of a
+	reference snapshot.
+
+	Parameters:
+		bids, asks: list
+			[price, size, ...] entries in any order, prices and sizes as
+			numbers or strings.
+		levels: int
+			Levels per side covered.
+
+	Returns:
+		checksum: int
+	"""
+
+	checksum = 0
+	top_bids = sorted(((float(p), float(s)) for p, s, *_ in bids), reverse=True)
+	top_asks = sorted((float(p), float(s)) for p, s, *_ in asks)
+	for price, size in top_bids[:levels]:
+		checksum += level_hash('buy', price, size)
+	for price, size in top_asks[:levels]:
+		checksum += level_hash('sell', price, size)
+
+	return checksum & MASK
+
+
+class BookChecksum:
+
+	def __init__(self, levels=10, history=4096):
+		"""
+		Checksum of the top levels per side of OrderBookWebSocket's book,
+		kept up to date with a constant amount of hashing per change: the
+		changed level's old hash is taken out and its new one added, and
+		when a level enters or leaves the top levels the one it displaces
+		or makes room for is swapped the same way. The checksum after every
+		message is remembered with its receive time so a reference snapshot
+		taken at a slightly different moment can still be matched.
+
+		Parameters:
+			levels: int
+				Levels per side covered.
+			history: int
+				Checksums remembered.
+		"""
+
+		self.levels = levels
+		self.value = 0
+		# (time.monotonic(), checksum) after each message
+		self.history = collections.deque(maxlen=history)
+
+	def reset(self, ob_buys, ob_sells):
+		"""
+		Recomputes the checksum after the book was rebuilt from a snapshot.
+
+		Parameters:
+			ob_buys: numpy.ndarray
+				Bids sorted from lowest to highest price.
+			ob_sells: numpy.ndarray
+				Asks sorted from lowest to highest price.
+
+		Returns:
+			None
+		"""
+
+		checksum = 0
+		for price, size in ob_buys[::-1][:self.levels]:
+			checksum += level_hash('buy', price, size)
+		for price, size in ob_sells[:self.levels]:
+			checksum += level_hash('sell', price, size)
+		self.value = checksum & MASK
+
+	def find(self, book, side, price):
+		"""
+		Rank (0 is the best level) and size of the level at price.
+
+		Parameters:
+			book: numpy.ndarray
+				One side of the book, sorted from lowest to highest price.
+			side: string
+				'buy' or 'sell'.
+			price: float
+				Price of the level.
+
+		Returns:
+			rank: int or None
+				None if there is no level at price.
+			size: float or None
+		"""
+
+		index = book[:, 0].searchsorted(price)
+		if index == len(book) or book[index, 0] != price:
+			return None, None
+		if side == 'buy':
+			return len(book) - 1 - index, book[index, 1]
+
+		return index, book[index, 1]
+
+	def level_at(self, book, side, rank):
+		"""
+		Hash of the level at rank, 0 if there isn't one.
+
+		Parameters:
+			book: numpy.ndarray
+				One side of the book, sorted from lowest to highest price.
+			side: string
+				'buy' or 'sell'.
+			rank: int
+				0 is the best level.
+
+		Returns:
+			level_hash: int
+		"""
+
+		if rank >= len(book):
+			return 0
+		price, size = book[-1 - rank] if side == 'buy' else book[rank]
+
+		return level_hash(side, price, size)
+
+	def on_change(self, side, price, before, after):
+		"""
+		Updates the checksum after a single level changed.
+
+		Parameters:
+			side: string
+				'buy' or 'sell'.
+			price: float
+				Price of the level that changed.
+			before: numpy.ndarray
+				The side of the book before the change.
+			after: numpy.ndarray
+				The side of the book after the change.
+
+		Returns:
+			None
+		"""
+
+		old_rank, old_size = self.find(before, side, price)
+		new_rank, new_size = self.find(after, side, price)
+		was_top = old_rank is not None and old_rank < self.levels
+		is_top = new_rank is not None and new_rank < self.levels
+		if not was_top and not is_top:
+			return
+
+		checksum = self.value
+		if was_top:
+			checksum -= level_hash(side, price, old_size)
+		if is_top:
+			checksum += level_hash(side, price, new_size)
+		if was_top and not is_top:
+			# The next level moved up into the top levels
+			checksum += self.level_at(after, side, self.levels - 1)
+		elif is_top and not was_top:
+			# The last of the top levels was pushed out
+			checksum -= self.level_at(after, side, self.levels)
+		self.value = checksum & MASK
+
+	def record(self, receive_time):
+		"""
+		Remembers the checksum once a message has been applied.
+
+		Parameters:
+			receive_time: float
+				time.monotonic() at which the message arrived.
+
+		Returns:
+			None
+		"""
+
+		self.history.append((receive_time, self.value))
+
+	def seen(self, checksum, start, end):
+		"""
+		Whether the book had the given checksum at some point between start
+		and end.
+
+		Parameters:
+			checksum: int
+				Checksum to look for.
+			start, end: float
+				time.monotonic() bounds.
+
+		Returns:
+			seen: bool
+		"""
+
+		# Also true if the book hasn't changed since before start
+		last_before = None
+		for receive_time, value in list(self.history):
+			if receive_time < start:
+				last_before = value
+			elif receive_time <= end:
+				if value == checksum:
+					return True
+			else:
+				break
+
+		return last_before == checksum
+
+
+class BookVerifier:
+
+	def __init__(
+			self, orderbook_ws, fetch_snapshot, logger, interval=30.0, slack=.5,
+			confirmations=2, retry_interval=1.0):
+		"""
+		Checks from a background thread that the top levels of the book
+		match a reference snapshot, fetched with fetch_snapshot() (GDAX's
+		REST book, or the feed stand-in's). The reference's checksum is
+		looked for among the book's checksums around the time of the fetch,
+		so only a hash comparison is done and the websocket thread never
+		waits on it. The verifier never writes the book itself. If
+		confirmations checks in a row find no match the book is rebuilt
+		from the latest reference snapshot.
+
+		Parameters:
+			orderbook_ws: OrderBookWebSocket
+				Book to verify.
+			fetch_snapshot: function
+				Called with no arguments, returns a dict with 'bids' and
+				'asks' lists of [price, size, ...] entries.
+			logger: Log
+				Used to log messages as needed.
+			interval: float
+				Seconds between checks.
+			slack: float
+				Seconds the book may lag or lead the reference snapshot.
+			confirmations: int
+				Mismatches in a row that trigger a resync.
+			retry_interval: float
+				Seconds before checking again after a mismatch.
+		"""
+
+		self.orderbook_ws = orderbook_ws
+		self.checksum = orderbook_ws.book_checksum
+		self.fetch_snapshot = fetch_snapshot
+		self.logger = logger
+		self.interval = interval
+		self.slack = slack
+		self.confirmations = confirmations
+		self.retry_interval = retry_interval
+		self.stop_event = threading.Event()
+		# Stats, only written by the verifier thread
+		self.checks = 0
+		self.mismatches = 0
+		self.resyncs = 0
+		self.fetch_errors = 0
+		self.mismatches_in_row = 0
+		self.verifier_thread = threading.Thread(
+			target=self.run, name='book_verifier', daemon=True
+		)
+
+	def start(self):
+		"""
+		Launches the verifier thread.
+
+		Returns:
+			None
+		"""
+
+		self.verifier_thread.start()
+
+	def stop(self):
+		"""
+		Stops the verifier thread.
+
+		Returns:
+			None
+		"""
+
+		self.stop_event.set()
+
+	def run(self):
+		"""
+		Verifier loop.
+
+		Returns:
+			None
+		"""
+
+		delay = self.interval
+		while not self.stop_event.wait(delay):
+			if not self.orderbook_ws.ready.is_set():
+				delay = self.interval
+				continue
+			try:
+				delay = self.interval if self.check() else self.retry_interval
+			except Exception as error:
+				self.fetch_errors += 1
+				self.logger.add(f'Book verification failed: {error!r}')
+				delay = self.interval
+
+	def check(self):
+		"""
+		Fetches a reference snapshot and compares its checksum with the
+		book's, resyncing after enough mismatches in a row.
+
+		Returns:
+			matched: bool
+		"""
+
+		start = time.monotonic()
+		snapshot = self.fetch_snapshot()
+		end = time.monotonic()
+		reference = top_levels_hash(
+			snapshot['bids'], snapshot['asks'], self.checksum.levels
+		)
+		# Give the book time to catch up with the reference
+		self.stop_event.wait(self.slack)
+
+		self.checks += 1
+		if self.checksum.seen(reference, start - self.slack, end + self.slack):
+			self.mismatches_in_row = 0
+			return True
+
+		self.mismatches += 1
+		self.mismatches_in_row += 1
+		self.logger.add(
+			f'Book checksum mismatch {self.mismatches_in_row}/{self.confirmations}'
+		)
+		if self.mismatches_in_row >= self.confirmations:
+			self.resync(snapshot)
+			self.mismatches_in_row = 0
+
+		return False
+
+	def resync(self, snapshot):
+		"""
+		Hands a reference snapshot to the book, which rebuilds itself from
+		it through the same path as the websocket's own snapshot, on its
+		own thread, before its next message. Level2 changes carry absolute
+		sizes, so levels that change after the snapshot was taken are right
+		again as soon as their next change arrives.
+
+		Parameters:
+			snapshot: dict
+				Reference snapshot.
+
+		Returns:
+			None
+		"""
+
+		self.resyncs += 1
+		self.logger.add('Book drifted from the reference snapshot, resyncing')
+		self.orderbook_ws.pending_resync.append({
+			'type': 'snapshot',
+			'bids': [[float(p), float(s)] for p, s, *_ in snapshot['bids']],
+			'asks': [[float(p), float(s)] for p, s, *_ in snapshot['asks']],
+		})
+
+	def stats(self):
+		"""
+		Snapshot of the verifier's counters.
+
+		Returns:
+			out: dict
+		"""
+
+		return {
+			'checks': self.checks,
+			'mismatches': self.mismatches,
+			'resyncs': self.resyncs,
+			'fetch_errors': self.fetch_errors,
+		}
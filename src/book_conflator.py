@@ -0,0 +1,160 @@
+import collections
+import threading
+import time
+
+
+# The book as of one update. time is the time.monotonic() at which the
+# update arrived. ob_buys and ob_sells are the book's own arrays, which are
+# replaced rather than modified on every update, so they stay consistent
+# with the rest of the snapshot.
+BookSnapshot = collections.namedtuple(
+	'BookSnapshot', [
+		'version', 'time', 'best_buy_price', 'best_buy_size', 'best_sell_price',
+		'best_sell_size', 'recent_price', 'ob_buys', 'ob_sells'
+	]
+)
+
+
+class BookConflator:
+
+	def __init__(self):
+		"""
+		Conflating delivery of order book updates. The book writer publishes
+		a BookSnapshot on every update and only the latest one is kept.
+		Consumers read through a ConflatedReader, which hands them the latest
+		snapshot and how many updates they missed since their last read, so
+		a consumer that falls behind skips straight to the current book
+		instead of working through a backlog.
+
+		Totals across every reader are kept here:
+			published: int
+				Snapshots published.
+			reads: int
+				Snapshots handed to readers.
+			conflated: int
+				Updates readers never saw because a newer one replaced them
+				before they read.
+			age_total, age_max: float
+				Seconds between updates arriving and being read.
+		"""
+
+		self.book_cond = threading.Condition()
+		self.latest = None
+		self.published = 0
+		self.reads = 0
+		self.conflated = 0
+		self.age_total = 0.0
+		self.age_max = 0.0
+
+	def publish(self, book, receive_time):
+		"""
+		Replaces the latest snapshot and wakes readers. Called by the book
+		writer after every update.
+
+		Parameters:
+			book: OrderBookWebSocket or RingBook
+				Book to snapshot.
+			receive_time: float
+				time.monotonic() at which the update arrived.
+
+		Returns:
+			None
+		"""
+
+		with self.book_cond:
+			self.published += 1
+			self.latest = BookSnapshot(
+				self.published, receive_time, book.best_buy_price,
+				book.best_buy_size, book.best_sell_price, book.best_sell_size,
+				book.recent_price, book.ob_buys, book.ob_sells
+			)
+			self.book_cond.notify_all()
+
+	def subscribe(self):
+		"""
+		Creates a reader that starts out having seen every update published
+		so far.
+
+		Returns:
+			reader: ConflatedReader
+		"""
+
+		return ConflatedReader(self)
+
+	def stats(self):
+		"""
+		Summary of conflation across all readers.
+
+		Returns:
+			stats: dict
+		"""
+
+		with self.book_cond:
+			return {
+				'published': self.published,
+				'reads': self.reads,
+				'conflated': self.conflated,
+				'age_mean_us': self.age_total / max(self.reads, 1) * 1e6,
+				'age_max_us': self.age_max * 1e6,
+			}
+
+
+class ConflatedReader:
+
+	def __init__(self, conflator):
+		"""
+		One consumer's view of a BookConflator. Remembers the version of the
+		last snapshot it read, which is all the state a consumer needs.
+
+		Parameters:
+			conflator: BookConflator
+				Conflator to read from.
+		"""
+
+		self.conflator = conflator
+		self.last_version = conflator.published
+		self.reads = 0
+		self.conflated = 0
+
+	def changed(self):
+		"""
+		Whether the book has changed since the last read.
+
+		Returns:
+			changed: bool
+		"""
+
+		return self.conflator.published != self.last_version
+
+	def read(self, timeout=None):
+		"""
+		Waits until the book has changed since the last read, then returns
+		the latest snapshot.
+
+		Parameters:
+			timeout: float
+				Seconds to wait at most, None to wait indefinitely.
+
+		Returns:
+			book: BookSnapshot or None
+				None if the timeout passed without a change.
+		"""
+
+		conflator = self.conflator
+		with conflator.book_cond:
+			if not conflator.book_cond.wait_for(self.changed, timeout):
+				return None
+
+			book = conflator.latest
+			conflated = book.version - self.last_version - 1
+			self.last_version = book.version
+			self.reads += 1
+			self.conflated += conflated
+			age = time.monotonic() - book.time
+			conflator.reads += 1
+			conflator.conflated += conflated
+			conflator.age_total += age
+			if age > conflator.age_max:
+				conflator.age_max = age
+
+		return book
@@ -0,0 +1,114 @@
+import time
+
+import numpy as np
+
+
+class BookDepth:
+
+	def __init__(self, levels=10):
+		"""
+		Top levels of the book in a buffer that is allocated once and
+		written in place, for consumers that want depth without holding on
+		to ob_buys and ob_sells, which the book writer replaces on every
+		update. bids and asks are read-only views of the buffer, best level
+		first, one (price, size) row per level, and rows past the last level
+		are NaN.
+
+		Reads never copy and never lock, so the views can change while they
+		are being read. version works like a seqlock: the writer makes it
+		odd before writing and even again after, so a reader takes the
+		version with read(), uses the views, and checks valid() afterwards,
+		reading again if the book changed underneath it:
+
+			while True:
+				version, bids, asks = depth.read()
+				spread = asks[0, 0] - bids[0, 0]
+				if depth.valid(version):
+					break
+
+		Parameters:
+			levels: int
+				Levels per side kept.
+		"""
+
+		self.levels = levels
+		self.buffer = np.full((2, levels, 2), np.nan)
+		view = self.buffer.view()
+		view.flags.writeable = False
+		self.bids = view[0]
+		self.asks = view[1]
+		self.bid_levels = 0
+		self.ask_levels = 0
+		self.version = 0
+
+	def update(self, ob_buys, ob_sells):
+		"""
+		Copies the top levels of the book into the buffer. Only the book
+		writer calls this.
+
+		Parameters:
+			ob_buys: numpy.ndarray
+				Bids sorted from lowest to highest price.
+			ob_sells: numpy.ndarray
+				Asks sorted from lowest to highest price.
+
+		Returns:
+			None
+		"""
+
+		self.version += 1
+		top_bids = ob_buys[:-self.levels - 1:-1]
+		top_asks = ob_sells[:self.levels]
+		bids, asks = self.buffer
+		bids[:len(top_bids)] = top_bids
+		bids[len(top_bids):] = np.nan
+		asks[:len(top_asks)] = top_asks
+		asks[len(top_asks):] = np.nan
+		self.bid_levels = len(top_bids)
+		self.ask_levels = len(top_asks)
+		self.version += 1
+
+	def read(self, levels=None):
+		"""
+		Views of the top levels per side. Waits out a write in progress.
+
+		Parameters:
+			levels: int
+				Levels per side to view, all that are kept if None. Sides
+				with fewer levels get shorter views.
+
+		Returns:
+			version: int
+				Pass to valid() once done with the views.
+			bids: numpy.ndarray
+				Read-only (levels, 2) view, best bid first.
+			asks: numpy.ndarray
+				Read-only (levels, 2) view, best ask first.
+		"""
+
+		if levels is None:
+			levels = self.levels
+		while True:
+			version = self.version
+			if not version & 1:
+				break
+			# Let the writer finish
+			time.sleep(0)
+
+		return \
+			version, self.bids[:min(levels, self.bid_levels)], \
+			self.asks[:min(levels, self.ask_levels)]
+
+	def valid(self, version):
+		"""
+		Whether the views read at version still hold that version's book.
+
+		Parameters:
+			version: int
+				As returned by read().
+
+		Returns:
+			valid: bool
+		"""
+
+		return self.version == version
@@ -0,0 +1,232 @@
+import numpy as np
+
+
+class BookSignals:
+
+	def __init__(self, levels=10, distances=(.0005, .001, .0025)):
+		"""
+		Keeps signals computed over the top levels of the order book up to
+		date as the book changes. Each side's top levels and aggregates are
+		cached, so a change only recomputes the side it happened on, and a
+		change deeper than the top levels recomputes nothing at all.
+
+		Strategies read the results as plain attributes:
+			spread: float
+				Best ask minus best bid.
+			mid: float
+				Average of best bid and best ask.
+			microprice: float
+				Best bid and ask weighted by the size on the opposite side,
+				i.e. leaning towards the side that is more likely to trade
+				through.
+			imbalance: float
+				(bid depth - ask depth) / (bid depth + ask depth) over the
+				top levels, with level i weighted by 1 / i. Between -1 (all
+				asks) and 1 (all bids).
+			bid_depth, ask_depth: numpy.ndarray
+				Cumulative size within each of distances of the best price
+				on that side.
+
+		Parameters:
+			levels: int
+				Number of levels per side the signals are computed over.
+			distances: tuple
+				Fractional distances from the best price at which cumulative
+				depth is measured. e.g. .001 means within 0.1% of the best
+				price.
+		"""
+
+		self.levels = levels
+		self.distances = np.array(distances, dtype=np.float64)
+		self.weights = 1 / np.arange(1, levels + 1, dtype=np.float64)
+		# Top levels per side, most competitive first
+		self.bid_prices = np.zeros(0)
+		self.bid_sizes = np.zeros(0)
+		self.ask_prices = np.zeros(0)
+		self.ask_sizes = np.zeros(0)
+		# Per side aggregates, only recomputed when that side's top changes
+		self.bid_weighted_size = 0.0
+		self.ask_weighted_size = 0.0
+		self.bid_depth = np.zeros(len(distances))
+		self.ask_depth = np.zeros(len(distances))
+		# Signals combined from both sides
+		self.spread = 0.0
+		self.mid = 0.0
+		self.microprice = 0.0
+		self.imbalance = 0.0
+		self.updates = 0
+		self.skipped_updates = 0
+
+	def update_all(self, ob_buys, ob_sells):
+		"""
+		Recomputes everything, used when the whole book is rebuilt from a
+		snapshot.
+
+		Parameters:
+			ob_buys: numpy.ndarray
+				Bids sorted from lowest to highest price.
+			ob_sells: numpy.ndarray
+				Asks sorted from lowest to highest price.
+
+		Returns:
+			None
+		"""
+
+		self.refresh_bids(ob_buys)
+		self.refresh_asks(ob_sells)
+		self.combine()
+
+	def update_side(self, side, price, ob_buys, ob_sells):
+		"""
+		Updates signals after a single price level changed.
+
+		Parameters:
+			side: string
+				'buy' or 'sell'. Side of the book that changed.
+			price: float
+				Price of the level that changed.
+			ob_buys: numpy.ndarray
+				Bids sorted from lowest to highest price, after the change.
+			ob_sells: numpy.ndarray
+				Asks sorted from lowest to highest price, after the change.
+
+		Returns:
+			None
+		"""
+
+		if not self.touches_top(side, price):
+			self.skipped_updates += 1
+			return
+
+		if side == 'buy':
+			self.refresh_bids(ob_buys)
+		else:
+			self.refresh_asks(ob_sells)
+
+		self.combine()
+
+	def touches_top(self, side, price):
+		"""
+		Whether a change at price could alter the cached top levels. Changes
+		deeper than a full set of top levels can't.
+
+		Parameters:
+			side: string
+				'buy' or 'sell'. Side of the book that changed.
+			price: float
+				Price of the level that changed.
+
+		Returns:
+			touches: bool
+		"""
+
+		if side == 'buy':
+			return len(self.bid_prices) < self.levels or price >= self.bid_prices[-1]
+
+		return len(self.ask_prices) < self.levels or price <= self.ask_prices[-1]
+
+	def refresh_bids(self, ob_buys):
+		"""
+		Caches the top bid levels and recomputes bid side aggregates.
+
+		Parameters:
+			ob_buys: numpy.ndarray
+				Bids sorted from lowest to highest price.
+
+		Returns:
+			None
+		"""
+
+		top = ob_buys[:-self.levels - 1:-1]
+		self.bid_prices = top[:, 0].copy()
+		self.bid_sizes = top[:, 1].copy()
+		self.bid_weighted_size = self.weighted_size(self.bid_sizes)
+		if len(self.bid_prices):
+			# Bid prices are descending, search on their negation
+			cutoffs = -self.bid_prices[0] * (1 - self.distances)
+			self.bid_depth = self.depth_at(-self.bid_prices, self.bid_sizes, cutoffs)
+
+	def refresh_asks(self, ob_sells):
+		"""
+		Caches the top ask levels and recomputes ask side aggregates.
+
+		Parameters:
+			ob_sells: numpy.ndarray
+				Asks sorted from lowest to highest price.
+
+		Returns:
+			None
+		"""
+
+		top = ob_sells[:self.levels]
+		self.ask_prices = top[:, 0].copy()
+		self.ask_sizes = top[:, 1].copy()
+		self.ask_weighted_size = self.weighted_size(self.ask_sizes)
+		if len(self.ask_prices):
+			cutoffs = self.ask_prices[0] * (1 + self.distances)
+			self.ask_depth = self.depth_at(self.ask_prices, self.ask_sizes, cutoffs)
+
+	def weighted_size(self, sizes):
+		"""
+		Depth weighted size of one side's top levels.
+
+		Parameters:
+			sizes: numpy.ndarray
+				Sizes of the top levels, most competitive first.
+
+		Returns:
+			weighted_size: float
+				Sum of sizes with level i weighted by 1 / i.
+		"""
+
+		return float(np.dot(self.weights[:len(sizes)], sizes))
+
+	@staticmethod
+	def depth_at(prices, sizes, cutoffs):
+		"""
+		Cumulative size at or inside each cutoff price.
+
+		Parameters:
+			prices: numpy.ndarray
+				Ascending prices.
+			sizes: numpy.ndarray
+				Sizes matching prices.
+			cutoffs: numpy.ndarray
+				Ascending cutoff prices.
+
+		Returns:
+			depth: numpy.ndarray
+				Total size of levels priced at or below each cutoff.
+		"""
+
+		cum_sizes = np.concatenate(([0.0], np.cumsum(sizes)))
+
+		return cum_sizes[np.searchsorted(prices, cutoffs, side='right')]
+
+	def combine(self):
+		"""
+		Recomputes the signals that depend on both sides from the cached
+		per side values.
+
+		Returns:
+			None
+		"""
+
+		self.updates += 1
+		if not len(self.bid_prices) or not len(self.ask_prices):
+			return
+
+		best_bid = self.bid_prices[0]
+		best_ask = self.ask_prices[0]
+		best_bid_size = self.bid_sizes[0]
+		best_ask_size = self.ask_sizes[0]
+		self.spread = best_ask - best_bid
+		self.mid = (best_bid + best_ask) / 2
+		self.microprice = \
+			(best_bid * best_ask_size + best_ask * best_bid_size) \
+			/ (best_bid_size + best_ask_size)
+		total_weighted_size = self.bid_weighted_size + self.ask_weighted_size
+		if total_weighted_size:
+			self.imbalance = \
+				(self.bid_weighted_size - self.ask_weighted_size) \
+				/ total_weighted_size
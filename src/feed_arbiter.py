@@ -0,0 +1,474 @@
+import collections
+import json
+import threading
+import time
+
+import websocket
+
+
+class FeedArbiter:
+
+	def __init__(
+			self, book, urls, subscription, logger, stale_timeout=5.0,
+			max_lag=.25, lag_alpha=.05, max_seen=65536, max_pending=4096):
+		"""
+		Receives the market data feed over several independent websocket
+		connections and hands the book whichever copy of every update
+		arrives first, so a feed that stalls, lags or disconnects costs
+		nothing as long as another one is healthy.
+
+		Matches carry the exchange's sequence number and are arbitrated by
+		it. level2 updates don't have one, so they are identified by their
+		contents (time and changes) instead. Every connection receives the
+		same ordered stream, so the first arrivals are always in stream
+		order, except right after a connection subscribes: its stream starts
+		at its own snapshot, which isn't the one the book was built from. A
+		connection is only trusted once it is known to be in step with the
+		book, i.e. it delivers an update the book already has, or the book
+		receives an update the connection delivered earlier. In the latter
+		case the connection is ahead and the updates it delivered since are
+		applied at once.
+
+		A connection is dropped and reconnected when nothing, not even a
+		heartbeat, arrives on it for stale_timeout seconds, or when its
+		copies arrive on average more than max_lag seconds after the
+		winning copy. If every connection is down the book is marked not
+		ready until one of them is back with a fresh snapshot, so nothing
+		keeps trading on a stale book.
+
+		Parameters:
+			book: OrderBookWebSocket
+				Receives the winning messages through on_message(). Its ready
+				event is cleared when every feed is down.
+			urls: list
+				Websocket URL of every connection. The same URL may be used
+				more than once.
+			subscription: dict
+				Subscribe message sent on every connection. The heartbeat
+				channel is added to it.
+			logger: Log
+				Used to log messages as needed.
+			stale_timeout: float
+				Seconds without a message after which a connection is
+				considered dead.
+			max_lag: float
+				Seconds a connection's copies may arrive after the winning
+				copy, on average, before it is reconnected.
+			lag_alpha: float
+				Weight of the newest sample in each connection's average lag.
+			max_seen: int
+				Winning message ids remembered to recognise later copies by.
+			max_pending: int
+				Updates held back per connection while it isn't known to be
+				in step with the book.
+		"""
+
+		self.book = book
+		self.logger = logger
+		self.stale_timeout = stale_timeout
+		self.max_lag = max_lag
+		self.lag_alpha = lag_alpha
+		self.max_seen = max_seen
+		self.max_pending = max_pending
+		self.subscription = dict(subscription)
+		self.subscription['channels'] = list(subscription['channels']) + ['heartbeat']
+		self.arbiter_lock = threading.Lock()
+		# Message id -> time.monotonic() the winning copy arrived
+		self.seen = collections.OrderedDict()
+		self.last_match_seq = 0
+		self.snapshots_ignored = 0
+		self.feeds = [FeedConnection(self, i, url) for i, url in enumerate(urls)]
+
+	def start(self):
+		"""
+		Launches every connection's thread.
+
+		Returns:
+			None
+		"""
+
+		for feed in self.feeds:
+			feed.start()
+
+	def close(self):
+		"""
+		Disconnects every connection for good.
+
+		Returns:
+			None
+		"""
+
+		for feed in self.feeds:
+			feed.close()
+
+	def on_feed_connected(self, feed):
+		"""
+		Called by a connection once it has subscribed.
+
+		Parameters:
+			feed: FeedConnection
+				Connection that subscribed.
+
+		Returns:
+			None
+		"""
+
+		with self.arbiter_lock:
+			feed.connected = True
+			feed.in_step = False
+			feed.pending.clear()
+			feed.lag = 0.0
+			feed.connect_time = time.monotonic()
+		self.logger.add(f'{feed.name} connected to {feed.url}')
+
+	def on_feed_disconnected(self, feed, reason):
+		"""
+		Called by a connection when it has been dropped. Marks the book not
+		ready if no other connection is keeping it up to date.
+
+		Parameters:
+			feed: FeedConnection
+				Connection that was dropped.
+			reason: string
+				Why it was dropped.
+
+		Returns:
+			None
+		"""
+
+		with self.arbiter_lock:
+			feed.connected = False
+			feed.in_step = False
+			feed.pending.clear()
+			feed.reconnects += 1
+			feed.last_reason = reason
+			book_lost = not feed.stopped and self.book.ready.is_set() \
+				and not any(f.in_step for f in self.feeds)
+			if book_lost:
+				self.book.ready.clear()
+				# Connections that aren't in step yet already sent (and had
+				# ignored) their snapshots, reconnecting gets a fresh one
+				for other in self.feeds:
+					if other.connected:
+						other.drop('resubscribing for a new snapshot')
+		self.logger.add(f'{feed.name} dropped: {reason}')
+		if book_lost:
+			self.logger.add(
+				'Every market data feed is down, the book is not ready until one '
+				'reconnects'
+			)
+
+	def on_feed_message(self, feed, msg):
+		"""
+		Arbitrates a message from one of the connections. Called from the
+		connection's thread.
+
+		Parameters:
+			feed: FeedConnection
+				Connection the message arrived on.
+			msg: dict
+				Decoded message.
+
+		Returns:
+			keep: bool
+				False if the connection should be dropped and reconnected.
+		"""
+
+		receive_time = time.monotonic()
+		msg_type = msg.get('type')
+
+		with self.arbiter_lock:
+			feed.msgs_received += 1
+
+			if msg_type == 'l2update':
+				msg_id = (msg.get('time'), tuple(tuple(c) for c in msg.get('changes', ())))
+				first_time = self.seen.get(msg_id)
+				if first_time is not None:
+					# The book already has this update, so this connection is
+					# in step with it from here on
+					feed.in_step = True
+					feed.pending.clear()
+					self.record_copy(feed, receive_time - first_time)
+				elif feed.in_step:
+					self.apply(feed, msg_id, msg, receive_time)
+				else:
+					feed.pending[msg_id] = msg
+					if len(feed.pending) > self.max_pending:
+						feed.pending.popitem(last=False)
+
+			elif msg_type in ('match', 'last_match'):
+				seq = msg.get('sequence', 0)
+				if seq > self.last_match_seq:
+					self.last_match_seq = seq
+					self.remember(('match', seq), receive_time)
+					feed.wins += 1
+					self.record_lag(feed, 0.0)
+					self.book.on_message(msg)
+				else:
+					first_time = self.seen.get(('match', seq))
+					self.record_copy(feed, 0.0 if first_time is None else receive_time - first_time)
+
+			elif msg_type == 'snapshot':
+				if self.book.ready.is_set():
+					# The book is kept up to date by another connection
+					self.snapshots_ignored += 1
+				else:
+					self.seen.clear()
+					for other in self.feeds:
+						other.in_step = False
+						other.pending.clear()
+					feed.in_step = True
+					self.book.on_message(msg)
+
+			elif msg_type == 'error':
+				feed.drop_reason = f"error message: {msg.get('message')}"
+				return False
+
+			if feed.lag > self.max_lag:
+				feed.drop_reason = f'lagging the other feeds by {feed.lag * 1e3:.0f}ms'
+				return False
+			if not feed.in_step and self.book.ready.is_set() \
+					and receive_time - feed.connect_time > self.stale_timeout:
+				# Too far behind for any of its updates to still be remembered
+				feed.drop_reason = f'not in step with the book after {self.stale_timeout:g}s'
+				return False
+
+		return True
+
+	def apply(self, feed, msg_id, msg, receive_time):
+		"""
+		Hands a winning level2 update to the book. Connections that
+		delivered it earlier, while not yet in step, are ahead of the book:
+		the updates they delivered after it are applied too. Must hold
+		arbiter_lock.
+
+		Parameters:
+			feed: FeedConnection
+				Connection the update won on.
+			msg_id: tuple
+				Identifies the update.
+			msg: dict
+				The update.
+			receive_time: float
+				time.monotonic() at which it arrived.
+
+		Returns:
+			None
+		"""
+
+		self.remember(msg_id, receive_time)
+		feed.wins += 1
+		self.record_lag(feed, 0.0)
+		self.book.on_message(msg)
+
+		for other in self.feeds:
+			if other.in_step or msg_id not in other.pending:
+				continue
+			# Everything other delivered before msg_id the book already has,
+			# or predates the snapshot the book was built from
+			while other.pending.popitem(last=False)[0] != msg_id:
+				pass
+			other.in_step = True
+			ahead = list(other.pending.items())
+			other.pending.clear()
+			for ahead_id, ahead_msg in ahead:
+				if ahead_id not in self.seen:
+					self.apply(other, ahead_id, ahead_msg, receive_time)
+
+	def remember(self, msg_id, receive_time):
+		"""
+		Records when a message's winning copy arrived. Must hold
+		arbiter_lock.
+
+		Returns:
+			None
+		"""
+
+		self.seen[msg_id] = receive_time
+		if len(self.seen) > self.max_seen:
+			self.seen.popitem(last=False)
+
+	def record_copy(self, feed, lag):
+		"""
+		Records a losing copy of a message. Must hold arbiter_lock.
+
+		Parameters:
+			feed: FeedConnection
+				Connection the copy arrived on.
+			lag: float
+				Seconds after the winning copy it arrived.
+
+		Returns:
+			None
+		"""
+
+		feed.copies += 1
+		self.record_lag(feed, lag)
+
+	def record_lag(self, feed, lag):
+		"""
+		Updates a connection's average lag behind the winning copies. Must
+		hold arbiter_lock.
+
+		Returns:
+			None
+		"""
+
+		feed.lag += self.lag_alpha * (lag - feed.lag)
+		if lag > feed.max_lag:
+			feed.max_lag = lag
+
+	def stats(self):
+		"""
+		How often each connection won and how far behind it runs.
+
+		Returns:
+			stats: dict
+				Connection name -> stats.
+		"""
+
+		total_wins = max(sum(feed.wins for feed in self.feeds), 1)
+		return {
+			feed.name: {
+				'url': feed.url,
+				'connected': feed.connected,
+				'in_step': feed.in_step,
+				'wins': feed.wins,
+				'win_share': feed.wins / total_wins,
+				'copies': feed.copies,
+				'lag_ms': feed.lag * 1e3,
+				'max_lag_ms': feed.max_lag * 1e3,
+				'reconnects': feed.reconnects,
+				'last_drop_reason': feed.last_reason,
+			}
+			for feed in self.feeds
+		}
+
+
+class FeedConnection:
+
+	def __init__(self, arbiter, index, url, min_backoff=.1, max_backoff=5.0):
+		"""
+		One of a FeedArbiter's websocket connections. Its thread connects,
+		subscribes and passes every message to the arbiter, and reconnects
+		with exponential backoff whenever the connection is dropped.
+
+		Parameters:
+			arbiter: FeedArbiter
+				Arbiter the messages are passed to.
+			index: int
+				Position among the arbiter's connections.
+			url: string
+				Websocket URL to connect to.
+			min_backoff: float
+				Seconds before the first reconnection attempt.
+			max_backoff: float
+				Most seconds between reconnection attempts.
+		"""
+
+		self.arbiter = arbiter
+		self.name = f'websocket_{index}'
+		self.url = url
+		self.min_backoff = min_backoff
+		self.max_backoff = max_backoff
+		self.ws = None
+		self.stopped = False
+		self.connected = False
+		# Whether the book can take this connection's updates as they come
+		self.in_step = False
+		# Updates held back while not in step, id -> message
+		self.pending = collections.OrderedDict()
+		self.connect_time = 0.0
+		self.drop_reason = None
+		self.last_reason = None
+		# Stats, written under the arbiter's lock
+		self.msgs_received = 0
+		self.wins = 0
+		self.copies = 0
+		self.lag = 0.0
+		self.max_lag = 0.0
+		self.reconnects = 0
+		self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+
+	def start(self):
+		"""
+		Launches the connection's thread.
+
+		Returns:
+			None
+		"""
+
+		self.thread.start()
+
+	def close(self):
+		"""
+		Disconnects for good.
+
+		Returns:
+			None
+		"""
+
+		self.stopped = True
+		self.drop('closed')
+		self.thread.join()
+
+	def drop(self, reason):
+		"""
+		Drops the connection from another thread. The connection's thread
+		reconnects unless it has been closed.
+
+		Parameters:
+			reason: string
+				Why it was dropped.
+
+		Returns:
+			None
+		"""
+
+		self.drop_reason = reason
+		ws = self.ws
+		if ws is not None:
+			try:
+				ws.abort()
+			except Exception:
+				pass
+
+	def run(self):
+		"""
+		Connection thread.
+
+		Returns:
+			None
+		"""
+
+		backoff = self.min_backoff
+		while not self.stopped:
+			self.drop_reason = None
+			try:
+				self.ws = websocket.create_connection(
+					self.url, timeout=self.arbiter.stale_timeout
+				)
+				self.ws.send(json.dumps(self.arbiter.subscription))
+				self.arbiter.on_feed_connected(self)
+				backoff = self.min_backoff
+				while not self.stopped:
+					msg = json.loads(self.ws.recv())
+					if not self.arbiter.on_feed_message(self, msg):
+						break
+			except websocket.WebSocketTimeoutException:
+				self.drop_reason = self.drop_reason or \
+					f'nothing received for {self.arbiter.stale_timeout:g}s'
+			except Exception as e:
+				self.drop_reason = self.drop_reason or repr(e)
+
+			if self.ws is not None:
+				try:
+					self.ws.close(timeout=0)
+				except Exception:
+					pass
+				self.ws = None
+			if self.connected:
+				self.arbiter.on_feed_disconnected(self, self.drop_reason or 'closed')
+			if not self.stopped:
+				time.sleep(backoff)
+				backoff = min(backoff * 2, self.max_backoff)
@@ -0,0 +1,750 @@
+import argparse
+import base64
+import datetime as dt
+import hashlib
+import json
+import math
+import queue
+import random
+import socketserver
+import struct
+import threading
+import time
+
+from .backtest import SIDE_NAMES, ReplayData
+from .tick_store import TickStore
+
+
+# Appended to Sec-WebSocket-Key to compute Sec-WebSocket-Accept (RFC 6455)
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+class FeedSimulator:
+
+	def __init__(
+			self, ports=(8765, 8766), delays=(0.0, 0.0), host='127.0.0.1',
+			rate=100, product='BTC-USD', start_price=10000.0, levels=50,
+			seed=None, max_changes=1, burst_interval=0.0, burst_size=0,
+			snapshot_interval=0.0):
+		"""
+		Local stand-ins for the GDAX websocket feed so OrderBookWebSocket and
+		FeedArbiter can be exercised without touching the exchange. Every
+		port serves the same synthetic level2, matches and heartbeat stream,
+		generated once and copied to every connection, so the copies are
+		identical apart from when they arrive. Each port has its own injected
+		delay, and stall() and disconnect() make a port lag or die on demand.
+		The stream is a random walk unless replay() loads recorded data.
+
+		Parameters:
+			ports: tuple
+				Ports to listen on, one stand-in per port.
+			delays: tuple
+				Seconds every message is held back on the matching port.
+			host: string
+				Address to listen on.
+			rate: float
+				Book changes per second.
+			product: string
+				Product id the messages are for.
+			start_price: float
+				Mid price the synthetic book starts around.
+			levels: int
+				Price levels per side.
+			seed: int
+				Seeds the random walk, for repeatable runs.
+			max_changes: int
+				Most changes per l2update, each carries between 1 and this
+				many.
+			burst_interval: float
+				Seconds between bursts of burst_size changes sent all at once,
+				0 for no bursts.
+			burst_size: int
+				Changes per burst.
+			snapshot_interval: float
+				Seconds between fresh snapshots sent to every level2
+				subscriber, 0 to only send one on subscribing.
+		"""
+
+		self.product = product
+		# Read on every step, so it can be changed while running
+		self.rate = rate
+		self.levels = levels
+		self.max_changes = max_changes
+		self.burst_interval = burst_interval
+		self.burst_size = burst_size
+		self.snapshot_interval = snapshot_interval
+		self.random = random.Random(seed)
+		self.servers = []
+		for port, delay in zip(ports, delays):
+			server = FeedServer((host, port), FeedHandler)
+			server.simulator = self
+			server.delay = delay
+			server.stall_until = 0.0
+			self.servers.append(server)
+
+		# Synthetic book, price -> size, and the stream's counters
+		self.source_lock = threading.Lock()
+		self.mid = start_price
+		self.tick = .01
+		self.bids = {}
+		self.asks = {}
+		for i in range(1, levels + 1):
+			self.bids[round(start_price - i * self.tick, 2)] = self.random_size()
+			self.asks[round(start_price + i * self.tick, 2)] = self.random_size()
+		self.sequence = 0
+		self.trade_id = 0
+		# Connections subscribed to the stream
+		self.clients = []
+		self.running = False
+		# Recorded market data the stream replays instead, set by replay()
+		self.replay_data = None
+		self.replay_events = None
+		# Called with (side, price, size, time.monotonic()) for every level2
+		# change as it is generated
+		self.on_change = None
+
+	def random_size(self):
+		"""
+		Returns:
+			size: float
+				Random level size.
+		"""
+
+		return round(self.random.uniform(.01, 5), 8)
+
+	def start(self):
+		"""
+		Starts every stand-in and the thread that generates the stream.
+
+		Returns:
+			None
+		"""
+
+		self.running = True
+		for server in self.servers:
+			threading.Thread(
+				target=server.serve_forever, name='feed_simulator', daemon=True
+			).start()
+		threading.Thread(target=self.run, name='feed_source', daemon=True).start()
+
+	def close(self):
+		"""
+		Stops generating and shuts every stand-in down.
+
+		Returns:
+			None
+		"""
+
+		self.running = False
+		for server in self.servers:
+			server.shutdown()
+			server.server_close()
+		for client in list(self.clients):
+			client.close()
+
+	def stall(self, index, seconds):
+		"""
+		Holds back everything sent on one stand-in for a while, then lets it
+		all through at once, like a feed falling behind.
+
+		Parameters:
+			index: int
+				Stand-in to stall, by position in ports.
+			seconds: float
+				How long to stall for.
+
+		Returns:
+			None
+		"""
+
+		self.servers[index].stall_until = time.monotonic() + seconds
+
+	def disconnect(self, index):
+		"""
+		Drops every connection to one stand-in, like a dead feed.
+
+		Parameters:
+			index: int
+				Stand-in whose connections are dropped, by position in ports.
+
+		Returns:
+			None
+		"""
+
+		server = self.servers[index]
+		for client in list(self.clients):
+			if client.server is server:
+				client.close()
+
+	def subscribe(self, client, channels):
+		"""
+		Adds a connection to the stream. The snapshot is taken under
+		source_lock so the connection's updates carry on exactly from it.
+
+		Parameters:
+			client: FeedHandler
+				Connection that subscribed.
+			channels: list
+				Channels it subscribed to.
+
+		Returns:
+			None
+		"""
+
+		with self.source_lock:
+			client.send_msg({
+				'type': 'subscriptions',
+				'channels': [{'name': c, 'product_ids': [self.product]} for c in channels],
+			})
+			if 'level2' in channels:
+				client.send_msg(self.snapshot_msg())
+			if 'matches' in channels and self.trade_id:
+				client.send_msg(self.match_msg('last_match', 'buy', self.mid, .01))
+			self.clients.append(client)
+
+	def unsubscribe(self, client):
+		"""
+		Removes a connection from the stream.
+
+		Parameters:
+			client: FeedHandler
+				Connection that went away.
+
+		Returns:
+			None
+		"""
+
+		with self.source_lock:
+			if client in self.clients:
+				self.clients.remove(client)
+
+	def snapshot_msg(self):
+		"""
+		Builds a snapshot message of the synthetic book. Must hold
+		source_lock.
+
+		Returns:
+			msg: dict
+		"""
+
+		return {
+			'type': 'snapshot',
+			'product_id': self.product,
+			'bids': [
+				[f'{p:.2f}', f'{s:.8f}'] for p, s in sorted(self.bids.items(), reverse=True)
+			],
+			'asks': [[f'{p:.2f}', f'{s:.8f}'] for p, s in sorted(self.asks.items())],
+		}
+
+	def book_snapshot(self):
+		"""
+		Snapshot of the synthetic book as it is right now, the stand-in for
+		GDAX's REST book that a BookVerifier checks against.
+
+		Returns:
+			msg: dict
+		"""
+
+		with self.source_lock:
+			return self.snapshot_msg()
+
+	def match_msg(self, msg_type, side, price, size):
+		"""
+		Builds a match message. Must hold source_lock.
+
+		Returns:
+			msg: dict
+		"""
+
+		return {
+			'type': msg_type,
+			'trade_id': self.trade_id,
+			'sequence': self.sequence,
+			'maker_order_id': '',
+			'taker_order_id': '',
+			'time': utc_time_str(),
+			'product_id': self.product,
+			'size': f'{size:.8f}',
+			'price': f'{price:.2f}',
+			'side': side,
+		}
+
+	def replay(self, root, start=None, end=None, levels=10):
+		"""
+		Replaces the random walk with level2 changes and trades recorded by
+		a TickRecorder. The book starts from the first depth snapshot in the
+		range, and the replay loops back to it, with a fresh snapshot, once
+		it reaches the end. rate still sets the pace.
+
+		Parameters:
+			root: string
+				Directory of the TickStore.
+			start, end: datetime.datetime
+				UTC time range to replay, everything recorded for the product
+				by default.
+			levels: int
+				Levels per side the depth snapshots were recorded with.
+
+		Returns:
+			None
+		"""
+
+		first, last = TickStore(root, levels).span(self.product)
+		if first is None:
+			raise ValueError(f'Nothing recorded for {self.product} in {root}')
+
+		with self.source_lock:
+			self.replay_data = ReplayData(
+				root, self.product, start or first, end or last, levels
+			)
+			self.restart_replay()
+
+	def restart_replay(self):
+		"""
+		Resets the book to the replay's first depth snapshot and starts its
+		events over. Must hold source_lock.
+
+		Returns:
+			None
+		"""
+
+		depth = self.replay_data.depth
+		self.bids = {}
+		self.asks = {}
+		if len(depth['time_ns']):
+			for book, prices, sizes in (
+					(self.bids, depth['bid_prices'][0], depth['bid_sizes'][0]),
+					(self.asks, depth['ask_prices'][0], depth['ask_sizes'][0])):
+				for price, size in zip(prices.tolist(), sizes.tolist()):
+					if size:
+						book[price] = size
+		self.replay_events = self.replay_data.events()
+
+	def replay_step(self):
+		"""
+		step() for a replay: the next recorded change or trade. Must hold
+		source_lock.
+
+		Returns:
+			msgs: list
+				(channel, message) pairs.
+		"""
+
+		event = next(self.replay_events, None)
+		if event is None:
+			self.restart_replay()
+			return [('level2', self.snapshot_msg())]
+
+		_, is_trade, side, price, size = event
+		side = SIDE_NAMES.get(side)
+		self.sequence += 1
+		if is_trade:
+			self.trade_id += 1
+			return [('matches', self.match_msg('match', side, price, size))]
+
+		book = self.bids if side == 'buy' else self.asks
+		if size:
+			book[price] = size
+		else:
+			book.pop(price, None)
+
+		return [('level2', self.l2update(side, price, size))]
+
+	def step(self):
+		"""
+		Moves the synthetic market on by one change, occasionally with a
+		trade, and returns the messages describing it. Must hold
+		source_lock.
+
+		Returns:
+			msgs: list
+				(channel, message) pairs.
+		"""
+
+		if self.replay_data is not None:
+			return self.replay_step()
+
+		msgs = []
+		self.sequence += 1
+		if self.random.random() < .1:
+			# A trade at the touch, which moves the mid by a tick
+			side = self.random.choice(('buy', 'sell'))
+			book = self.bids if side == 'buy' else self.asks
+			price = max(book) if side == 'buy' else min(book)
+			self.trade_id += 1
+			msgs.append(('matches', self.match_msg('match', side, price, book[price])))
+			del book[price]
+			msgs.append(('level2', self.l2update(side, price, 0.0)))
+			self.mid += -self.tick if side == 'buy' else self.tick
+			other = self.asks if side == 'buy' else self.bids
+			new_price = round(self.mid + (self.tick if side == 'buy' else -self.tick), 2)
+			crosses = new_price <= max(self.bids) if side == 'buy' else new_price >= min(self.asks)
+			if new_price not in other and not crosses:
+				other[new_price] = self.random_size()
+				msgs.append((
+					'level2',
+					self.l2update('sell' if side == 'buy' else 'buy', new_price, other[new_price])
+				))
+		else:
+			side = self.random.choice(('buy', 'sell'))
+			book = self.bids if side == 'buy' else self.asks
+			offset = self.random.randint(1, self.levels) * self.tick
+			price = round(self.mid - offset if side == 'buy' else self.mid + offset, 2)
+			if (side == 'buy' and self.asks and price >= min(self.asks)) or \
+					(side == 'sell' and self.bids and price <= max(self.bids)):
+				# Would cross the book
+				return msgs
+			size = 0.0 if price in book and self.random.random() < .2 else self.random_size()
+			if size:
+				book[price] = size
+			else:
+				del book[price]
+			msgs.append(('level2', self.l2update(side, price, size)))
+
+		# Keep each side near levels deep
+		for book, worst in ((self.bids, min), (self.asks, max)):
+			while len(book) > self.levels:
+				price = worst(book)
+				del book[price]
+				side = 'buy' if book is self.bids else 'sell'
+				msgs.append(('level2', self.l2update(side, price, 0.0)))
+
+		return msgs
+
+	def l2update(self, side, price, size):
+		"""
+		Builds a level2 update message and reports the change to on_change.
+
+		Returns:
+			msg: dict
+		"""
+
+		if self.on_change is not None:
+			self.on_change(side, price, size, time.monotonic())
+
+		return {
+			'type': 'l2update',
+			'product_id': self.product,
+			'time': utc_time_str(),
+			'changes': [[side, f'{price:.2f}', f'{size:.8f}']],
+		}
+
+	def generate(self, steps):
+		"""
+		Runs step() a number of times and puts all the level2 changes that
+		come out into a single l2update. Must hold source_lock.
+
+		Parameters:
+			steps: int
+				Times to step the market.
+
+		Returns:
+			msgs: list
+				(channel, message) pairs.
+		"""
+
+		msgs = []
+		update = None
+		for _ in range(steps):
+			for channel, msg in self.step():
+				if msg['type'] != 'l2update':
+					msgs.append((channel, msg))
+				elif update is None:
+					update = msg
+					msgs.append((channel, msg))
+				else:
+					update['changes'].extend(msg['changes'])
+
+		return msgs
+
+	def send(self, msgs):
+		"""
+		Hands each message, serialized once, to every connection subscribed
+		to its channel. Must hold source_lock.
+
+		Parameters:
+			msgs: list
+				(channel, message) pairs.
+
+		Returns:
+			None
+		"""
+
+		for channel, msg in msgs:
+			data = json.dumps(msg)
+			for client in self.clients:
+				if channel in client.channels:
+					client.enqueue(data)
+
+	def run(self):
+		"""
+		Generator thread. Produces rate changes per second in l2updates of
+		up to max_changes changes each, plus any bursts and periodic
+		snapshots, and a heartbeat per connection every second.
+
+		Returns:
+			None
+		"""
+
+		next_time = time.monotonic()
+		next_heartbeat = next_time + 1
+		next_burst = next_time + self.burst_interval if self.burst_interval else math.inf
+		next_snapshot = next_time + self.snapshot_interval if self.snapshot_interval else math.inf
+		while self.running:
+			now = time.monotonic()
+			steps = self.random.randint(1, self.max_changes)
+			with self.source_lock:
+				self.send(self.generate(steps))
+				if now >= next_burst:
+					next_burst = now + self.burst_interval
+					for _ in range(0, self.burst_size, self.max_changes):
+						self.send(self.generate(self.max_changes))
+				if now >= next_snapshot:
+					next_snapshot = now + self.snapshot_interval
+					self.send([('level2', self.snapshot_msg())])
+				if now >= next_heartbeat:
+					next_heartbeat += 1
+					self.send([('heartbeat', {
+						'type': 'heartbeat',
+						'sequence': self.sequence,
+						'last_trade_id': self.trade_id,
+						'product_id': self.product,
+						'time': utc_time_str(),
+					})])
+
+			next_time += steps / self.rate
+			sleep_time = next_time - time.monotonic()
+			if sleep_time > 0:
+				time.sleep(sleep_time)
+			elif sleep_time < -1:
+				# Can't keep up, don't try to make up for it later
+				next_time = time.monotonic()
+
+
+class FeedServer(socketserver.ThreadingTCPServer):
+
+	allow_reuse_address = True
+	daemon_threads = True
+
+
+class FeedHandler(socketserver.BaseRequestHandler):
+
+	def setup(self):
+		"""
+		Per-connection state.
+
+		Returns:
+			None
+		"""
+
+		self.simulator = self.server.simulator
+		self.channels = ()
+		# (due time, text) waiting to be sent
+		self.outbox = queue.Queue()
+		self.closed = False
+
+	def handle(self):
+		"""
+		Performs the websocket handshake, waits for the subscribe message
+		and then sends the stream until the connection goes away.
+
+		Returns:
+			None
+		"""
+
+		if not self.handshake():
+			return
+		subscribe = json.loads(self.recv_frame())
+		self.channels = [
+			c if isinstance(c, str) else c['name'] for c in subscribe.get('channels', [])
+		]
+		self.simulator.subscribe(self, self.channels)
+		try:
+			while not self.closed:
+				try:
+					due_time, data = self.outbox.get(timeout=.5)
+				except queue.Empty:
+					continue
+				# A stall holds everything back until it ends
+				wait = max(due_time, self.server.stall_until) - time.monotonic()
+				if wait > 0:
+					time.sleep(wait)
+				self.send_frame(data)
+		except OSError:
+			pass
+		finally:
+			self.simulator.unsubscribe(self)
+
+	def enqueue(self, data):
+		"""
+		Queues a message to be sent after the stand-in's delay.
+
+		Parameters:
+			data: string
+				Serialized message.
+
+		Returns:
+			None
+		"""
+
+		self.outbox.put((time.monotonic() + self.server.delay, data))
+
+	def send_msg(self, msg):
+		"""
+		Queues a message dict.
+
+		Returns:
+			None
+		"""
+
+		self.enqueue(json.dumps(msg))
+
+	def close(self):
+		"""
+		Drops the connection.
+
+		Returns:
+			None
+		"""
+
+		self.closed = True
+		try:
+			self.request.close()
+		except OSError:
+			pass
+
+	def handshake(self):
+		"""
+		Answers the HTTP upgrade request.
+
+		Returns:
+			upgraded: bool
+		"""
+
+		request = b''
+		while b'\r\n\r\n' not in request:
+			data = self.request.recv(4096)
+			if not data:
+				return False
+			request += data
+
+		key = ''
+		for line in request.decode('latin-1').split('\r\n'):
+			name, _, value = line.partition(':')
+			if name.strip().lower() == 'sec-websocket-key':
+				key = value.strip()
+		accept = base64.b64encode(
+			hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()
+		).decode()
+		self.request.sendall((
+			'HTTP/1.1 101 Switching Protocols\r\n'
+			'Upgrade: websocket\r\n'
+			'Connection: Upgrade\r\n'
+			f'Sec-WebSocket-Accept: {accept}\r\n\r\n'
+		).encode())
+
+		return True
+
+	def recv_exact(self, n):
+		"""
+		Returns:
+			data: bytes
+				Exactly n bytes read off the connection.
+		"""
+
+		data = b''
+		while len(data) < n:
+			chunk = self.request.recv(n - len(data))
+			if not chunk:
+				raise ConnectionError('Connection closed')
+			data += chunk
+
+		return data
+
+	def recv_frame(self):
+		"""
+		Reads one (masked, unfragmented) frame from the client.
+
+		Returns:
+			payload: string
+		"""
+
+		first, second = self.recv_exact(2)
+		length = second & 0x7f
+		if length == 126:
+			length, = struct.unpack('>H', self.recv_exact(2))
+		elif length == 127:
+			length, = struct.unpack('>Q', self.recv_exact(8))
+		mask = self.recv_exact(4) if second & 0x80 else b'\x00' * 4
+		payload = self.recv_exact(length)
+
+		return bytes(b ^ mask[i % 4] for i, b in enumerate(payload)).decode()
+
+	def send_frame(self, data):
+		"""
+		Sends one unmasked text frame.
+
+		Parameters:
+			data: string
+				Payload.
+
+		Returns:
+			None
+		"""
+
+		payload = data.encode()
+		length = len(payload)
+		if length < 126:
+			header = struct.pack('>BB', 0x81, length)
+		elif length < 1 << 16:
+			header = struct.pack('>BBH', 0x81, 126, length)
+		else:
+			header = struct.pack('>BBQ', 0x81, 127, length)
+		self.request.sendall(header + payload)
+
+
+def utc_time_str():
+	"""
+	Returns:
+		time_str: string
+			Current time formatted like GDAX feed timestamps.
+	"""
+
+	return dt.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(
+		description='Local stand-ins for the GDAX websocket feed.'
+	)
+	parser.add_argument('--ports', type=int, nargs='+', default=[8765, 8766])
+	parser.add_argument(
+		'--delays', type=float, nargs='+', default=[0.0, 0.0],
+		help='Seconds each port holds messages back for'
+	)
+	parser.add_argument('--rate', type=float, default=100, help='Changes per second')
+	parser.add_argument(
+		'--max-changes', type=int, default=1, help='Most changes per l2update'
+	)
+	parser.add_argument(
+		'--burst-interval', type=float, default=0,
+		help='Seconds between bursts, 0 for none'
+	)
+	parser.add_argument('--burst-size', type=int, default=0, help='Changes per burst')
+	parser.add_argument(
+		'--snapshot-interval', type=float, default=0,
+		help='Seconds between fresh snapshots, 0 to only send one on subscribing'
+	)
+	parser.add_argument('--replay', help='tick_store_path to replay instead of a random walk')
+	args = parser.parse_args()
+
+	simulator = FeedSimulator(
+		args.ports, args.delays, rate=args.rate, max_changes=args.max_changes,
+		burst_interval=args.burst_interval, burst_size=args.burst_size,
+		snapshot_interval=args.snapshot_interval
+	)
+	if args.replay:
+		simulator.replay(args.replay)
+	simulator.start()
+	while True:
+		time.sleep(1)
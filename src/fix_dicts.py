@@ -0,0 +1,61 @@
+import glob
+import json
+import os
+import pickle
+
+
+FIX_MSGS_DIR = os.path.join(
+	os.path.dirname(os.path.abspath(__file__)), os.pardir, 'fix_msgs'
+)
+CACHE_PATH = os.path.join(FIX_MSGS_DIR, 'fix_dicts.pickle')
+
+
+def load_fix_dicts():
+	"""
+	Loads every dict in fix_msgs, keyed by file name without extension
+	(e.g. 'msg_type_35'). The JSON files are compiled into a single pickle
+	next to them the first time and the pickle is loaded on later startups,
+	until any of the JSON files changes.
+
+	Paths are resolved relative to this file, so it doesn't matter which
+	directory the bot is launched from.
+
+	Returns:
+		fix_dicts: dict
+			File name -> dict of FIX tag or value meanings.
+	"""
+
+	json_paths = glob.glob(os.path.join(FIX_MSGS_DIR, '*.json'))
+	try:
+		if os.path.getmtime(CACHE_PATH) >= max(map(os.path.getmtime, json_paths)):
+			with open(CACHE_PATH, 'rb') as f:
+				return pickle.load(f)
+	except (OSError, pickle.UnpicklingError, EOFError):
+		pass
+
+	fix_dicts = {}
+	for json_path in json_paths:
+		with open(json_path) as f:
+			fix_dicts[os.path.basename(json_path)[:-len('.json')]] = json.load(f)
+
+	# Written aside and renamed so another process never reads half a cache
+	tmp_path = f'{CACHE_PATH}.{os.getpid()}'
+	try:
+		with open(tmp_path, 'wb') as f:
+			pickle.dump(fix_dicts, f, pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp_path, CACHE_PATH)
+	except OSError:
+		# Read only install, the JSON files will be read every startup
+		pass
+
+	return fix_dicts
+
+
+# Loaded once per process, on first import
+FIX_DICTS = load_fix_dicts()
+
+# Tag -> dict translating that tag's values, used when parsing replies
+VALUE_DICTS = {
+	name.rsplit('_', 1)[1]: values for name, values in FIX_DICTS.items()
+	if name != 'fix_tag_field_pairs'
+}
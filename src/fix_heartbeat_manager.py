@@ -1,20 +1,112 @@
-import time
-
-
-def fix_heartbeat_manager(fix_trader):
-	"""
-	Simple function that sends a heartbeat message to GDAX if no message has
-	been sent recently. This is necessary because GDAX requires some sort of
-	message at least once every 30 seconds or else it closes the FIX connection.
-
-	Parameters:
-		fix_trader: FIXTrader
-			Used to send heartbeat requests.
-
-	Returns:
-		None
-	"""
-	while True:
-		if (time.time() - fix_trader.last_send_msg_time) > 20:
-			fix_trader.request('heartbeat')
-		time.sleep(1)
+import uuid
+
+
+class FIXHeartbeatManager:
+
+	def __init__(self, session, scheduler, heartbeat_interval=30):
+		"""
+		Keeps the FIX session alive and notices when it has died, entirely
+		with timers on the scheduler:
+			- GDAX closes the connection if we send nothing for
+			  heartbeat_interval seconds, so a heartbeat timer is pushed back
+			  every time anything is sent and only fires when we've been
+			  quiet for two thirds of the interval.
+			- If GDAX sends nothing for longer than heartbeat_interval plus
+			  some slack, a Test Request is sent. If that goes unanswered
+			  for another interval the session is presumed dead.
+			- Test Requests from GDAX are answered with a Heartbeat.
+
+		Parameters:
+			session: FIXSession
+				Session kept alive, used to send heartbeats and test
+				requests.
+			scheduler: TimerWheel
+				Owns the timers.
+			heartbeat_interval: int
+				HeartBtInt (108) sent at logon, in seconds.
+		"""
+
+		self.session = session
+		self.logger = session.logger
+		self.scheduler = scheduler
+		self.heartbeat_interval = heartbeat_interval
+		self.send_delay = heartbeat_interval * 2 / 3
+		self.receive_delay = heartbeat_interval * 1.2
+		self.test_req_id = None
+		self.session_alive = True
+		self.send_timer = scheduler.schedule(self.send_delay, self.send_heartbeat)
+		self.receive_timer = scheduler.schedule(
+			self.receive_delay, self.on_receive_timeout
+		)
+
+	def on_send(self):
+		"""
+		Called after every batch written to the FIX socket. Pushes the next
+		heartbeat back.
+
+		Returns:
+			None
+		"""
+
+		self.scheduler.reschedule(self.send_timer, self.send_delay)
+
+	def on_receive(self):
+		"""
+		Called whenever anything is read off the FIX socket. Pushes the
+		inbound silence timeout back.
+
+		Returns:
+			None
+		"""
+
+		self.test_req_id = None
+		self.session_alive = True
+		self.scheduler.reschedule(self.receive_timer, self.receive_delay)
+
+	def on_test_request(self, test_req_id):
+		"""
+		Answers a Test Request from GDAX.
+
+		Parameters:
+			test_req_id: string
+				TestReqID (112) of the Test Request, echoed in the Heartbeat.
+
+		Returns:
+			None
+		"""
+
+		self.session.request('heartbeat', test_req_id=test_req_id)
+
+	def send_heartbeat(self):
+		"""
+		Timer callback, fires when nothing has been sent for send_delay
+		seconds.
+
+		Returns:
+			None
+		"""
+
+		# Sending reschedules send_timer through on_send()
+		self.session.request('heartbeat')
+
+	def on_receive_timeout(self):
+		"""
+		Timer callback, fires when GDAX has been silent for too long. The
+		first time, asks GDAX to prove it's there with a Test Request; if
+		that goes unanswered, flags the session as dead.
+
+		Returns:
+			None
+		"""
+
+		if self.test_req_id is None:
+			self.test_req_id = str(uuid.uuid4())
+			self.logger.add('No FIX messages received recently, sending Test Request')
+			self.session.request('test_request', test_req_id=self.test_req_id)
+			self.scheduler.reschedule(self.receive_timer, self.heartbeat_interval)
+		else:
+			self.session_alive = False
+			self.logger.add(
+				f'Test Request went unanswered, FIX session {self.session.index} '
+				'presumed dead'
+			)
@@ -0,0 +1,249 @@
+import socket
+import threading
+
+from .fix_heartbeat_manager import FIXHeartbeatManager
+from .fix_writer import FIXWriter
+
+
+class FIXSession:
+
+	def __init__(
+			self, fix_trader, index, scheduler, journal=None, first_seq_num=0,
+			last_inbound_seq=0, rate_limit=None, address=('127.0.0.1', 4197)):
+		"""
+		One logged on FIX connection to GDAX. Each session has its own
+		socket, writer thread, sequence numbers, rate limit and heartbeats,
+		so FIXTrader can spread orders over several of them. Messages built
+		for any session come from fix_trader, and Execution Reports read off
+		any session land in fix_trader's one OrderTracker.
+
+		Parameters:
+			fix_trader: FIXTrader
+				Builds and parses messages, and is told when the session
+				has logged on.
+			index: int
+				Position in fix_trader.sessions, used to name the session's
+				threads and label its metrics.
+			scheduler: TimerWheel
+				Owns the session's heartbeat timers.
+			journal: SessionJournal
+				If given, the session's sequence numbers are journaled.
+			first_seq_num: int
+				MsgSeqNum of the first message sent.
+			last_inbound_seq: int
+				MsgSeqNum last received, so the next one expected is one more.
+			rate_limit: dict
+				rate, burst, priority_reserve and max_order_wait for the
+				session's FIXWriter. Unlimited if not given.
+			address: tuple
+				(host, port) to connect to.
+		"""
+
+		self.fix_trader = fix_trader
+		self.index = index
+		self.name = 'fix_writer' if index == 0 else f'fix_writer_{index}'
+		self.logger = fix_trader.logger
+		self.journal = journal
+		self.expected_inbound_seq = last_inbound_seq + 1
+		# Set by reply_manager when GDAX answers the Logon
+		self.logged_on = threading.Event()
+		# Orders routed to this session that haven't closed yet, used to
+		# balance load between sessions
+		self.live_orders = 0
+		self.live_orders_lock = threading.Lock()
+		self.fix_socket = self.create_fix_socket(address)
+		# All writes to fix_socket go through fix_writer's thread
+		self.fix_writer = FIXWriter(
+			self.fix_socket, fix_trader.build_msg, fix_trader.analyze_fix_msg,
+			self.logger, first_seq_num=first_seq_num, name=self.name,
+			**(rate_limit or {})
+		)
+		self.heartbeat_manager = FIXHeartbeatManager(self, scheduler)
+		self.fix_writer.on_sent = self.on_sent
+		self.fix_writer.on_dropped = fix_trader.on_dropped
+
+	def __repr__(self):
+		"""
+		Pretty print of the session's state.
+
+		Returns:
+			string
+				Formatted information about this session.
+		"""
+		return \
+			f'FIXSession {self.index}: logged_on: {self.logged_on.is_set()}, ' \
+			f'live_orders: {self.live_orders}, pending: {len(self.fix_writer.pending)}'
+
+	def start(self):
+		"""
+		Launches the writer thread and logs on.
+
+		Returns:
+			None
+		"""
+
+		self.fix_writer.start()
+		self.request('logon')
+
+	def close(self):
+		"""
+		Stops the writer thread and shuts the socket down, which ends the
+		session's reply_manager.
+
+		Returns:
+			None
+		"""
+
+		self.fix_writer.stop()
+		try:
+			self.fix_socket.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			# Already disconnected
+			pass
+
+	def create_fix_socket(self, address):
+		"""
+		Establishes a socket to communicate over.
+
+		Parameters:
+			address: tuple
+				(host, port) to connect to.
+
+		Returns:
+			fix_socket: socket.socket
+				The socket all of this session's FIX communications will
+				transfer over.
+		"""
+
+		fix_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		fix_socket.connect(address)
+		# Orders are small and latency sensitive, don't let Nagle hold them
+		fix_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+		return fix_socket
+
+	def request(self, request_type, **kwargs):
+		"""
+		Queues a message on this session's writer. See FIXTrader.request()
+		for the arguments.
+
+		Parameters:
+			request_type: string
+				Kind of request to make.
+			kwargs: dict
+				Arguments passed through to FIXTrader.build_msg().
+
+		Returns:
+			None
+		"""
+
+		self.fix_writer.enqueue(request_type, **kwargs)
+
+	def on_logon(self):
+		"""
+		Called by reply_manager when GDAX answers this session's Logon.
+
+		Returns:
+			None
+		"""
+
+		self.logged_on.set()
+		self.fix_trader.on_session_logon(self)
+
+	def add_order(self):
+		"""
+		Counts an order routed to this session.
+
+		Returns:
+			None
+		"""
+
+		with self.live_orders_lock:
+			self.live_orders += 1
+
+	def remove_order(self):
+		"""
+		Uncounts an order routed to this session once it has closed.
+
+		Returns:
+			None
+		"""
+
+		with self.live_orders_lock:
+			self.live_orders -= 1
+
+	def load(self):
+		"""
+		How busy the session is, for routing new orders.
+
+		Returns:
+			load: int
+				Live orders plus messages waiting to be sent.
+		"""
+
+		writer = self.fix_writer
+		return self.live_orders + len(writer.pending) + len(writer.priority_pending)
+
+	def on_sent(self, last_seq_num):
+		"""
+		Called by fix_writer after every batch it sends, off the send path.
+
+		Parameters:
+			last_seq_num: int
+				MsgSeqNum of the last message in the batch.
+
+		Returns:
+			None
+		"""
+
+		self.heartbeat_manager.on_send()
+		if self.journal is not None:
+			self.journal.record_outbound(last_seq_num)
+
+	def on_inbound_seq(self, msg):
+		"""
+		Checks a received message's MsgSeqNum. Asks GDAX to resend anything
+		that was skipped and journals the sequence number.
+
+		Parameters:
+			msg: dict
+				Parsed FIX message.
+
+		Returns:
+			None
+		"""
+
+		# Resent messages fill a gap that has already been requested
+		if 'MsgSeqNum' not in msg or msg.get('PossDupFlag') == 'Y':
+			return
+
+		seq_num = int(msg['MsgSeqNum'])
+		if seq_num > self.expected_inbound_seq:
+			self.logger.add(
+				f'Inbound sequence gap on session {self.index}: expected '
+				f'{self.expected_inbound_seq}, got {seq_num}. Requesting resend'
+			)
+			self.request(
+				'resend_request', seq_range=(self.expected_inbound_seq, seq_num - 1)
+			)
+		# A lower number than expected means GDAX started a new session
+		self.expected_inbound_seq = seq_num + 1
+		if self.journal is not None:
+			self.journal.record_inbound(seq_num)
+
+	def stats(self):
+		"""
+		Snapshot of the session's counters.
+
+		Returns:
+			out: dict
+		"""
+
+		return {
+			'logged_on': self.logged_on.is_set(),
+			'alive': self.heartbeat_manager.session_alive,
+			'live_orders': self.live_orders,
+			'pending': len(self.fix_writer.pending),
+			'msgs_sent': self.fix_writer.msgs_sent,
+			'dropped': self.fix_writer.dropped,
+		}
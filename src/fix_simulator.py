@@ -0,0 +1,355 @@
+import datetime as dt
+import itertools
+import socket
+import socketserver
+import threading
+import uuid
+
+
+class FIXSimulator(socketserver.ThreadingTCPServer):
+
+	allow_reuse_address = True
+	daemon_threads = True
+
+	def __init__(
+			self, host='127.0.0.1', port=4197, fill_delay=None,
+			max_batch_orders=15):
+		"""
+		Local stand-in for the GDAX FIX gateway (as seen through stunnel) so
+		FIXTrader can be exercised without touching the exchange. Understands
+		Logon, Heartbeat, Test Request, New Order - Single, Order Cancel
+		Request, New Order Batch and Order Cancel Batch Request and answers
+		with the same kinds of messages GDAX does. Orders rest until they
+		are canceled or, if fill_delay is set, until they are filled.
+
+		Parameters:
+			host: string
+				Address to listen on.
+			port: int
+				Port to listen on. 4197 is where FIXTrader connects.
+			fill_delay: float or None
+				Seconds after acknowledging an order to fill it completely.
+				None leaves orders resting.
+			max_batch_orders: int
+				Batches with more orders than this are rejected, like GDAX
+				does.
+		"""
+
+		super(FIXSimulator, self).__init__((host, port), FIXSimulatorHandler)
+		self.fill_delay = fill_delay
+		self.max_batch_orders = max_batch_orders
+		self.separator = '\u0001'
+
+	def finalize_msg(self, msg_type, msg_body):
+		"""
+		Adds the header and check sum fields to a reply, mirroring
+		FIXTrader.finalize_msg.
+
+		Parameters:
+			msg_type: string
+				FIX-specific denoter of the type of message being sent.
+			msg_body: string
+				'|' separated body of the message.
+
+		Returns:
+			msg: bytes
+				Ascii encoded FIX message.
+		"""
+
+		msg_body_len = len(f'35={msg_type}|') + len(msg_body)
+		msg = f'8=FIX.4.2|9={msg_body_len}|35={msg_type}|{msg_body}'
+		msg = msg.replace('|', self.separator)
+		check_sum = sum(msg.encode('ascii')) % 256
+		msg = msg + f'10={check_sum:03d}' + self.separator
+
+		return msg.encode('ascii')
+
+
+class FIXSimulatorHandler(socketserver.BaseRequestHandler):
+
+	def setup(self):
+		"""
+		Per-connection state. Each connection is its own FIX session with
+		its own outbound sequence numbers and resting orders.
+
+		Returns:
+			None
+		"""
+
+		self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.seq_num = itertools.count(1)
+		self.send_lock = threading.Lock()
+		self.sender_comp_id = 'Coinbase'
+		self.target_comp_id = ''
+		# ClOrdID -> [order_id, side, price, size]
+		self.orders = {}
+		self.orders_lock = threading.Lock()
+
+	def handle(self):
+		"""
+		Reads FIX messages off the connection and dispatches them until the
+		client disconnects.
+
+		Returns:
+			None
+		"""
+
+		buffer = b''
+		while True:
+			data = self.request.recv(65536)
+			if not data:
+				break
+			buffer += data
+			msgs, buffer = split_fix_msgs(buffer)
+			for msg in msgs:
+				self.dispatch(parse_fix_msg(msg))
+
+	def dispatch(self, fields):
+		"""
+		Answers a single parsed message.
+
+		Parameters:
+			fields: list
+				(tag, value) string pairs in message order.
+
+		Returns:
+			None
+		"""
+
+		tags = dict(fields)
+		msg_type = tags.get('35')
+		self.target_comp_id = tags.get('49', self.target_comp_id)
+
+		if msg_type == 'A':
+			self.send('A', '98=0|108=30|')
+		elif msg_type == '1':
+			self.send('0', f"112={tags.get('112', '')}|")
+		elif msg_type == 'D':
+			self.new_order(tags)
+		elif msg_type == 'F':
+			self.cancel_order(tags.get('41'))
+		elif msg_type == 'U6':
+			group = split_group(fields, '11')
+			if len(group) > self.server.max_batch_orders:
+				self.send(
+					'U7', f"8014={tags.get('8014')}|58=Too many orders in batch|"
+				)
+			else:
+				for order_tags in group:
+					self.new_order(order_tags)
+		elif msg_type == 'U4':
+			group = split_group(fields, '41')
+			if len(group) > self.server.max_batch_orders:
+				self.send(
+					'U5', f"8014={tags.get('8014')}|58=Too many orders in batch|"
+				)
+			else:
+				for order_tags in group:
+					self.cancel_order(order_tags.get('41'))
+
+	def new_order(self, tags):
+		"""
+		Acknowledges a new order and, if the server has a fill_delay, fills
+		it after that delay.
+
+		Parameters:
+			tags: dict
+				Fields of the order.
+
+		Returns:
+			None
+		"""
+
+		client_order_id = tags.get('11')
+		order = [str(uuid.uuid4()), tags.get('54'), tags.get('44'), tags.get('38')]
+		with self.orders_lock:
+			self.orders[client_order_id] = order
+		self.execution_report(client_order_id, order, '0', '0', order[3])
+
+		if self.server.fill_delay is not None:
+			timer = threading.Timer(
+				self.server.fill_delay, self.fill_order, args=(client_order_id,)
+			)
+			timer.daemon = True
+			timer.start()
+
+	def fill_order(self, client_order_id):
+		"""
+		Fills a resting order completely.
+
+		Parameters:
+			client_order_id: string
+				ClOrdID of the order to fill.
+
+		Returns:
+			None
+		"""
+
+		with self.orders_lock:
+			order = self.orders.pop(client_order_id, None)
+		if order is None:
+			return
+		self.execution_report(
+			client_order_id, order, '1', '2', '0',
+			f'32={order[3]}|31={order[2]}|'
+		)
+		self.execution_report(client_order_id, order, '3', '3', '0')
+
+	def cancel_order(self, client_order_id):
+		"""
+		Cancels a resting order, or rejects the cancel if the order isn't
+		resting.
+
+		Parameters:
+			client_order_id: string
+				ClOrdID of the order to cancel.
+
+		Returns:
+			None
+		"""
+
+		with self.orders_lock:
+			order = self.orders.pop(client_order_id, None)
+		if order is None:
+			self.send('9', f'41={client_order_id}|102=1|434=1|')
+			return
+		self.execution_report(client_order_id, order, '4', '4', '0')
+
+	def execution_report(
+			self, client_order_id, order, exec_type, ord_status, leaves_qty,
+			extra=''):
+		"""
+		Sends an Execution Report for an order.
+
+		Parameters:
+			client_order_id: string
+				ClOrdID of the order.
+			order: list
+				[order_id, side, price, size] of the order.
+			exec_type: string
+				ExecType (150) value.
+			ord_status: string
+				OrdStatus (39) value.
+			leaves_qty: string
+				LeavesQty (151) value.
+			extra: string
+				Additional '|' terminated fields.
+
+		Returns:
+			None
+		"""
+
+		order_id, side, price, size = order
+		self.send(
+			'8',
+			f'11={client_order_id}|37={order_id}|55=BTC-USD|54={side}|'
+			f'44={price}|38={size}|150={exec_type}|39={ord_status}|'
+			f'151={leaves_qty}|{extra}'
+		)
+
+	def send(self, msg_type, msg_body):
+		"""
+		Adds the session header fields to msg_body and sends it.
+
+		Parameters:
+			msg_type: string
+				FIX-specific denoter of the type of message being sent.
+			msg_body: string
+				'|' terminated fields specific to the message.
+
+		Returns:
+			None
+		"""
+
+		fix_time_str = dt.datetime.utcnow().strftime('%Y%m%d-%H:%M:%S.%f')[:-3]
+		with self.send_lock:
+			header = \
+				f'34={next(self.seq_num)}|49={self.sender_comp_id}|' \
+				f'52={fix_time_str}|56={self.target_comp_id}|'
+			msg = self.server.finalize_msg(msg_type, header + msg_body)
+			try:
+				self.request.sendall(msg)
+			except OSError:
+				pass
+
+
+def split_fix_msgs(buffer):
+	"""
+	Splits complete FIX messages off the front of a byte buffer.
+
+	Parameters:
+		buffer: bytes
+			Bytes read off a socket, possibly ending in a partial message.
+
+	Returns:
+		msgs: list
+			Complete messages as bytes.
+		remaining: bytes
+			Trailing partial message, if any.
+	"""
+
+	msgs = []
+	start = 0
+	while True:
+		check_sum_ind = buffer.find(b'\x0110=', start)
+		if check_sum_ind == -1:
+			break
+		end = buffer.find(b'\x01', check_sum_ind + 1)
+		if end == -1:
+			break
+		msgs.append(buffer[start:end + 1])
+		start = end + 1
+
+	return msgs, buffer[start:]
+
+
+def parse_fix_msg(msg):
+	"""
+	Splits a FIX message into its fields, keeping repeated tags.
+
+	Parameters:
+		msg: bytes
+			A single complete FIX message.
+
+	Returns:
+		fields: list
+			(tag, value) string pairs in message order.
+	"""
+
+	fields = []
+	for item in msg.decode('ascii').split('\u0001'):
+		if item:
+			tag, _, value = item.partition('=')
+			fields.append((tag, value))
+
+	return fields
+
+
+def split_group(fields, first_tag):
+	"""
+	Splits the entries of a repeating group, such as the NoOrders group of a
+	batch message, into one dict per entry.
+
+	Parameters:
+		fields: list
+			(tag, value) pairs of the whole message.
+		first_tag: string
+			Tag that starts every entry of the group.
+
+	Returns:
+		group: list
+			One dict of tag -> value per entry.
+	"""
+
+	group = []
+	for tag, value in fields:
+		if tag == first_tag:
+			group.append({})
+		if group and tag != '10':
+			group[-1][tag] = value
+
+	return group
+
+
+if __name__ == '__main__':
+	FIXSimulator().serve_forever()
@@ -1,22 +1,30 @@
 import base64
+import collections
 import datetime as dt
 import hashlib
 import hmac
 import itertools
-import json
-import socket
-import time
+import threading
 import uuid
 
+from .fix_dicts import FIX_DICTS, VALUE_DICTS
+from .fix_session import FIXSession
+from .latency_tracker import LatencyTracker
 from .order import Order
 from .order_tracker import OrderTracker
+from .risk_gate import RiskGate
 
 
 class FIXTrader:
 
+	# GDAX accepts at most 15 orders in a New Order Batch or Order Cancel
+	# Batch message
+	max_batch_orders = 15
+
 	def __init__(
 			self, api_key, api_secret_key, api_passphrase, account,
-			orderbook_ws, ob_updated_cond, logger):
+			orderbook_ws, ob_updated_cond, logger, scheduler, journal=None,
+			risk_gate=None, rate_limit=None, sessions=1, routing='load'):
 		"""
 		FIXTrader handles messages sent to GDAX through the FIX connection.
 		On receiving an organize_order() method call, it creates an Order
@@ -41,9 +49,28 @@ class FIXTrader:
 				against their strategy.
 			logger: Log
 				Used to log messages as needed.
+			scheduler: TimerWheel
+				Owns the session's heartbeat timers and order timeouts.
+			journal: SessionJournal
+				If given, sequence numbers and order states are journaled
+				and the session resumes from where the journal left off.
+			risk_gate: RiskGate
+				Pre-trade checks every new order must pass. Defaults to a
+				RiskGate with default limits.
+			rate_limit: dict
+				rate, burst, priority_reserve and max_order_wait for
+				FIXWriter's outbound rate limit, which every session gets its
+				own of. Unlimited if not given.
+			sessions: int
+				Number of FIX sessions to log on and spread orders over.
+			routing: string
+				'load' sends each new order to the session with the fewest
+				live and queued orders, 'product' sends all orders for a
+				product to the same session.
 		"""
 
 		self.logger = logger
+		self.scheduler = scheduler
 		self.api_key = api_key
 		self.api_secret_key = api_secret_key
 		self.api_passphrase = api_passphrase
@@ -51,12 +78,34 @@ class FIXTrader:
 		self.orderbook_ws = orderbook_ws
 		self.ob_updated_cond = ob_updated_cond
 		self.order_tracker = OrderTracker()
-		self.seq_num = itertools.count(0)
-		self.fix_socket = self.create_fix_socket()
+		if risk_gate is None:
+			risk_gate = RiskGate(account, orderbook_ws)
+		self.risk_gate = risk_gate
+		# BatchID -> Orders of recent batch messages, so a batch reject can
+		# be routed back to the orders it contained
+		self.order_batches = collections.OrderedDict()
+		# Set by main when strategy plugins are in use
+		self.strategy_engine = None
+		# Seconds after which a live order is canceled, None to never time
+		# out. Set by main.
+		self.order_timeout = None
+		# QueuePositionEstimator for live orders, None to always cancel as
+		# soon as a strategy says so. Set by main.
+		self.queue_estimator = None
+		self.journal = journal
+		next_outbound_seq, last_inbound_seq, live_orders = 0, 0, {}
+		if journal is not None:
+			next_outbound_seq, last_inbound_seq, live_orders = journal.recover()
+		# Set once GDAX has answered every session's Logon
+		self.logged_on = threading.Event()
+		# Updated by reply_manager
+		self.msgs_received_by_type = collections.Counter()
+		# Stamped as orders and cancels are requested and as their
+		# Execution Reports arrive
+		self.latency_tracker = LatencyTracker()
 		# \u0001 is the unicode field separator for FIX on Python 3
 		# Must specify as unicode with u'\u0001' on Python 2
 		self.separator = '\u0001'
-		self.last_send_msg_time = time.time()
 		self.order_id = None
 		self.order_ids = []
 		self.client_order_id = None
@@ -68,48 +117,155 @@ class FIXTrader:
 		self.order_size = None
 		self.qty_filled = 0
 
-		# Some dicts to help parse FIX message meanings
-		with open('../fix_msgs/fix_tag_field_pairs.json') as f:
-			self.fix_tag_field_pairs = json.load(f)
-		with open('../fix_msgs/exec_trans_type_20.json') as f:
-			self.exec_trans_type_20 = json.load(f)
-		with open('../fix_msgs/handl_inst_21.json') as f:
-			self.handl_inst_21 = json.load(f)
-		with open('../fix_msgs/msg_type_35.json') as f:
-			self.msg_type_35 = json.load(f)
-		with open('../fix_msgs/ord_status_39.json') as f:
-			self.ord_status_39 = json.load(f)
-		with open('../fix_msgs/ord_type_40.json') as f:
-			self.ord_type_40 = json.load(f)
-		with open('../fix_msgs/side_54.json') as f:
-			self.side_54 = json.load(f)
-		with open('../fix_msgs/time_in_force_59.json') as f:
-			self.time_in_force_59 = json.load(f)
-		with open('../fix_msgs/encrypt_method_98.json') as f:
-			self.encrypt_method_98 = json.load(f)
-		with open('../fix_msgs/cxl_rej_reason_102.json') as f:
-			self.cxl_rej_reason_102 = json.load(f)
-		with open('../fix_msgs/cxl_rej_reason_103.json') as f:
-			self.ord_rej_reason_103 = json.load(f)
-		with open('../fix_msgs/ord_rej_reason_150.json') as f:
-			self.exec_type_150 = json.load(f)
-		with open('../fix_msgs/aggressor_indicator_1057.json') as f:
-			self.aggressor_indicator_1057 = json.load(f)
-		self.request('logon')
-
-	def create_fix_socket(self):
-		"""
-		Establishes a socket to communicate over.
+		# Some dicts to help parse FIX message meanings, loaded once per
+		# process by fix_dicts
+		self.fix_tag_field_pairs = FIX_DICTS['fix_tag_field_pairs']
+		self.exec_trans_type_20 = FIX_DICTS['exec_trans_type_20']
+		self.handl_inst_21 = FIX_DICTS['handl_inst_21']
+		self.msg_type_35 = FIX_DICTS['msg_type_35']
+		self.ord_status_39 = FIX_DICTS['ord_status_39']
+		self.ord_type_40 = FIX_DICTS['ord_type_40']
+		self.side_54 = FIX_DICTS['side_54']
+		self.time_in_force_59 = FIX_DICTS['time_in_force_59']
+		self.encrypt_method_98 = FIX_DICTS['encrypt_method_98']
+		self.cxl_rej_reason_102 = FIX_DICTS['cxl_rej_reason_102']
+		self.ord_rej_reason_103 = FIX_DICTS['ord_rej_reason_103']
+		self.exec_type_150 = FIX_DICTS['exec_type_150']
+		self.aggressor_indicator_1057 = FIX_DICTS['aggressor_indicator_1057']
+		self.value_dicts = VALUE_DICTS
+		self.routing = routing
+		# Product -> FIXSession, assigned round robin as products are first
+		# traded when routing by product
+		self.product_sessions = {}
+		self.next_session = itertools.count()
+		# The journal only holds one set of sequence numbers, so only the
+		# first session resumes and is journaled. The rest start fresh.
+		self.sessions = [
+			FIXSession(
+				self, 0, scheduler, journal=journal,
+				first_seq_num=next_outbound_seq, last_inbound_seq=last_inbound_seq,
+				rate_limit=rate_limit
+			)
+		]
+		for index in range(1, sessions):
+			self.sessions.append(
+				FIXSession(self, index, scheduler, rate_limit=rate_limit)
+			)
+		for session in self.sessions:
+			session.start()
+		self.recover_orders(live_orders)
+
+	def on_session_logon(self, session):
+		"""
+		Called by a FIXSession when GDAX answers its Logon. Sets logged_on
+		once every session has logged on.
+
+		Parameters:
+			session: FIXSession
+				Session that logged on.
+
+		Returns:
+			None
+		"""
+
+		if len(self.sessions) > 1:
+			self.logger.add(f'FIX session {session.index} logged on')
+		if all(session.logged_on.is_set() for session in self.sessions):
+			self.logged_on.set()
+
+	def route_order(self, product='BTC-USD'):
+		"""
+		Picks the session a new order is sent over. Sessions that have
+		stopped answering are passed over while any other is alive.
+
+		Parameters:
+			product: string
+				Product the order is for.
 
 		Returns:
-			fix_socket: socket.socket
-				The socket all FIX communications will transfer over.
+			session: FIXSession
+		"""
+
+		if len(self.sessions) == 1:
+			return self.sessions[0]
+
+		sessions = [
+			session for session in self.sessions
+			if session.heartbeat_manager.session_alive
+		] or self.sessions
+		if self.routing == 'product':
+			session = self.product_sessions.get(product)
+			if session is None or session not in sessions:
+				session = sessions[next(self.next_session) % len(sessions)]
+				self.product_sessions[product] = session
+			return session
+
+		# Start from a different session each time so ties are broken
+		# round robin instead of always going to the first session
+		start = next(self.next_session) % len(sessions)
+		sessions = sessions[start:] + sessions[:start]
+
+		return min(sessions, key=FIXSession.load)
+
+	def on_dropped(self, request_type, kwargs):
 		"""
+		Called by a session's fix_writer when it drops a new order that
+		waited too long for the rate limit. The orders are rejected as if
+		GDAX had rejected them, so their threads exit and their strategies
+		hear about it.
 
-		fix_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		fix_socket.connect(("127.0.0.1", 4197))
+		Parameters:
+			request_type: string
+				'order' or 'batch_order'.
+			kwargs: dict
+				Arguments the request was made with.
 
-		return fix_socket
+		Returns:
+			None
+		"""
+
+		if request_type == 'batch_order':
+			orders = kwargs['orders']
+		else:
+			with self.order_tracker.orders_by_cl_oid_lock:
+				order = self.order_tracker.orders_by_cl_oid.get(kwargs['client_order_id'])
+			orders = [order] if order is not None else []
+
+		for order in orders:
+			msg = {'OrdStatus': 'Rejected', 'Text': 'Rate limited'}
+			order.msgs.put(msg)
+			if self.strategy_engine is not None:
+				self.strategy_engine.on_execution_report(order, msg)
+
+	def recover_orders(self, live_orders):
+		"""
+		Rebuilds Order objects for orders the journal says were live when
+		the last process stopped and asks GDAX for each one's status so fills
+		that happened in the meantime are picked up. They belong to the
+		first session, whose sequence numbers the journal resumed.
+
+		Parameters:
+			live_orders: dict
+				As returned by SessionJournal.recover().
+
+		Returns:
+			None
+		"""
+
+		for client_order_id, live_order in live_orders.items():
+			order_type, _, price, size, filled, order_id = live_order
+			Order(
+				price, size, order_type, self,
+				recovered=(client_order_id, order_id, filled),
+				session=self.sessions[0]
+			)
+			self.request(
+				'status', order_type=order_type, client_order_id=client_order_id,
+				order_id=order_id, session=self.sessions[0]
+			)
+
+		if live_orders:
+			self.logger.add(f'Recovered {len(live_orders)} live orders from journal')
 
 	def fix_check_sum(self, msg):
 		"""
@@ -166,6 +322,9 @@ class FIXTrader:
 		else:
 			order_size = btc_trading
 
+		if not self.admit_order(order_type, order_price, order_size):
+			return
+
 		new_order = Order(
 			order_price, order_size, order_type, self
 		)
@@ -173,35 +332,150 @@ class FIXTrader:
 		message = f'Made {order_type} order'
 		self.logger.add(message)
 
-	def send_msg(self, msg):
+	def organize_orders(self, order_specs):
 		"""
-		Sends the input msg to GDAX via the FIX socket. Also updates
-		last_send_msg_time to the current time.
+		Creates an Order object for each entry in order_specs and submits
+		them all as New Order Batch messages instead of one message per
+		order. Useful for quoting several price levels at once. Each batch
+		is routed to a session as a whole.
 
 		Parameters:
-			msg: bytes
-				Ascii encoded message to be sent to GDAX via FIX.
+			order_specs: list
+				(order_type, order_price, order_size) tuples, where
+				order_type is 'buy' or 'sell'.
+
+		Returns:
+			new_orders: list
+				The Order objects created, in the same order as order_specs.
+				Orders rejected by risk_gate are left out.
+		"""
+
+		order_specs = [
+			(order_type, order_price, order_size)
+			for order_type, order_price, order_size in order_specs
+			if self.admit_order(order_type, order_price, order_size)
+		]
+		new_orders = []
+		for start in range(0, len(order_specs), self.max_batch_orders):
+			session = self.route_order()
+			batch = [
+				Order(
+					order_price, order_size, order_type, self, batched=True,
+					session=session
+				)
+				for order_type, order_price, order_size
+				in order_specs[start:start + self.max_batch_orders]
+			]
+			self.request('batch_order', orders=batch, session=session)
+			new_orders += batch
+
+		self.logger.add(f'Made batch of {len(new_orders)} orders')
+
+		return new_orders
+
+	def admit_order(self, order_type, order_price, order_size):
+		"""
+		Runs a new order through risk_gate before its Order object is
+		created. Rejects are logged when the reason changes, so a strategy
+		that keeps retrying doesn't flood the log.
+
+		Parameters:
+			order_type: string
+				'buy' or 'sell'.
+			order_price: float
+				Price the order would be made at.
+			order_size: float
+				Size of the order.
+
+		Returns:
+			admitted: bool
+		"""
+
+		reason = self.risk_gate.admit(order_type, order_price, order_size)
+		if reason is not None and reason != self.risk_gate.last_reject:
+			self.logger.add(
+				f'Risk gate rejected {order_type} {order_size} @ {order_price}: {reason}'
+			)
+		self.risk_gate.last_reject = reason
+
+		return reason is None
+
+	def close(self):
+		"""
+		Closes every session. Live orders stay on the book and are
+		recovered from the journal on the next start.
+
+		Returns:
+			None
+		"""
+
+		for session in self.sessions:
+			session.close()
+
+	def kill_switch(self, reason):
+		"""
+		Stops all new orders through risk_gate and cancels every live order.
+
+		Parameters:
+			reason: string
+				Why, for the log.
+
+		Returns:
+			None
+		"""
+
+		self.risk_gate.kill(reason)
+		with self.order_tracker.orders_by_cl_oid_lock:
+			orders = [
+				order for order in self.order_tracker.orders_by_cl_oid.values()
+				if not order.cancel_requested
+			]
+		self.logger.add(f'Kill switch engaged ({reason}), canceling {len(orders)} orders')
+		if orders:
+			self.cancel_orders(orders)
+
+	def cancel_orders(self, orders):
+		"""
+		Cancels every Order in orders with Order Cancel Batch messages,
+		each sent over the session its orders were placed on. The Order
+		objects see the resulting cancel Execution Reports like they would
+		for their own cancels and won't send a cancel of their own.
+
+		Parameters:
+			orders: list
+				Order objects to cancel.
 
 		Returns:
 			None
 		"""
 
-		# Send message
-		self.fix_socket.sendall(msg)
-		# Update time of last send
-		self.last_send_msg_time = time.time()
+		orders_by_session = collections.defaultdict(list)
+		for order in orders:
+			if order.request_cancel(send=False):
+				orders_by_session[order.session].append(order)
+		for session, session_orders in orders_by_session.items():
+			for start in range(0, len(session_orders), self.max_batch_orders):
+				self.request(
+					'batch_cancel',
+					orders=session_orders[start:start + self.max_batch_orders],
+					session=session
+				)
+
+		self.logger.add(f'Canceled batch of {len(orders)} orders')
 
 	def request(
 			self, request_type=None, order_type=None, order_size=None,
-			order_price=None, client_order_id=None, order_id=None):
+			order_price=None, client_order_id=None, order_id=None, orders=None,
+			test_req_id=None, seq_range=None, session=None):
 		"""
-		Creates the appropriate message to send given request_type, sends the
-		message off and logs.
+		Queues the appropriate message for request_type on a session's
+		fix_writer, which assigns its sequence number, sends it and logs it.
 
 		Parameters:
 			request_type: string
-				'logon', 'order', 'cancel' or 'heartbeat'. Represents the
-				kind of request to make.
+				'logon', 'order', 'cancel', 'batch_order', 'batch_cancel',
+				'status', 'heartbeat', 'test_request', 'resend_request' or
+				'sequence_reset'. Represents the kind of request to make.
 			order_type: string
 				'buy' or 'sell'. Denotes which side of the order book the
 				position will be on.
@@ -216,14 +490,65 @@ class FIXTrader:
 				Similar to client_order_id in that it identifies an order,
 				but order_id is assigned by GDAX (as opposed to us like in the
 				case of client_order_id)
+			orders: list
+				Order objects making up a 'batch_order' or 'batch_cancel'
+				request.
+			test_req_id: string
+				TestReqID of a 'test_request', or of the Test Request a
+				'heartbeat' answers.
+			seq_range: tuple
+				(BeginSeqNo, EndSeqNo) of a 'resend_request', or of the
+				Resend Request a 'sequence_reset' answers.
+			session: FIXSession
+				Session to send over. Requests about an order must go over
+				the session the order was placed on. Defaults to the first
+				session.
 
 		Returns:
 			None
 		"""
 
-		seq_num = next(self.seq_num)
+		if session is None:
+			session = self.sessions[0]
+		if request_type in ('order', 'cancel'):
+			self.latency_tracker.on_send(request_type, client_order_id)
+		elif request_type in ('batch_order', 'batch_cancel'):
+			kind = 'order' if request_type == 'batch_order' else 'cancel'
+			for order in orders:
+				self.latency_tracker.on_send(kind, order.client_order_id)
+
+		session.request(
+			request_type, order_type=order_type, order_size=order_size,
+			order_price=order_price, client_order_id=client_order_id,
+			order_id=order_id, orders=orders, test_req_id=test_req_id,
+			seq_range=seq_range
+		)
 
-		msg = ''
+	def build_msg(
+			self, request_type, seq_num, order_type=None, order_size=None,
+			order_price=None, client_order_id=None, order_id=None,
+			orders=None, test_req_id=None, seq_range=None):
+		"""
+		Creates the appropriate message to send given request_type. Called by
+		fix_writer at write time so that seq_num matches wire order.
+
+		Parameters:
+			request_type: string
+				'logon', 'order', 'cancel', 'batch_order', 'batch_cancel',
+				'status', 'heartbeat', 'test_request', 'resend_request' or
+				'sequence_reset'. Represents the kind of request to make.
+			seq_num: int
+				Sequence identifier for FIX message.
+			order_type, order_size, order_price, client_order_id, order_id,
+			orders, test_req_id, seq_range:
+				See request().
+
+		Returns:
+			msg: bytes
+				Ascii encoded FIX message.
+		"""
+
+		msg = b''
 		if request_type == 'logon':
 			msg = self.create_logon_msg(seq_num)
 		elif request_type == 'order':
@@ -232,12 +557,24 @@ class FIXTrader:
 			)
 		elif request_type == 'cancel':
 			msg = self.create_cancel_msg(order_id, client_order_id, seq_num)
+		elif request_type == 'batch_order':
+			msg = self.create_batch_order_msg(orders, seq_num)
+		elif request_type == 'batch_cancel':
+			msg = self.create_batch_cancel_msg(orders, seq_num)
 		elif request_type == 'heartbeat':
-			msg = self.create_heartbeat_msg(seq_num)
-
-		self.logger.add(f'{request_type} msg: {self.analyze_fix_msg(msg)}')
+			msg = self.create_heartbeat_msg(seq_num, test_req_id)
+		elif request_type == 'test_request':
+			msg = self.create_test_request_msg(seq_num, test_req_id)
+		elif request_type == 'status':
+			msg = self.create_status_msg(
+				order_type, order_id, client_order_id, seq_num
+			)
+		elif request_type == 'resend_request':
+			msg = self.create_resend_request_msg(seq_range, seq_num)
+		elif request_type == 'sequence_reset':
+			msg = self.create_sequence_reset_msg(seq_range, seq_num)
 
-		self.send_msg(msg)
+		return msg
 
 	def finalize_msg(self, msg_type, msg_body):
 		"""
@@ -372,22 +709,239 @@ class FIXTrader:
 
 		return msg
 
-	def create_heartbeat_msg(self, seq_num):
+	def track_batch(self, orders, max_tracked=1024):
+		"""
+		Assigns a BatchID to a batch of orders and remembers which orders it
+		contained. Only the most recent max_tracked batches are remembered
+		since GDAX rejects batches right away or not at all.
+
+		Parameters:
+			orders: list
+				Order objects in the batch.
+			max_tracked: int
+				Number of recent batches to remember.
+
+		Returns:
+			batch_id: string
+				Randomly generated uuid4 identifying the batch.
+		"""
+
+		batch_id = str(uuid.uuid4())
+		self.order_batches[batch_id] = orders
+		if len(self.order_batches) > max_tracked:
+			self.order_batches.popitem(last=False)
+
+		return batch_id
+
+	def create_batch_order_msg(self, orders, seq_num):
+		"""
+		Formats a FIX New Order Batch message. Each order is one entry of the
+		NoOrders repeating group and gets its own Execution Report back.
+
+		Parameters:
+			orders: list
+				Order objects to submit, at most max_batch_orders of them.
+			seq_num: int
+				Sequence identifier for FIX message.
+
+		Returns:
+			msg: bytes
+				Ascii encoded FIX New Order Batch message.
+		"""
+
+		msg_type = 'U6'
+
+		batch_id = self.track_batch(orders)
+		fix_time_str = str(dt.datetime.utcnow()).replace("-", "").replace(" ", "-")[:-3]
+		msg_body = \
+			f'34={seq_num}|49={self.api_key}|52={fix_time_str}|' \
+			f'8014={batch_id}|73={len(orders)}|'
+		for order in orders:
+			if order.order_type == 'buy':
+				side = '1'
+			else:
+				side = '2'
+			msg_body += \
+				f'11={order.client_order_id}|55=BTC-USD|54={side}|' \
+				f'44={order.price}|38={order.size}|40=2|59=P|'
+
+		msg = self.finalize_msg(msg_type, msg_body)
+
+		return msg
+
+	def create_batch_cancel_msg(self, orders, seq_num):
+		"""
+		Formats a FIX Order Cancel Batch message. Each order is one entry of
+		the NoOrders repeating group.
+
+		Parameters:
+			orders: list
+				Order objects to cancel, at most max_batch_orders of them.
+			seq_num: int
+				Sequence identifier for FIX message.
+
+		Returns:
+			msg: bytes
+				Ascii encoded FIX Order Cancel Batch message.
+		"""
+
+		msg_type = 'U4'
+
+		batch_id = self.track_batch(orders)
+		fix_time_str = str(dt.datetime.utcnow()).replace("-", "").replace(" ", "-")[:-3]
+		msg_body = \
+			f'34={seq_num}|49={self.api_key}|52={fix_time_str}|' \
+			f'8014={batch_id}|73={len(orders)}|'
+		for order in orders:
+			msg_body += f'41={order.client_order_id}|'
+			# order_id is only known once GDAX has acknowledged the order
+			if order.order_id is not None:
+				msg_body += f'37={order.order_id}|'
+			msg_body += '55=BTC-USD|'
+
+		msg = self.finalize_msg(msg_type, msg_body)
+
+		return msg
+
+	def create_heartbeat_msg(self, seq_num, test_req_id=None):
 		"""
 		Formats a FIX heartbeat message.
 
 		Parameters:
 			seq_num: int
 				Sequence identifier for FIX message.
+			test_req_id: string
+				TestReqID of the Test Request this heartbeat answers, if any.
 
 		Returns:
 			msg: bytes
 				Ascii encoded FIX heartbeat message.
 		"""
 
-		msg_type = '1'
+		msg_type = '0'
 		fix_time_str = str(dt.datetime.utcnow()).replace("-", "").replace(" ", "-")[:-3]
 		msg_body = f'34={seq_num}|49={self.api_key}|52={fix_time_str}|'
+		if test_req_id is not None:
+			msg_body += f'112={test_req_id}|'
+
+		msg = self.finalize_msg(msg_type, msg_body)
+
+		return msg
+
+	def create_test_request_msg(self, seq_num, test_req_id):
+		"""
+		Formats a FIX Test Request message, which GDAX must answer with a
+		heartbeat carrying the same TestReqID.
+
+		Parameters:
+			seq_num: int
+				Sequence identifier for FIX message.
+			test_req_id: string
+				Identifies the Test Request.
+
+		Returns:
+			msg: bytes
+				Ascii encoded FIX Test Request message.
+		"""
+
+		msg_type = '1'
+		fix_time_str = str(dt.datetime.utcnow()).replace("-", "").replace(" ", "-")[:-3]
+		msg_body = \
+			f'34={seq_num}|49={self.api_key}|52={fix_time_str}|112={test_req_id}|'
+
+		msg = self.finalize_msg(msg_type, msg_body)
+
+		return msg
+
+	def create_status_msg(self, order_type, order_id, client_order_id, seq_num):
+		"""
+		Formats a FIX Order Status Request message. GDAX answers with an
+		Execution Report describing the order's current state.
+
+		Parameters:
+			order_type: string
+				'buy' or 'sell'.
+			order_id: string
+				Identifying Order ID of the order.
+			client_order_id: string
+				Identifying Client Order ID of the order.
+			seq_num: int
+				Sequence identifier for FIX message.
+
+		Returns:
+			msg: bytes
+				Ascii encoded FIX Order Status Request message.
+		"""
+
+		msg_type = 'H'
+
+		fix_time_str = str(dt.datetime.utcnow()).replace("-", "").replace(" ", "-")[:-3]
+		if order_type == 'buy':
+			side = '1'
+		else:
+			side = '2'
+		msg_body = \
+			f'37={order_id}|11={client_order_id}|55=BTC-USD|54={side}|' \
+			f'34={seq_num}|49={self.api_key}|52={fix_time_str}|'
+
+		msg = self.finalize_msg(msg_type, msg_body)
+
+		return msg
+
+	def create_resend_request_msg(self, seq_range, seq_num):
+		"""
+		Formats a FIX Resend Request message asking GDAX to resend messages
+		we missed.
+
+		Parameters:
+			seq_range: tuple
+				(BeginSeqNo, EndSeqNo) of the missed messages.
+			seq_num: int
+				Sequence identifier for FIX message.
+
+		Returns:
+			msg: bytes
+				Ascii encoded FIX Resend Request message.
+		"""
+
+		msg_type = '2'
+
+		fix_time_str = str(dt.datetime.utcnow()).replace("-", "").replace(" ", "-")[:-3]
+		begin_seq_no, end_seq_no = seq_range
+		msg_body = \
+			f'34={seq_num}|49={self.api_key}|52={fix_time_str}|' \
+			f'7={begin_seq_no}|16={end_seq_no}|'
+
+		msg = self.finalize_msg(msg_type, msg_body)
+
+		return msg
+
+	def create_sequence_reset_msg(self, seq_range, seq_num):
+		"""
+		Formats a FIX Sequence Reset - Gap Fill message answering a Resend
+		Request from GDAX. Stale orders and heartbeats shouldn't be replayed,
+		so the whole requested range is gap filled. The gap fill takes the
+		place of BeginSeqNo, and seq_num, which fix_writer assigned to this
+		message, is skipped by pointing NewSeqNo past it.
+
+		Parameters:
+			seq_range: tuple
+				(BeginSeqNo, EndSeqNo) of the Resend Request.
+			seq_num: int
+				Sequence number fix_writer assigned to this message.
+
+		Returns:
+			msg: bytes
+				Ascii encoded FIX Sequence Reset message.
+		"""
+
+		msg_type = '4'
+
+		fix_time_str = str(dt.datetime.utcnow()).replace("-", "").replace(" ", "-")[:-3]
+		begin_seq_no, _ = seq_range
+		msg_body = \
+			f'34={begin_seq_no}|43=Y|49={self.api_key}|52={fix_time_str}|' \
+			f'123=Y|36={seq_num + 1}|'
 
 		msg = self.finalize_msg(msg_type, msg_body)
 
@@ -422,30 +976,8 @@ class FIXTrader:
 				try:
 					tag = split_item[0]
 					tag_msg = split_item[1]
-					if tag == '20':
-						tag_msg = self.exec_trans_type_20[tag_msg]
-					elif tag == '21':
-						tag_msg = self.handl_inst_21[tag_msg]
-					elif tag == '35':
-						tag_msg = self.msg_type_35[tag_msg]
-					elif tag == '39':
-						tag_msg = self.ord_status_39[tag_msg]
-					elif tag == '40':
-						tag_msg = self.ord_type_40[tag_msg]
-					elif tag == '54':
-						tag_msg = self.side_54[tag_msg]
-					elif tag == '59':
-						tag_msg = self.time_in_force_59[tag_msg]
-					elif tag == '98':
-						tag_msg = self.encrypt_method_98[tag_msg]
-					elif tag == '102':
-						tag_msg = self.cxl_rej_reason_102[tag_msg]
-					elif tag == '103':
-						tag_msg = self.ord_rej_reason_103[tag_msg]
-					elif tag == '150':
-						tag_msg = self.exec_type_150[tag_msg]
-					elif tag == '1057':
-						tag_msg = self.aggressor_indicator_1057[tag_msg]
+					if tag in self.value_dicts:
+						tag_msg = self.value_dicts[tag][tag_msg]
 					recent_out[self.fix_tag_field_pairs[tag]] = tag_msg
 
 				except KeyError:
@@ -0,0 +1,336 @@
+import collections
+import itertools
+import math
+import threading
+import time
+
+from .metrics import Histogram
+
+
+# Requests sent ahead of new orders when the rate limit is reached
+PRIORITY_REQUESTS = frozenset((
+	'logon', 'cancel', 'batch_cancel', 'heartbeat', 'test_request',
+	'resend_request', 'sequence_reset',
+))
+# Requests dropped rather than sent once they have waited too long
+DROPPABLE_REQUESTS = frozenset(('order', 'batch_order'))
+
+
+class FIXWriter:
+
+	# Linux caps a single sendmsg() at IOV_MAX (1024) buffers, stay well under
+	max_iov = 512
+
+	def __init__(
+			self, fix_socket, build_msg, analyze_msg, logger, first_seq_num=0,
+			rate=math.inf, burst=math.inf, priority_reserve=0, max_order_wait=math.inf,
+			name='fix_writer'):
+		"""
+		FIXWriter is the only thing allowed to write to the FIX socket. Any
+		thread may queue a request with enqueue(); a single writer thread
+		drains everything queued since it last woke up, assigns MsgSeqNum to
+		each message in queue order and sends the whole batch with one
+		vectored sendmsg() call. Because sequence numbers are assigned at
+		write time, sequence order always matches the order bytes hit the
+		wire.
+
+		Messages are rate limited with a token bucket: every message takes a
+		token, tokens come back at rate per second and at most burst are
+		saved up. Requests in PRIORITY_REQUESTS (cancels, heartbeats, etc.)
+		have their own queue which is always drained first, and the last
+		priority_reserve tokens are kept for them, so a burst of new orders
+		can't hold up a cancel. New orders that have waited longer than
+		max_order_wait for a token are dropped instead of being sent stale,
+		and on_dropped is told so.
+
+		Parameters:
+			fix_socket: socket.socket
+				Connected FIX socket. FIXWriter takes ownership of writes.
+			build_msg: function
+				Called as build_msg(request_type, seq_num, **kwargs) and
+				returns the ascii encoded FIX message to send.
+			analyze_msg: function
+				Turns a sent message into something readable for the log.
+			logger: Log
+				Used to log messages as needed.
+			first_seq_num: int
+				MsgSeqNum assigned to the first message written.
+			rate: float
+				Messages per second allowed on average.
+			burst: float
+				Messages that can be sent at once after a quiet period.
+			priority_reserve: float
+				Tokens only priority requests may use.
+			max_order_wait: float
+				Seconds a new order may wait for a token before it is
+				dropped.
+			name: string
+				Name of the writer thread.
+		"""
+
+		self.fix_socket = fix_socket
+		self.build_msg = build_msg
+		self.analyze_msg = analyze_msg
+		self.logger = logger
+		self.seq_num = itertools.count(first_seq_num)
+		self.pending = collections.deque()
+		self.priority_pending = collections.deque()
+		self.pending_cond = threading.Condition()
+		self.rate = rate
+		self.burst = burst
+		self.priority_reserve = priority_reserve
+		self.max_order_wait = max_order_wait
+		self.tokens = burst
+		self.refill_time = time.perf_counter()
+		self.last_send_msg_time = time.time()
+		# Called with the batch's last MsgSeqNum after every batch is sent
+		self.on_sent = None
+		# Called as on_dropped(request_type, kwargs) for every dropped request
+		self.on_dropped = None
+		# Stats, only written by the writer thread
+		self.msgs_sent = 0
+		self.batches_sent = 0
+		self.bytes_sent = 0
+		self.batch_size_counts = collections.Counter()
+		self.msgs_sent_by_type = collections.Counter()
+		self.queue_latency_total = 0.0
+		self.queue_latency_max = 0.0
+		# Time from enqueue() to being sent, per queue
+		self.priority_wait = Histogram()
+		self.order_wait = Histogram()
+		# Writer wake ups that left messages queued for lack of tokens, and
+		# new orders dropped
+		self.rate_limited = 0
+		self.dropped = 0
+		self.running = True
+		self.writer_thread = threading.Thread(target=self.run, name=name)
+
+	def start(self):
+		"""
+		Launches the writer thread.
+
+		Returns:
+			None
+		"""
+
+		self.writer_thread.start()
+
+	def stop(self):
+		"""
+		Stops the writer thread once it has sent the batch it is working on.
+		Requests still queued are not sent.
+
+		Returns:
+			None
+		"""
+
+		with self.pending_cond:
+			self.running = False
+			self.pending_cond.notify()
+		self.writer_thread.join()
+
+	def enqueue(self, request_type, **kwargs):
+		"""
+		Queues a request to be built and sent by the writer thread. Never
+		touches the socket so it's safe to call from any thread.
+
+		Parameters:
+			request_type: string
+				Kind of request, passed through to build_msg.
+			kwargs: dict
+				Extra arguments passed through to build_msg.
+
+		Returns:
+			None
+		"""
+
+		if request_type in PRIORITY_REQUESTS:
+			queue = self.priority_pending
+		else:
+			queue = self.pending
+		with self.pending_cond:
+			queue.append((time.perf_counter(), request_type, kwargs))
+			self.pending_cond.notify()
+
+	def run(self):
+		"""
+		Writer loop. Waits for queued requests, then builds and sends
+		everything the rate limit allows in one batch.
+
+		Returns:
+			None
+		"""
+
+		while True:
+			with self.pending_cond:
+				while True:
+					if not self.running:
+						return
+					batch, dropped, wait = self.take()
+					if batch or dropped:
+						break
+					self.pending_cond.wait(wait)
+
+			for enqueue_time, request_type, kwargs in dropped:
+				self.dropped += 1
+				self.logger.add(
+					f'Dropped {request_type} after waiting '
+					f'{(time.perf_counter() - enqueue_time) * 1e3:.1f}ms for the rate limit'
+				)
+				if self.on_dropped is not None:
+					self.on_dropped(request_type, kwargs)
+			if batch:
+				self.write_batch(batch)
+
+	def take(self):
+		"""
+		Takes as many queued requests as there are tokens for, priority
+		requests first, and drops new orders that have waited too long.
+		Must hold pending_cond.
+
+		Returns:
+			batch: collections.deque
+				(enqueue_time, request_type, kwargs) tuples to send, in the
+				order they are to be sent.
+			dropped: list
+				(enqueue_time, request_type, kwargs) tuples dropped.
+			wait: float or None
+				If nothing was taken, seconds until there may be something
+				to take. None to wait for the next enqueue().
+		"""
+
+		now = time.perf_counter()
+		if self.tokens < self.burst:
+			self.tokens = min(self.burst, self.tokens + (now - self.refill_time) * self.rate)
+		self.refill_time = now
+
+		batch = collections.deque()
+		dropped = []
+		while self.priority_pending and self.tokens >= 1:
+			batch.append(self.priority_pending.popleft())
+			self.tokens -= 1
+		while self.pending:
+			enqueue_time, request_type, kwargs = self.pending[0]
+			if request_type in DROPPABLE_REQUESTS and now - enqueue_time > self.max_order_wait:
+				dropped.append(self.pending.popleft())
+				continue
+			if self.tokens < 1 + self.priority_reserve:
+				break
+			batch.append(self.pending.popleft())
+			self.tokens -= 1
+
+		wait = None
+		if self.priority_pending or self.pending:
+			self.rate_limited += 1
+			# Until a token comes back, or the oldest order has to be dropped
+			needed = 1 if self.priority_pending else 1 + self.priority_reserve
+			wait = (needed - self.tokens) / self.rate
+			if self.pending and self.pending[0][1] in DROPPABLE_REQUESTS:
+				wait = min(wait, self.pending[0][0] + self.max_order_wait - now)
+			wait = max(wait, 0.0)
+
+		return batch, dropped, wait
+
+	def write_batch(self, batch):
+		"""
+		Assigns sequence numbers to, builds and sends a batch of queued
+		requests, then records batch size and queue latency and logs the
+		messages that were sent.
+
+		Parameters:
+			batch: collections.deque
+				(enqueue_time, request_type, kwargs) tuples in queue order.
+
+		Returns:
+			None
+		"""
+
+		msgs = []
+		request_types = []
+		enqueue_times = []
+		for enqueue_time, request_type, kwargs in batch:
+			if request_type in PRIORITY_REQUESTS:
+				self.priority_wait.observe(time.perf_counter() - enqueue_time)
+			else:
+				self.order_wait.observe(time.perf_counter() - enqueue_time)
+			seq_num = next(self.seq_num)
+			msgs.append(self.build_msg(request_type, seq_num, **kwargs))
+			request_types.append(request_type)
+			enqueue_times.append(enqueue_time)
+
+		for start in range(0, len(msgs), self.max_iov):
+			self.sendmsg_all(msgs[start:start + self.max_iov])
+		sent_time = time.perf_counter()
+		self.last_send_msg_time = time.time()
+
+		# Everything below is off the send path
+		if self.on_sent is not None:
+			self.on_sent(seq_num)
+		batch_size = len(msgs)
+		batch_latency_max = sent_time - enqueue_times[0]
+		self.msgs_sent += batch_size
+		self.batches_sent += 1
+		self.bytes_sent += sum(len(msg) for msg in msgs)
+		self.batch_size_counts[batch_size] += 1
+		for request_type in request_types:
+			self.msgs_sent_by_type[request_type] += 1
+		self.queue_latency_total += sum(sent_time - t for t in enqueue_times)
+		if batch_latency_max > self.queue_latency_max:
+			self.queue_latency_max = batch_latency_max
+
+		for request_type, msg in zip(request_types, msgs):
+			self.logger.add(f'{request_type} msg: {self.analyze_msg(msg)}')
+		self.logger.add(
+			f'FIX batch sent: {batch_size} msgs, '
+			f'max queue latency {batch_latency_max * 1e6:.1f}us'
+		)
+
+	def sendmsg_all(self, msgs):
+		"""
+		Sends msgs with as few sendmsg() calls as possible, resuming after
+		partial writes the way sendall() would.
+
+		Parameters:
+			msgs: list
+				Ascii encoded FIX messages.
+
+		Returns:
+			None
+		"""
+
+		buffers = [memoryview(msg) for msg in msgs]
+		first = 0
+		while first < len(buffers):
+			sent = self.fix_socket.sendmsg(buffers[first:])
+			while first < len(buffers) and sent >= len(buffers[first]):
+				sent -= len(buffers[first])
+				first += 1
+			if sent:
+				buffers[first] = buffers[first][sent:]
+
+	def stats(self):
+		"""
+		Summary of what the writer has sent so far.
+
+		Returns:
+			out: dict
+				Message, batch and byte counts, batch size distribution,
+				mean/max time messages spent queued (in seconds), and how
+				often the rate limit held messages back or dropped them.
+		"""
+
+		if self.msgs_sent:
+			queue_latency_mean = self.queue_latency_total / self.msgs_sent
+		else:
+			queue_latency_mean = 0.0
+
+		return {
+			'msgs_sent': self.msgs_sent,
+			'batches_sent': self.batches_sent,
+			'bytes_sent': self.bytes_sent,
+			'batch_size_counts': dict(self.batch_size_counts),
+			'queue_latency_mean': queue_latency_mean,
+			'queue_latency_max': self.queue_latency_max,
+			'rate_limited': self.rate_limited,
+			'dropped': self.dropped,
+		}
@@ -3,6 +3,8 @@ import threading
 
 import gdax
 
+from .metrics import Histogram
+
 
 class GDAXAccount:
 
@@ -29,6 +31,8 @@ class GDAXAccount:
 		)
 		self.usd, self.btc = self.get_account_holdings()
 		self.account_lock = threading.RLock()
+		# Time spent waiting for account_lock on the order path
+		self.lock_wait = Histogram()
 
 	def authorize_gdax_account(
 			self, api_key=None, api_secret_key=None, api_passphrase=None):
@@ -104,3 +108,35 @@ class GDAXAccount:
 			break
 
 		return usd_holding, btc_holding
+
+	def refresh_holdings(self):
+		"""
+		Replaces the calculated usd and btc holdings with the actual
+		holdings fetched over REST. Blocks on the REST call.
+
+		Returns:
+			None
+		"""
+
+		with self.account_lock:
+			self.usd, self.btc = self.get_account_holdings()
+
+	def reconcile_holdings(self, order_tracker):
+		"""
+		Scheduler callback that periodically corrects drift in the
+		calculated holdings. Skipped while orders are live since their fills
+		are still being accounted for. The REST call runs on its own thread
+		so it doesn't hold up the scheduler.
+
+		Parameters:
+			order_tracker: OrderTracker
+				Used to check for live orders.
+
+		Returns:
+			None
+		"""
+
+		if order_tracker.orders_by_cl_oid:
+			return
+
+		threading.Thread(target=self.refresh_holdings, name='reconcile').start()
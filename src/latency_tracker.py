@@ -0,0 +1,216 @@
+import collections
+import heapq
+import json
+import threading
+import time
+
+import numpy as np
+
+from .metrics import Histogram
+
+
+# Intervals measured, as (name, from event, to event)
+INTERVALS = (
+	('new_to_ack', 'new', 'ack'),
+	('new_to_first_fill', 'new', 'fill'),
+	('cancel_to_canceled', 'cancel', 'canceled'),
+)
+
+
+class LatencyTracker:
+
+	def __init__(self, max_orders=4096, max_samples=65536, max_outliers=32):
+		"""
+		Measures how long GDAX takes to acknowledge, fill and cancel our
+		orders. Every order gets a timeline, keyed by client order id, of
+		when it was sent, when cancels were sent and when each matching
+		Execution Report arrived. Each interval in INTERVALS is measured the
+		first time both of its events have happened.
+
+		Parameters:
+			max_orders: int
+				Timelines kept. The oldest are forgotten first.
+			max_samples: int
+				Samples per interval kept for percentiles.
+			max_outliers: int
+				Slowest samples per interval kept, with their timelines.
+		"""
+
+		self.max_orders = max_orders
+		self.max_outliers = max_outliers
+		self.tracker_lock = threading.Lock()
+		# Client order id -> [(event, time.monotonic()), ...]
+		self.timelines = collections.OrderedDict()
+		self.samples = {
+			name: collections.deque(maxlen=max_samples) for name, _, _ in INTERVALS
+		}
+		# Min-heaps of (latency, client order id, timeline), so the fastest
+		# of the slowest samples is the one replaced
+		self.outliers = {name: [] for name, _, _ in INTERVALS}
+		# Exposed through the metrics endpoint
+		self.histograms = {name: Histogram() for name, _, _ in INTERVALS}
+
+	def stamp(self, client_order_id, event, stamp_time=None):
+		"""
+		Adds an event to an order's timeline and records any interval the
+		event completes.
+
+		Parameters:
+			client_order_id: string
+				Order the event happened to.
+			event: string
+				'new', 'cancel', 'ack', 'fill' or 'canceled'.
+			stamp_time: float
+				time.monotonic() of the event, now if not given.
+
+		Returns:
+			None
+		"""
+
+		if stamp_time is None:
+			stamp_time = time.monotonic()
+
+		with self.tracker_lock:
+			timeline = self.timelines.get(client_order_id)
+			if timeline is None:
+				if event != 'new':
+					# Sent before the tracker knew about it, e.g. recovered
+					# from the session journal
+					return
+				timeline = self.timelines[client_order_id] = []
+				if len(self.timelines) > self.max_orders:
+					self.timelines.popitem(last=False)
+
+			seen = {e for e, _ in timeline}
+			timeline.append((event, stamp_time))
+			if event in seen:
+				return
+
+			for name, start_event, end_event in INTERVALS:
+				if event != end_event or start_event not in seen:
+					continue
+				start_time = next(t for e, t in timeline if e == start_event)
+				self.record(name, stamp_time - start_time, client_order_id, timeline)
+
+	def record(self, name, latency, client_order_id, timeline):
+		"""
+		Records one sample of an interval. Must hold tracker_lock.
+
+		Parameters:
+			name: string
+				Interval name from INTERVALS.
+			latency: float
+				Seconds.
+			client_order_id: string
+				Order the sample came from.
+			timeline: list
+				The order's timeline so far.
+
+		Returns:
+			None
+		"""
+
+		self.samples[name].append(latency)
+		self.histograms[name].observe(latency)
+		outliers = self.outliers[name]
+		# The timeline keeps growing after this, e.g. with fills and cancels
+		outlier = (latency, client_order_id, timeline)
+		if len(outliers) < self.max_outliers:
+			heapq.heappush(outliers, outlier)
+		elif latency > outliers[0][0]:
+			heapq.heapreplace(outliers, outlier)
+
+	def on_send(self, request_type, client_order_id):
+		"""
+		Stamps an order or cancel request. Called by FIXTrader.request().
+
+		Parameters:
+			request_type: string
+				'order' or 'cancel'.
+			client_order_id: string
+				Order the request is for.
+
+		Returns:
+			None
+		"""
+
+		self.stamp(client_order_id, 'new' if request_type == 'order' else 'cancel')
+
+	def on_execution_report(self, client_order_id, msg):
+		"""
+		Stamps an Execution Report. Called by reply_manager.
+
+		Parameters:
+			client_order_id: string
+				Order the report is for.
+			msg: dict
+				Parsed Execution Report.
+
+		Returns:
+			None
+		"""
+
+		now = time.monotonic()
+		if msg.get('ExecType') == 'New':
+			self.stamp(client_order_id, 'ack', now)
+		if 'LastShares' in msg:
+			self.stamp(client_order_id, 'fill', now)
+		if msg.get('OrdStatus') == 'Canceled':
+			self.stamp(client_order_id, 'canceled', now)
+
+	def summary(self):
+		"""
+		Percentiles and slowest samples of every interval.
+
+		Returns:
+			summary: dict
+				Interval name -> count, p50, p90, p99, p999 and max in
+				microseconds, and the slowest samples with their timelines
+				relative to the order being sent.
+		"""
+
+		with self.tracker_lock:
+			samples = {name: np.array(s) for name, s in self.samples.items()}
+			outliers = {
+				name: [(l, c, list(t)) for l, c, t in sorted(o, reverse=True)]
+				for name, o in self.outliers.items()
+			}
+
+		summary = {}
+		for name, values in samples.items():
+			stats = {'count': len(values)}
+			if len(values):
+				p50, p90, p99, p999 = np.percentile(values, [50, 90, 99, 99.9]) * 1e6
+				stats.update({
+					'p50_us': float(p50), 'p90_us': float(p90),
+					'p99_us': float(p99), 'p999_us': float(p999),
+					'max_us': float(values.max() * 1e6),
+				})
+			stats['outliers'] = [
+				{
+					'latency_us': latency * 1e6,
+					'client_order_id': client_order_id,
+					'timeline_us': [
+						(event, (t - timeline[0][1]) * 1e6) for event, t in timeline
+					],
+				}
+				for latency, client_order_id, timeline in outliers[name]
+			]
+			summary[name] = stats
+
+		return summary
+
+	def save(self, path):
+		"""
+		Writes summary() to a JSON file. Registered to run at exit.
+
+		Parameters:
+			path: string
+				File to write.
+
+		Returns:
+			None
+		"""
+
+		with open(path, 'w') as f:
+			json.dump(self.summary(), f, indent=2)
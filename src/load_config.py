@@ -22,3 +22,22 @@ def load_api_keys():
     api_passphrase = config['user']['api_passphrase']
 
     return api_key, api_secret_key, api_passphrase
+
+
+def load_settings():
+    """
+    Loads the optional [cryptobot] section of config.ini, which holds
+    settings that change how the bot runs rather than who it runs as.
+    Missing settings fall back to the defaults of whatever reads them.
+
+    Returns:
+        settings: configparser.SectionProxy
+            The [cryptobot] section, empty if config.ini doesn't have one.
+    """
+
+    config = configparser.ConfigParser()
+    config.read('../config.ini')
+    if not config.has_section('cryptobot'):
+        config.add_section('cryptobot')
+
+    return config['cryptobot']
@@ -26,23 +26,132 @@ Development for cryptobot stopped in approximately May 2018, and as such,
 many functionalities are most likely broken.
 
 Requirements:
-	Python 3.6
+	Python 3.8
 	gdax v1.06
 	numpy
 	websocket v0.40.0
 """
 
+import atexit
+import functools
+import multiprocessing
+import signal
+import sys
 import threading
 import time
 
+import gdax
+
+from .book_checksum import BookVerifier
 from .fix_trader import FIXTrader
 from .gdax_account import GDAXAccount
-from .load_config import load_api_keys
+from .load_config import load_api_keys, load_settings
 from .log import Log
+from .md_ring import MarketDataRing, RingBook, run_market_data_process
+from .metrics import MetricsServer, register_metrics
 from .orderbook_ws import OrderBookWebSocket
-from .fix_heartbeat_manager import fix_heartbeat_manager
+from .profiler import SamplingProfiler, thread_cpu_times
+from .queue_position import QueuePositionEstimator
 from .reply_manager import reply_manager
+from .risk_gate import RiskGate
+from .runtime_tuning import GCTuner, ThreadPinner, parse_affinity
+from .session_journal import SessionJournal
+from .strategy import STRATEGIES, StrategyEngine
 from .strategy_manager import strategy_manager
+from .tick_store import TickRecorder
+from .timer_wheel import TimerWheel
+
+
+def log_stats(logger, orderbook_ws, gc_tuner=None):
+	"""
+	Scheduler callback that logs how far behind the latest book its
+	consumers are running, conflated and through the market data bus, and
+	how much CPU each thread has used, how each redundant feed is doing, how
+	much the tick recorder has written, whether the book still matches the
+	reference snapshots and how long GC has paused for.
+
+	Parameters:
+		logger: Log
+			Used to log messages as needed.
+		orderbook_ws: OrderBookWebSocket or RingBook
+			Book whose stats are logged.
+		gc_tuner: GCTuner
+			GC pause stats are logged if given.
+
+	Returns:
+		None
+	"""
+
+	logger.add(f'Book conflation stats: {orderbook_ws.conflator.stats()}')
+	logger.add(f'Market data bus stats: {orderbook_ws.bus.stats()}')
+	logger.add(f'Thread CPU seconds: {thread_cpu_times()}')
+	if getattr(orderbook_ws, 'feed_arbiter', None) is not None:
+		logger.add(f'Market data feed stats: {orderbook_ws.feed_arbiter.stats()}')
+	if getattr(orderbook_ws, 'tick_recorder', None) is not None:
+		logger.add(f'Tick recorder stats: {orderbook_ws.tick_recorder.stats()}')
+	if getattr(orderbook_ws, 'book_verifier', None) is not None:
+		logger.add(f'Book verifier stats: {orderbook_ws.book_verifier.stats()}')
+	if getattr(orderbook_ws, 'queue_estimator', None) is not None:
+		logger.add(f'Queue position stats: {orderbook_ws.queue_estimator.stats()}')
+	if gc_tuner is not None:
+		logger.add(f'GC stats: {gc_tuner.stats()}')
+
+
+def market_is_quiet(orderbook_ws, fix_trader, quiet_time):
+	"""
+	Whether a GC pause would hold nothing up right now: the book hasn't
+	changed for quiet_time seconds and no FIX messages are waiting to go
+	out.
+
+	Parameters:
+		orderbook_ws: OrderBookWebSocket or RingBook
+			Book to check.
+		fix_trader: FIXTrader
+			Sessions to check.
+		quiet_time: float
+			Seconds without a book update that count as quiet.
+
+	Returns:
+		quiet: bool
+	"""
+
+	latest = orderbook_ws.conflator.latest
+	if latest is not None and time.monotonic() - latest.time < quiet_time:
+		return False
+
+	return not any(
+		session.fix_writer.pending or session.fix_writer.priority_pending
+		for session in fix_trader.sessions
+	)
+
+
+def shutdown(logger, scheduler, orderbook_ws, fix_trader):
+	"""
+	Stops the threads that would otherwise keep the process alive: the
+	market data feed, every FIX session's writer and reply_manager, and the
+	scheduler. Once they have exited the interpreter runs its atexit
+	handlers, which write the latency summary, flush the tick store and
+	close the session journal.
+
+	Parameters:
+		logger: Log
+			Used to log messages as needed.
+		scheduler: TimerWheel
+			Stopped last, after everything that schedules on it.
+		orderbook_ws: OrderBookWebSocket or RingBook
+			Book whose feed to close.
+		fix_trader: FIXTrader
+			Sessions to close.
+
+	Returns:
+		None
+	"""
+
+	logger.add('Shutting down')
+	orderbook_ws.close()
+	fix_trader.close()
+	scheduler.stop()
+	logger.flush()
 
 
 def main():
@@ -54,32 +163,223 @@ def main():
 		None
 	"""
 
+	launch_time = time.monotonic()
+
 	# Load account information
 	api_key, api_secret_key, api_passphrase = load_api_keys()
+	settings = load_settings()
 
 	# General setup
 	logger = Log()
 	ob_updated_cond = threading.Condition()
+	# All timed work (heartbeats, timeouts, reconciliation) runs here
+	scheduler = TimerWheel(logger)
+	scheduler.start()
+	thread_pinner = ThreadPinner(logger, parse_affinity(settings.get('cpu_affinity', '')))
 
 	# Setup trading objects
 	account = GDAXAccount(api_key, api_secret_key, api_passphrase, logger)
-	orderbook_ws = OrderBookWebSocket(ob_updated_cond, logger)
+	subscribe_matches = settings.getboolean('subscribe_matches', fallback=False)
+	ignore_cutoff_vol = settings.getfloat('ignore_cutoff_vol', fallback=0) or None
+	feed_urls = [
+		url.strip() for url in settings.get('feed_urls', '').split(',') if url.strip()
+	] or None
+	feed_max_lag = settings.getfloat('feed_max_lag', fallback=.25)
+	if settings.getboolean('market_data_process', fallback=False):
+		# Websocket decoding and book maintenance get their own process (and
+		# GIL), this process follows the book through shared memory
+		md_ring = MarketDataRing(create=True)
+		atexit.register(md_ring.shm.unlink)
+		market_data_process = multiprocessing.Process(
+			target=run_market_data_process,
+			args=(
+				md_ring.name, ['BTC-USD'], subscribe_matches, ignore_cutoff_vol,
+				feed_urls, feed_max_lag
+			),
+			name='market_data', daemon=True
+		)
+		market_data_process.start()
+		thread_pinner.processes['market_data'] = market_data_process
+		orderbook_ws = RingBook(
+			md_ring, ob_updated_cond, logger,
+			depth_levels=settings.getint('depth_levels', fallback=10)
+		)
+	else:
+		orderbook_ws = OrderBookWebSocket(
+			ob_updated_cond, logger, subscribe_matches=subscribe_matches,
+			ignore_cutoff_vol=ignore_cutoff_vol, feed_urls=feed_urls,
+			feed_max_lag=feed_max_lag,
+			checksum_levels=settings.getint('book_checksum_levels', fallback=10),
+			depth_levels=settings.getint('depth_levels', fallback=10)
+		)
 	orderbook_ws.start()
+	tick_store_path = settings.get('tick_store_path', '')
+	if tick_store_path:
+		# Records the market data for backtests from its own thread
+		orderbook_ws.tick_recorder = TickRecorder(
+			orderbook_ws, tick_store_path,
+			levels=settings.getint('tick_store_levels', fallback=10),
+			depth_interval=settings.getfloat('tick_store_depth_interval', fallback=1.0)
+		)
+		orderbook_ws.tick_recorder.start()
+		atexit.register(orderbook_ws.tick_recorder.stop)
+	book_verify_interval = settings.getfloat('book_verify_interval', fallback=0)
+	if book_verify_interval > 0:
+		if isinstance(orderbook_ws, RingBook):
+			logger.add('Book verification only runs with market_data_process off')
+		else:
+			# Checks the book against GDAX's REST book off the websocket thread
+			public_client = gdax.PublicClient()
+			orderbook_ws.book_verifier = BookVerifier(
+				orderbook_ws,
+				functools.partial(public_client.get_product_order_book, 'BTC-USD', level=2),
+				logger, interval=book_verify_interval
+			)
+			orderbook_ws.book_verifier.start()
+	journal = None
+	journal_path = settings.get('journal_path', 'fix_session.journal')
+	if journal_path:
+		# Lets a restarted bot resume the FIX session and its live orders
+		journal = SessionJournal(journal_path)
+		atexit.register(journal.close)
+	risk_gate = RiskGate(
+		account, orderbook_ws,
+		max_order_size=settings.getfloat('risk_max_order_size', fallback=float('inf')),
+		max_notional=settings.getfloat('risk_max_notional', fallback=float('inf')),
+		max_open_orders=settings.getint('risk_max_open_orders', fallback=10),
+		max_position=settings.getfloat('risk_max_position', fallback=float('inf')),
+		min_position=settings.getfloat('risk_min_position', fallback=0.0),
+		price_band=settings.getfloat('risk_price_band', fallback=.01)
+	)
 	fix_trader = FIXTrader(
 		api_key, api_secret_key, api_passphrase, account,
-		orderbook_ws, ob_updated_cond, logger
+		orderbook_ws, ob_updated_cond, logger, scheduler, journal=journal,
+		risk_gate=risk_gate, rate_limit={
+			'rate': settings.getfloat('fix_rate_limit', fallback=float('inf')),
+			'burst': settings.getfloat('fix_rate_burst', fallback=float('inf')),
+			'priority_reserve': settings.getfloat('fix_priority_reserve', fallback=0),
+			'max_order_wait': settings.getfloat('fix_max_order_wait', fallback=float('inf')),
+		},
+		sessions=settings.getint('fix_sessions', fallback=1),
+		routing=settings.get('fix_session_routing', 'load')
+	)
+	gc_thresholds = settings.get('gc_thresholds', '')
+	if gc_thresholds:
+		gc_thresholds = tuple(int(value) for value in gc_thresholds.split(','))
+	gc_quiet_time = settings.getfloat('gc_quiet_time', fallback=.05)
+	gc_tuner = GCTuner(
+		logger, scheduler, thresholds=gc_thresholds or None,
+		collect_interval=settings.getfloat('gc_collect_interval', fallback=0),
+		quiet_time=gc_quiet_time,
+		max_defer=settings.getfloat('gc_max_defer', fallback=2.0),
+		is_quiet=lambda: market_is_quiet(orderbook_ws, fix_trader, gc_quiet_time)
+	)
+	order_timeout = settings.getfloat('order_timeout', fallback=0)
+	if order_timeout > 0:
+		fix_trader.order_timeout = order_timeout
+	queue_keep_time = settings.getfloat('queue_keep_time', fallback=0)
+	if queue_keep_time > 0:
+		# Follows where live orders are in the queue at their price so
+		# strategies don't cancel the ones about to fill
+		queue_estimator = QueuePositionEstimator(
+			keep_time=queue_keep_time, trades=subscribe_matches
+		)
+		fix_trader.queue_estimator = queue_estimator
+		orderbook_ws.queue_estimator = queue_estimator
+	scheduler.schedule_every(
+		settings.getfloat('reconcile_interval', fallback=300),
+		account.reconcile_holdings, fix_trader.order_tracker
 	)
+	scheduler.schedule_every(
+		settings.getfloat('stats_interval', fallback=60),
+		log_stats, logger, orderbook_ws, gc_tuner
+	)
+	latency_summary_path = settings.get('latency_summary_path', '')
+	if latency_summary_path:
+		atexit.register(fix_trader.latency_tracker.save, latency_summary_path)
+	metrics_port = settings.getint('metrics_port', fallback=0)
+	if metrics_port:
+		metrics_server = MetricsServer(metrics_port)
+		register_metrics(
+			metrics_server, orderbook_ws, fix_trader, account, logger, gc_tuner
+		)
+		metrics_server.start()
+
+	# reply_manager operates in a separate thread for convenience, one per
+	# FIX session
+	for session in fix_trader.sessions:
+		name = 'reply_manager' if session.index == 0 else f'reply_manager_{session.index}'
+		threading.Thread(
+			target=reply_manager, args=(fix_trader, logger),
+			kwargs={'session': session}, name=name
+		).start()
 
-	# Give the order book a moment to populate and fix_trader a moment to log on
-	time.sleep(1)
+	def on_stop_signal(signum, frame):
+		# A second Ctrl-C exits without waiting
+		signal.signal(signal.SIGINT, signal.SIG_DFL)
+		# The threads are stopped from a thread of their own so whatever
+		# locks this thread holds are released as it unwinds
+		threading.Thread(
+			target=shutdown, args=(logger, scheduler, orderbook_ws, fix_trader),
+			name='shutdown'
+		).start()
+		sys.exit(0)
 
-	# fix_heartbeat_manager and reply_manager both operate in a separate
-	# thread for convenience
-	threading.Thread(target=fix_heartbeat_manager, args=(fix_trader,)).start()
-	threading.Thread(target=reply_manager, args=(fix_trader, logger)).start()
+	# Ctrl-C or kill <pid> stops every thread, so the process exits and the
+	# atexit handlers run
+	signal.signal(signal.SIGINT, on_stop_signal)
+	signal.signal(signal.SIGTERM, on_stop_signal)
+
+	# Trade as soon as the book snapshot is in and GDAX has accepted the logon
+	orderbook_ws.ready.wait()
+	fix_trader.logged_on.wait()
+	logger.add(
+		f'Startup: first quotable book after '
+		f'{(orderbook_ws.ready_time - launch_time) * 1e3:.1f}ms, ready to trade '
+		f'after {(time.monotonic() - launch_time) * 1e3:.1f}ms'
+	)
+	# Whatever is alive now lives as long as the process, and from here on
+	# collections should happen on our schedule
+	if settings.getboolean('gc_freeze', fallback=False):
+		gc_tuner.freeze()
+	gc_tuner.start()
+
+	# kill -USR1 <pid> switches the sampling profiler on, and again off
+	profiler = SamplingProfiler(
+		logger, interval=settings.getfloat('profile_interval', fallback=.005)
+	)
+	signal.signal(signal.SIGUSR1, profiler.on_signal)
+	# kill -USR2 <pid> stops all new orders and cancels the live ones
+	signal.signal(
+		signal.SIGUSR2,
+		lambda signum, frame: threading.Thread(
+			target=fix_trader.kill_switch, args=('SIGUSR2',), name='kill_switch'
+		).start()
+	)
 
 	# Execute strategy
-	strategy_manager(fix_trader, logger)
+	threading.current_thread().name = 'strategy'
+	if thread_pinner.affinity:
+		# Again later for threads that come and go, like reconnected feeds
+		thread_pinner.pin()
+		scheduler.schedule_every(5, thread_pinner.pin)
+	strategy_names = [
+		name.strip() for name in settings.get('strategies', '').split(',')
+		if name.strip()
+	]
+	if strategy_names:
+		# Plugins run from the websocket and reply threads, all that's left
+		# for this thread is writing out the log
+		strategy_engine = StrategyEngine(fix_trader, logger)
+		for name in strategy_names:
+			strategy_engine.add(STRATEGIES[name](account))
+		fix_trader.strategy_engine = strategy_engine
+		orderbook_ws.strategy_engine = strategy_engine
+		while True:
+			time.sleep(1)
+			logger.flush()
+	else:
+		strategy_manager(fix_trader, logger)
 
 
 if __name__ == '__main__':
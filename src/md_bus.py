@@ -0,0 +1,275 @@
+import collections
+import threading
+import time
+
+
+# Events published on a MarketDataBus. seq is the bus wide publish order
+# and time is the time.monotonic() at which the update arrived.
+# A single price level changed. size 0 means the level was removed.
+BookDelta = collections.namedtuple(
+	'BookDelta', ['seq', 'time', 'side', 'price', 'size']
+)
+# The whole book was replaced (snapshot or resync). Deltas that follow
+# apply to ob_buys and ob_sells.
+BookReset = collections.namedtuple(
+	'BookReset', ['seq', 'time', 'ob_buys', 'ob_sells']
+)
+# The best bid or ask price or size changed
+TopOfBook = collections.namedtuple(
+	'TopOfBook', [
+		'seq', 'time', 'best_buy_price', 'best_buy_size', 'best_sell_price',
+		'best_sell_size'
+	]
+)
+# A trade printed. side is the maker's side.
+Trade = collections.namedtuple(
+	'Trade', ['seq', 'time', 'side', 'price', 'size', 'trade_id']
+)
+
+# A level2 change as it arrived, before ignore_cutoff filtering and the
+# depth limit decide whether the book applies it
+L2Change = collections.namedtuple(
+	'L2Change', ['seq', 'time', 'side', 'price', 'size']
+)
+
+EVENT_TYPES = (BookDelta, BookReset, TopOfBook, Trade, L2Change)
+
+
+class MarketDataBus:
+
+	def __init__(self):
+		"""
+		In-process publish/subscribe bus the book writer publishes typed
+		market data events to. Every subscriber has its own bounded ring, so
+		publishing never blocks or waits on a lock, and a slow subscriber
+		only ever loses its own oldest events.
+
+		Events are only built for types that have subscribers, so an unused
+		bus costs the writer one dict lookup per publish.
+		"""
+
+		self.seq = 0
+		self.subscribe_lock = threading.Lock()
+		# Replaced rather than modified, so publish() can iterate without
+		# taking subscribe_lock
+		self.subscribers = {event_type: () for event_type in EVENT_TYPES}
+		self.subscriptions = ()
+
+	def subscribe(self, name, event_types=EVENT_TYPES, capacity=4096):
+		"""
+		Attaches a new subscriber.
+
+		Parameters:
+			name: string
+				Identifies the subscriber in stats.
+			event_types: tuple
+				Event types to receive.
+			capacity: int
+				Events the subscriber can fall behind by before the oldest
+				ones are dropped.
+
+		Returns:
+			subscription: Subscription
+		"""
+
+		subscription = Subscription(name, capacity)
+		with self.subscribe_lock:
+			subscribers = dict(self.subscribers)
+			for event_type in event_types:
+				subscribers[event_type] += (subscription,)
+			self.subscribers = subscribers
+			self.subscriptions += (subscription,)
+
+		return subscription
+
+	def unsubscribe(self, subscription):
+		"""
+		Detaches a subscriber.
+
+		Parameters:
+			subscription: Subscription
+				As returned by subscribe().
+
+		Returns:
+			None
+		"""
+
+		with self.subscribe_lock:
+			self.subscribers = {
+				event_type: tuple(s for s in subs if s is not subscription)
+				for event_type, subs in self.subscribers.items()
+			}
+			self.subscriptions = tuple(
+				s for s in self.subscriptions if s is not subscription
+			)
+
+	def publish(self, event_type, receive_time, *fields):
+		"""
+		Builds an event and hands it to every subscriber of its type. Never
+		blocks. Must only be called from the book writer's thread.
+
+		Parameters:
+			event_type: type
+				One of EVENT_TYPES.
+			receive_time: float
+				time.monotonic() at which the update arrived.
+			fields:
+				The event's remaining fields, after seq and time.
+
+		Returns:
+			None
+		"""
+
+		subscriptions = self.subscribers[event_type]
+		if not subscriptions:
+			return
+
+		self.seq += 1
+		event = event_type(self.seq, receive_time, *fields)
+		for subscription in subscriptions:
+			subscription.put(event)
+
+	def stats(self):
+		"""
+		Per subscriber lag and drop counts.
+
+		Returns:
+			stats: dict
+				Subscriber name -> Subscription.stats().
+		"""
+
+		return {s.name: s.stats() for s in self.subscriptions}
+
+
+class Subscription:
+
+	def __init__(self, name, capacity):
+		"""
+		One subscriber's ring of events. Single producer (the bus), single
+		consumer (the subscriber). The producer only ever advances head and
+		the consumer only ever advances tail, so neither needs a lock. When
+		the producer laps the consumer, the consumer skips ahead to the
+		oldest event still in the ring and counts the rest as dropped.
+
+		Parameters:
+			name: string
+				Identifies the subscriber in stats.
+			capacity: int
+				Number of events the ring holds.
+		"""
+
+		self.name = name
+		self.capacity = capacity
+		self.ring = [None] * capacity
+		# Events ever put and taken. head - tail is the current lag.
+		self.head = 0
+		self.tail = 0
+		self.consumed = 0
+		self.dropped = 0
+		self.max_lag = 0
+		self.age_total = 0.0
+		self.age_max = 0.0
+		# Set while the consumer is blocked in get(), so put() only pays for
+		# a wakeup when someone is waiting
+		self.waiting = False
+		self.wakeup = threading.Event()
+
+	def put(self, event):
+		"""
+		Adds an event, overwriting the oldest one if the ring is full.
+		Called by the bus only.
+
+		Parameters:
+			event: namedtuple
+				Event to add.
+
+		Returns:
+			None
+		"""
+
+		self.ring[self.head % self.capacity] = event
+		self.head += 1
+		if self.waiting:
+			self.wakeup.set()
+
+	def poll(self):
+		"""
+		Takes the oldest unread event without waiting.
+
+		Returns:
+			event: namedtuple or None
+				None if there are no unread events.
+		"""
+
+		while True:
+			tail = self.tail
+			lag = self.head - tail
+			if lag == 0:
+				return None
+
+			if lag > self.capacity:
+				# Lapped, skip to the oldest event that hasn't been overwritten
+				self.dropped += lag - self.capacity
+				self.tail = tail = self.head - self.capacity
+				lag = self.capacity
+			event = self.ring[tail % self.capacity]
+			# The slot may have been overwritten while it was being read
+			if self.head - tail > self.capacity:
+				continue
+
+			self.tail = tail + 1
+			self.consumed += 1
+			if lag > self.max_lag:
+				self.max_lag = lag
+			age = time.monotonic() - event.time
+			self.age_total += age
+			if age > self.age_max:
+				self.age_max = age
+
+			return event
+
+	def get(self, timeout=None):
+		"""
+		Takes the oldest unread event, waiting for one if necessary.
+
+		Parameters:
+			timeout: float
+				Seconds to wait at most, None to wait indefinitely.
+
+		Returns:
+			event: namedtuple or None
+				None if the timeout passed without an event.
+		"""
+
+		event = self.poll()
+		if event is not None:
+			return event
+
+		self.waiting = True
+		# An event may have been put between poll() and setting waiting
+		event = self.poll()
+		if event is None:
+			self.wakeup.wait(timeout)
+			event = self.poll()
+		self.waiting = False
+		self.wakeup.clear()
+
+		return event
+
+	def stats(self):
+		"""
+		How far behind the publisher this subscriber is.
+
+		Returns:
+			stats: dict
+		"""
+
+		return {
+			'published': self.head,
+			'consumed': self.consumed,
+			'dropped': self.dropped,
+			'lag': self.head - self.tail,
+			'max_lag': self.max_lag,
+			'age_mean_us': self.age_total / max(self.consumed, 1) * 1e6,
+			'age_max_us': self.age_max * 1e6,
+		}
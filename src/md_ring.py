@@ -0,0 +1,618 @@
+import collections
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .book_conflator import BookConflator
+from .book_depth import BookDepth
+from .book_signals import BookSignals
+from .log import Log
+from .md_bus import BookDelta, BookReset, MarketDataBus, TopOfBook, Trade
+from .metrics import Histogram
+from .orderbook_ws import OrderBookWebSocket
+from .trade_stats import TradeStats
+
+
+# Kinds of ring records
+KIND_DELTA = 1
+KIND_SNAPSHOT = 2
+# Returned by RingReader.poll() after an overrun, not stored in the ring
+KIND_RESYNC = 3
+KIND_TRADE = 4
+
+SIDES = {'buy': 1, 'sell': 2}
+SIDE_NAMES = {1: 'buy', 2: 'sell'}
+
+RECORD_DTYPE = np.dtype([
+	('seq', np.int64),
+	('time_ns', np.int64),
+	('kind', np.int64),
+	('side', np.int64),
+	('price', np.float64),
+	('size', np.float64),
+	('best_buy_price', np.float64),
+	('best_buy_size', np.float64),
+	('best_sell_price', np.float64),
+	('best_sell_size', np.float64),
+])
+
+# header fields
+WRITE_SEQ = 0
+SNAPSHOT_VERSION = 1
+SNAPSHOT_SEQ = 2
+NUM_BIDS = 3
+NUM_ASKS = 4
+CAPACITY = 5
+LEVELS = 6
+HEADER_LEN = 8
+
+
+class MarketDataRing:
+
+	def __init__(self, name=None, create=False, capacity=65536, levels=50):
+		"""
+		Ring buffer of order book updates in shared memory, written by the
+		market data process and read in place by any number of trading
+		processes.
+
+		Every record holds one book delta (or marks a snapshot) together
+		with the top of book after it was applied and the time it was
+		published. Next to the ring sits a depth snapshot of the whole
+		(50 level) book, rewritten on every publish, that readers fall back
+		on when they fall so far behind that the writer has lapped them.
+
+		There are no locks. Each ring slot's seq field is set to -1 while the
+		slot is being written and to the record's sequence number once it is
+		complete, and the depth snapshot is guarded by a version counter that
+		is odd while it is being written, so readers can tell torn reads from
+		good ones.
+
+		Parameters:
+			name: string
+				Shared memory block name to attach to. A new block gets a
+				generated name, available as self.name.
+			create: bool
+				True to create the block (market data process owner), False
+				to attach to an existing one.
+			capacity: int
+				Number of records the ring holds. Read from the block when
+				attaching.
+			levels: int
+				Number of levels per side the depth snapshot holds. Read from
+				the block when attaching.
+		"""
+
+		header_bytes = HEADER_LEN * 8
+		if create:
+			size = \
+				header_bytes + capacity * RECORD_DTYPE.itemsize \
+				+ 2 * levels * 2 * 8
+			self.shm = shared_memory.SharedMemory(create=True, size=size)
+		else:
+			# Processes started by multiprocessing share the creator's
+			# resource tracker, so attaching doesn't change who cleans up
+			self.shm = shared_memory.SharedMemory(name=name)
+		self.name = self.shm.name
+		buf = self.shm.buf
+		self.header = np.ndarray((HEADER_LEN,), dtype=np.int64, buffer=buf)
+		if create:
+			self.header[:] = 0
+			self.header[CAPACITY] = capacity
+			self.header[LEVELS] = levels
+		self.capacity = capacity = int(self.header[CAPACITY])
+		self.levels = levels = int(self.header[LEVELS])
+		ring_bytes = capacity * RECORD_DTYPE.itemsize
+		self.slots = np.ndarray(
+			(capacity,), dtype=RECORD_DTYPE, buffer=buf, offset=header_bytes
+		)
+		self.snapshot = np.ndarray(
+			(2, levels, 2), dtype=np.float64, buffer=buf,
+			offset=header_bytes + ring_bytes
+		)
+		if create:
+			self.slots['seq'] = -1
+
+	def publish(self, kind, side, price, size, book):
+		"""
+		Appends a record to the ring and rewrites the depth snapshot. Only
+		the market data process calls this.
+
+		Parameters:
+			kind: int
+				KIND_DELTA, KIND_SNAPSHOT or KIND_TRADE.
+			side: string
+				'buy' or 'sell' for deltas and trades (the maker's side),
+				ignored for snapshots.
+			price: float
+				Price of the level that changed, or of the trade.
+			size: float
+				New size at that price, 0 if the level was removed, or size
+				of the trade.
+			book: OrderBookWebSocket
+				Book after the update.
+
+		Returns:
+			None
+		"""
+
+		seq = int(self.header[WRITE_SEQ]) + 1
+		slot = self.slots[seq % self.capacity]
+		slot['seq'] = -1
+		slot['kind'] = kind
+		slot['side'] = SIDES.get(side, 0)
+		slot['price'] = price
+		slot['size'] = size
+		slot['best_buy_price'] = book.best_buy_price
+		slot['best_buy_size'] = book.best_buy_size
+		slot['best_sell_price'] = book.best_sell_price
+		slot['best_sell_size'] = book.best_sell_size
+		slot['time_ns'] = time.monotonic_ns()
+		slot['seq'] = seq
+
+		if kind == KIND_TRADE:
+			# Trades don't change the depth snapshot
+			self.header[WRITE_SEQ] = seq
+			return
+
+		bids = book.ob_buys[-self.levels:]
+		asks = book.ob_sells[:self.levels]
+		self.header[SNAPSHOT_VERSION] += 1
+		self.snapshot[0, :len(bids)] = bids
+		self.snapshot[1, :len(asks)] = asks
+		self.header[NUM_BIDS] = len(bids)
+		self.header[NUM_ASKS] = len(asks)
+		self.header[SNAPSHOT_SEQ] = seq
+		self.header[SNAPSHOT_VERSION] += 1
+
+		self.header[WRITE_SEQ] = seq
+
+	def publish_delta(self, side, price, size, book):
+		"""
+		Publishes a change to a single price level.
+
+		Parameters:
+			side: string
+				'buy' or 'sell'.
+			price: float
+				Price of the level that changed.
+			size: float
+				New size at that price, 0 if the level was removed.
+			book: OrderBookWebSocket
+				Book after the change.
+
+		Returns:
+			None
+		"""
+
+		self.publish(KIND_DELTA, side, price, size, book)
+
+	def publish_snapshot(self, book):
+		"""
+		Publishes that the book was rebuilt from a snapshot.
+
+		Parameters:
+			book: OrderBookWebSocket
+				Book after the rebuild.
+
+		Returns:
+			None
+		"""
+
+		self.publish(KIND_SNAPSHOT, None, 0.0, 0.0, book)
+
+	def publish_trade(self, side, price, size, book):
+		"""
+		Publishes a trade.
+
+		Parameters:
+			side: string
+				'buy' or 'sell', the maker's side.
+			price: float
+				Trade price.
+			size: float
+				Trade size.
+			book: OrderBookWebSocket
+				Book at the time of the trade.
+
+		Returns:
+			None
+		"""
+
+		self.publish(KIND_TRADE, side, price, size, book)
+
+	def read_snapshot(self):
+		"""
+		Consistent copy of the depth snapshot.
+
+		Returns:
+			seq: int
+				Sequence number of the last record the snapshot includes.
+			ob_buys: numpy.ndarray
+				Bids sorted from lowest to highest price.
+			ob_sells: numpy.ndarray
+				Asks sorted from lowest to highest price.
+		"""
+
+		while True:
+			version = self.header[SNAPSHOT_VERSION]
+			if version % 2:
+				continue
+			seq = int(self.header[SNAPSHOT_SEQ])
+			ob_buys = self.snapshot[0, :self.header[NUM_BIDS]].copy()
+			ob_sells = self.snapshot[1, :self.header[NUM_ASKS]].copy()
+			if self.header[SNAPSHOT_VERSION] == version:
+				return seq, ob_buys, ob_sells
+
+	def close(self, unlink=False):
+		"""
+		Detaches from the shared memory block.
+
+		Parameters:
+			unlink: bool
+				Also destroy the block. Only the creator should do this.
+
+		Returns:
+			None
+		"""
+
+		del self.header, self.slots, self.snapshot
+		self.shm.close()
+		if unlink:
+			self.shm.unlink()
+
+
+class RingReader:
+
+	def __init__(self, ring):
+		"""
+		Reads records from a MarketDataRing in sequence order, starting with
+		the next one published. Detects when the writer has lapped it and
+		resyncs from the depth snapshot.
+
+		Parameters:
+			ring: MarketDataRing
+				Ring to read.
+		"""
+
+		self.ring = ring
+		self.next_seq = int(ring.header[WRITE_SEQ]) + 1
+		self.overruns = 0
+
+	def poll(self):
+		"""
+		Reads the next record if it has been published.
+
+		Returns:
+			record: tuple or None
+				(kind, side, price, size, best_buy_price, best_buy_size,
+				best_sell_price, best_sell_size, time_ns), or None if there is
+				nothing new. After an overrun kind is KIND_RESYNC and the
+				caller should rebuild its state from ring.read_snapshot().
+		"""
+
+		seq = self.next_seq
+		slot = self.ring.slots[seq % self.ring.capacity]
+		slot_seq = slot['seq']
+		if slot_seq == seq:
+			record = (
+				int(slot['kind']), SIDE_NAMES.get(int(slot['side'])),
+				float(slot['price']), float(slot['size']),
+				float(slot['best_buy_price']), float(slot['best_buy_size']),
+				float(slot['best_sell_price']), float(slot['best_sell_size']),
+				int(slot['time_ns'])
+			)
+			# The writer may have started reusing the slot while it was read
+			if slot['seq'] == seq:
+				self.next_seq = seq + 1
+				return record
+		elif slot_seq < seq and self.ring.header[WRITE_SEQ] < seq:
+			# Not published yet
+			return None
+
+		# The writer lapped us, skip to the depth snapshot
+		self.overruns += 1
+		self.next_seq = int(self.ring.header[SNAPSHOT_SEQ]) + 1
+
+		return (KIND_RESYNC, None, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0)
+
+
+class RingBook:
+
+	def __init__(
+			self, ring, ob_updated_cond, logger, signal_levels=10,
+			trade_windows=(10, 60, 300), depth_levels=10):
+		"""
+		Stand-in for OrderBookWebSocket in a trading process when market data
+		is ingested by another process. A reader thread follows the
+		MarketDataRing and keeps the same attributes FIXTrader, Order and
+		strategies read off OrderBookWebSocket up to date, notifying
+		ob_updated_cond and the strategy engine the same way. ob_buys and
+		ob_sells are only refreshed from the depth snapshot when the top
+		levels change.
+
+		Also measures how long records take to cross the process boundary,
+		from publish to being applied here.
+
+		Parameters:
+			ring: MarketDataRing
+				Ring written by the market data process.
+			ob_updated_cond: threading.Condition
+				Notified when the best bid or ask price or size changes.
+			logger: Log
+				Used to log messages as needed.
+			signal_levels: int
+				Number of levels per side self.signals is computed over.
+			trade_windows: tuple
+				Lengths in seconds of the windows self.trades are computed
+				over, if the market data process publishes trades.
+			depth_levels: int
+				Number of levels per side self.depth keeps. It is only as
+				fresh as ob_buys and ob_sells, so levels past signal_levels
+				can lag.
+		"""
+
+		self.ring = ring
+		self.reader = RingReader(ring)
+		self.ob_updated_cond = ob_updated_cond
+		self.logger = logger
+		_, self.ob_buys, self.ob_sells = ring.read_snapshot()
+		self.best_buy_price = 0.0
+		self.best_buy_size = 0.0
+		self.best_sell_price = 0.0
+		self.best_sell_size = 0.0
+		self.recent_price = 0.0
+		self.signals = BookSignals(levels=signal_levels)
+		self.trades = TradeStats(windows=trade_windows)
+		self.depth = BookDepth(levels=depth_levels)
+		self.conflator = BookConflator()
+		self.bus = MarketDataBus()
+		self.strategy_engine = None
+		# Set by main when queue_keep_time is set
+		self.queue_estimator = None
+		# Metrics, only written by the reader thread
+		self.msgs_received = 0
+		self.update_time = Histogram()
+		self.lock_wait = Histogram()
+		# Set once the market data process has published a book both sides
+		# of which can be quoted against
+		self.ready = threading.Event()
+		self.ready_time = None
+		self.set_top_from_depth()
+		# Publish to apply latency
+		self.latency_count = 0
+		self.latency_total = 0
+		self.latency_max = 0
+		self.latency_samples = collections.deque(maxlen=4096)
+		self.running = True
+		self.reader_thread = threading.Thread(target=self.run, name='md_reader')
+
+	def start(self):
+		"""
+		Launches the reader thread.
+
+		Returns:
+			None
+		"""
+
+		self.reader_thread.start()
+
+	def close(self):
+		"""
+		Stops the reader thread.
+
+		Returns:
+			None
+		"""
+
+		self.running = False
+		self.reader_thread.join()
+
+	def set_top_from_depth(self):
+		"""
+		Sets best prices, sizes, signals and depth from self.ob_buys and
+		self.ob_sells.
+
+		Returns:
+			None
+		"""
+
+		if len(self.ob_buys) and len(self.ob_sells):
+			self.best_buy_price = self.ob_buys[-1, 0]
+			self.best_buy_size = self.ob_buys[-1, 1]
+			self.best_sell_price = self.ob_sells[0, 0]
+			self.best_sell_size = self.ob_sells[0, 1]
+			self.update_recent_price()
+			if not self.ready.is_set():
+				self.ready_time = time.monotonic()
+				self.ready.set()
+		self.signals.update_all(self.ob_buys, self.ob_sells)
+		self.depth.update(self.ob_buys, self.ob_sells)
+
+	def update_recent_price(self):
+		"""
+		Sets recent_price the way OrderBookWebSocket does: the last traded
+		price if trades are coming in, otherwise the mid price.
+
+		Returns:
+			None
+		"""
+
+		if self.trades.count:
+			self.recent_price = self.trades.last_price
+		else:
+			self.recent_price = (self.best_buy_price + self.best_sell_price) / 2
+
+	def run(self, idle_spins=1000, idle_sleep=.00005):
+		"""
+		Reader loop. Spins on the ring while records are arriving and backs
+		off to short sleeps when it goes quiet.
+
+		Parameters:
+			idle_spins: int
+				Empty polls before starting to sleep between polls.
+			idle_sleep: float
+				Seconds to sleep between polls once idle.
+
+		Returns:
+			None
+		"""
+
+		idle = 0
+		while self.running:
+			record = self.reader.poll()
+			if record is None:
+				idle += 1
+				if idle > idle_spins:
+					time.sleep(idle_sleep)
+				continue
+			idle = 0
+			self.apply(record)
+
+	def apply(self, record):
+		"""
+		Applies one ring record.
+
+		Parameters:
+			record: tuple
+				As returned by RingReader.poll().
+
+		Returns:
+			None
+		"""
+
+		kind, side, price, size, bbp, bbs, bsp, bss, time_ns = record
+		apply_start = time.monotonic()
+		self.msgs_received += 1
+		# Age and bus event times are measured from when the market data
+		# process received the update, time.monotonic() is system wide
+		receive_time = (time_ns or time.monotonic_ns()) / 1e9
+		# Trades age out of their windows even while none are printing
+		self.trades.expire(receive_time)
+
+		if kind == KIND_TRADE:
+			aggressor = 'sell' if side == 'buy' else 'buy'
+			self.trades.add(price, size, aggressor, receive_time)
+			self.update_recent_price()
+			self.bus.publish(Trade, receive_time, side, price, size, None)
+			if self.queue_estimator is not None:
+				self.queue_estimator.on_trade(side, price, size, receive_time)
+			return
+
+		with self.ob_updated_cond:
+			self.lock_wait.observe(time.monotonic() - apply_start)
+			old_top = (
+				self.best_buy_price, self.best_buy_size,
+				self.best_sell_price, self.best_sell_size
+			)
+			if kind == KIND_RESYNC:
+				self.logger.add('Market data ring overrun, resynced from snapshot')
+				_, self.ob_buys, self.ob_sells = self.ring.read_snapshot()
+				self.set_top_from_depth()
+				self.bus.publish(BookReset, receive_time, self.ob_buys, self.ob_sells)
+			else:
+				self.best_buy_price = bbp
+				self.best_buy_size = bbs
+				self.best_sell_price = bsp
+				self.best_sell_size = bss
+				self.update_recent_price()
+				# Depth is only copied out of shared memory when it changes
+				# what the signals are computed over
+				if kind == KIND_SNAPSHOT:
+					_, self.ob_buys, self.ob_sells = self.ring.read_snapshot()
+					self.set_top_from_depth()
+					self.bus.publish(BookReset, receive_time, self.ob_buys, self.ob_sells)
+				else:
+					if self.queue_estimator is not None:
+						self.queue_estimator.on_change(side, price, size, receive_time)
+					if self.signals.touches_top(side, price):
+						_, self.ob_buys, self.ob_sells = self.ring.read_snapshot()
+						self.signals.update_side(side, price, self.ob_buys, self.ob_sells)
+						self.depth.update(self.ob_buys, self.ob_sells)
+					self.bus.publish(BookDelta, receive_time, side, price, size)
+
+			new_top = (
+				self.best_buy_price, self.best_buy_size,
+				self.best_sell_price, self.best_sell_size
+			)
+			if old_top != new_top:
+				self.ob_updated_cond.notify_all()
+				self.bus.publish(TopOfBook, receive_time, *new_top)
+			if self.ready.is_set():
+				self.conflator.publish(self, receive_time)
+			if self.strategy_engine is not None and self.ready.is_set():
+				self.strategy_engine.on_book_update(self)
+		self.update_time.observe(time.monotonic() - apply_start)
+
+		if time_ns:
+			latency = time.monotonic_ns() - time_ns
+			self.latency_count += 1
+			self.latency_total += latency
+			if latency > self.latency_max:
+				self.latency_max = latency
+			self.latency_samples.append(latency)
+
+	def stats(self):
+		"""
+		Cross process latency and overrun counts.
+
+		Returns:
+			out: dict
+				Records applied, overruns, and mean, median, 99th percentile
+				and max publish to apply latency in microseconds.
+		"""
+
+		samples = np.array(self.latency_samples, dtype=np.float64)
+		if len(samples):
+			p50, p99 = (float(p) for p in np.percentile(samples, [50, 99]) / 1e3)
+		else:
+			p50 = p99 = 0.0
+
+		return {
+			'records': self.latency_count,
+			'overruns': self.reader.overruns,
+			'latency_mean_us': self.latency_total / max(self.latency_count, 1) / 1e3,
+			'latency_p50_us': p50,
+			'latency_p99_us': p99,
+			'latency_max_us': self.latency_max / 1e3,
+		}
+
+
+def run_market_data_process(
+		ring_name, order_book_products=['BTC-USD'], subscribe_matches=False,
+		ignore_cutoff_vol=None, feed_urls=None, feed_max_lag=.25):
+	"""
+	Entry point of the market data process. Runs OrderBookWebSocket and
+	publishes every book update into the MarketDataRing named ring_name.
+
+	Parameters:
+		ring_name: string
+			Name of the shared memory block created by the trading process.
+		order_book_products: list
+			Name(s) of pair(s) to subscribe to.
+		subscribe_matches, ignore_cutoff_vol, feed_urls, feed_max_lag:
+			Passed to OrderBookWebSocket. Trades are published into the
+			ring too.
+
+	Returns:
+		None
+	"""
+
+	logger = Log()
+	ring = MarketDataRing(name=ring_name)
+	orderbook_ws = OrderBookWebSocket(
+		threading.Condition(), logger, order_book_products=order_book_products,
+		subscribe_matches=subscribe_matches, ignore_cutoff_vol=ignore_cutoff_vol,
+		feed_urls=feed_urls, feed_max_lag=feed_max_lag
+	)
+	orderbook_ws.md_ring = ring
+	orderbook_ws.start()
+
+	next_stats_time = time.monotonic() + 60
+	while True:
+		time.sleep(1)
+		if orderbook_ws.feed_arbiter is not None and time.monotonic() > next_stats_time:
+			next_stats_time += 60
+			logger.add(f'Market data feed stats: {orderbook_ws.feed_arbiter.stats()}')
+		logger.flush()
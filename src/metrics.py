@@ -0,0 +1,455 @@
+import bisect
+import collections
+import gc
+import http.server
+import threading
+import time
+
+from .profiler import thread_cpu_times
+
+
+class Histogram:
+
+	def __init__(self, bounds=None):
+		"""
+		Latency histogram with fixed buckets. observe() is a bisect and a
+		few plain increments with no lock, so it can be called from any hot
+		path. Increments racing in from several threads can occasionally be
+		lost, which is fine for monitoring.
+
+		Parameters:
+			bounds: list
+				Ascending bucket upper bounds in seconds. Defaults to powers of
+				two from 1us to ~17s.
+		"""
+
+		if bounds is None:
+			bounds = [1e-6 * 2 ** i for i in range(25)]
+		self.bounds = bounds
+		# Last bucket counts values above every bound
+		self.counts = [0] * (len(bounds) + 1)
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self, value):
+		"""
+		Records a value.
+
+		Parameters:
+			value: float
+				Seconds.
+
+		Returns:
+			None
+		"""
+
+		self.counts[bisect.bisect_left(self.bounds, value)] += 1
+		self.count += 1
+		self.sum += value
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		"""
+		Serves the metrics in Prometheus text format at /metrics.
+
+		Returns:
+			None
+		"""
+
+		if self.path != '/metrics':
+			self.send_error(404)
+			return
+
+		body = self.server.render().encode()
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/plain; version=0.0.4')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		"""
+		Keeps scrapes out of stderr.
+
+		Returns:
+			None
+		"""
+
+		pass
+
+
+class MetricsServer(http.server.HTTPServer):
+
+	def __init__(self, port, host='127.0.0.1'):
+		"""
+		HTTP endpoint serving metrics in Prometheus text format from a
+		background thread. Nothing is computed on the hot path: the objects
+		being measured keep plain counters and Histograms as attributes and
+		the server reads them when scraped.
+
+		Parameters:
+			port: int
+				Port to listen on.
+			host: string
+				Address to listen on. Only localhost by default.
+		"""
+
+		super().__init__((host, port), MetricsHandler)
+		# (name, kind, help text, label name, read function or Histogram)
+		self.metrics = []
+		self.server_thread = threading.Thread(
+			target=self.serve_forever, name='metrics', daemon=True
+		)
+
+	def start(self):
+		"""
+		Launches the server's thread.
+
+		Returns:
+			None
+		"""
+
+		self.server_thread.start()
+
+	def add(self, name, kind, help_text, read, label=None):
+		"""
+		Adds a counter or gauge.
+
+		Parameters:
+			name: string
+				Metric name.
+			kind: string
+				'counter' or 'gauge'.
+			help_text: string
+				Description shown by Prometheus.
+			read: function
+				Called on every scrape. Returns the value, or a dict of label
+				value -> value if label is given.
+			label: string
+				Name of the label the values returned by read are keyed by.
+
+		Returns:
+			None
+		"""
+
+		self.metrics.append((name, kind, help_text, label, read))
+
+	def add_histogram(self, name, help_text, histogram, label=None):
+		"""
+		Adds a Histogram, or a family of them told apart by a label.
+
+		Parameters:
+			name: string
+				Metric name, conventionally ending in _seconds.
+			help_text: string
+				Description shown by Prometheus.
+			histogram: Histogram
+				Histogram to expose, or a dict of label value -> Histogram
+				if label is given.
+			label: string
+				Name of the label the Histograms are keyed by.
+
+		Returns:
+			None
+		"""
+
+		self.metrics.append((name, 'histogram', help_text, label, histogram))
+
+	def render(self):
+		"""
+		Formats every metric in Prometheus text format.
+
+		Returns:
+			text: string
+		"""
+
+		lines = []
+		for name, kind, help_text, label, read in self.metrics:
+			lines.append(f'# HELP {name} {help_text}')
+			lines.append(f'# TYPE {name} {kind}')
+			if kind == 'histogram':
+				histograms = {None: read} if label is None else read
+				for label_value, histogram in histograms.items():
+					labels = '' if label is None else f'{label}="{label_value}",'
+					suffix = '' if label is None else f'{{{label}="{label_value}"}}'
+					cumulative = 0
+					for bound, count in zip(histogram.bounds, histogram.counts):
+						cumulative += count
+						lines.append(f'{name}_bucket{{{labels}le="{bound:g}"}} {cumulative}')
+					lines.append(
+						f'{name}_bucket{{{labels}le="+Inf"}} {cumulative + histogram.counts[-1]}'
+					)
+					lines.append(f'{name}_sum{suffix} {histogram.sum}')
+					lines.append(f'{name}_count{suffix} {histogram.count}')
+				continue
+
+			try:
+				value = read()
+			except Exception:
+				# A metric that can't be read right now is left out
+				continue
+			if label is None:
+				lines.append(f'{name} {value}')
+			else:
+				for label_value, sample in list(value.items()):
+					lines.append(f'{name}{{{label}="{label_value}"}} {sample}')
+
+		return '\n'.join(lines) + '\n'
+
+
+def per_second(read_total):
+	"""
+	Turns a counter into a rate measured between consecutive scrapes.
+
+	Parameters:
+		read_total: function
+			Returns the counter's current value.
+
+	Returns:
+		read_rate: function
+			Returns the counter's increase per second since it was last
+			called.
+	"""
+
+	last = [time.monotonic(), read_total()]
+
+	def read_rate():
+		now, total = time.monotonic(), read_total()
+		rate = (total - last[1]) / max(now - last[0], 1e-9)
+		last[0], last[1] = now, total
+		return rate
+
+	return read_rate
+
+
+def register_metrics(server, orderbook_ws, fix_trader, account, logger, gc_tuner=None):
+	"""
+	Adds the bot's metrics to a MetricsServer.
+
+	Parameters:
+		server: MetricsServer
+			Server to add to.
+		orderbook_ws: OrderBookWebSocket or RingBook
+			Market data side.
+		fix_trader: FIXTrader
+			Order side.
+		account: GDAXAccount
+			For account lock waits.
+		logger: Log
+			For the log queue depth.
+		gc_tuner: GCTuner
+			For garbage collection pauses, if the bot runs one.
+
+	Returns:
+		None
+	"""
+
+	server.add(
+		'cryptobot_ws_messages_total', 'counter',
+		'Market data messages processed.', lambda: orderbook_ws.msgs_received
+	)
+	server.add(
+		'cryptobot_ws_messages_per_second', 'gauge',
+		'Market data messages processed per second since the last scrape.',
+		per_second(lambda: orderbook_ws.msgs_received)
+	)
+	server.add_histogram(
+		'cryptobot_book_update_seconds',
+		'Time from a market data message arriving to the book being updated.',
+		orderbook_ws.update_time
+	)
+	server.add(
+		'cryptobot_book_updates_conflated_total', 'counter',
+		'Book updates replaced before a conflated reader read them.',
+		lambda: orderbook_ws.conflator.conflated
+	)
+	server.add(
+		'cryptobot_bus_dropped_total', 'counter',
+		'Market data bus events dropped because a subscriber fell behind.',
+		lambda: {name: s['dropped'] for name, s in orderbook_ws.bus.stats().items()},
+		label='subscriber'
+	)
+	feed_arbiter = getattr(orderbook_ws, 'feed_arbiter', None)
+	if feed_arbiter is not None:
+		server.add(
+			'cryptobot_feed_wins_total', 'counter',
+			'Market data updates whose first copy arrived on each feed.',
+			lambda: {name: s['wins'] for name, s in feed_arbiter.stats().items()},
+			label='feed'
+		)
+		server.add(
+			'cryptobot_feed_lag_seconds', 'gauge',
+			'Average time each feed\'s copies arrive after the first copy.',
+			lambda: {name: s['lag_ms'] / 1e3 for name, s in feed_arbiter.stats().items()},
+			label='feed'
+		)
+		server.add(
+			'cryptobot_feed_reconnects_total', 'counter',
+			'Times each feed was dropped and reconnected.',
+			lambda: {name: s['reconnects'] for name, s in feed_arbiter.stats().items()},
+			label='feed'
+		)
+	tick_recorder = getattr(orderbook_ws, 'tick_recorder', None)
+	if tick_recorder is not None:
+		server.add(
+			'cryptobot_tick_rows_written_total', 'counter',
+			'Rows the tick recorder wrote to each table.',
+			lambda: dict(tick_recorder.rows_written), label='table'
+		)
+	sessions = fix_trader.sessions
+
+	def msgs_sent_by_type():
+		total = collections.Counter()
+		for session in sessions:
+			total.update(session.fix_writer.msgs_sent_by_type)
+		return dict(total)
+
+	book_verifier = getattr(orderbook_ws, 'book_verifier', None)
+	if book_verifier is not None:
+		server.add(
+			'cryptobot_book_checks_total', 'counter',
+			'Checks of the book against a reference snapshot.',
+			lambda: book_verifier.checks
+		)
+		server.add(
+			'cryptobot_book_checksum_mismatches_total', 'counter',
+			'Checks that found the book differing from the reference snapshot.',
+			lambda: book_verifier.mismatches
+		)
+		server.add(
+			'cryptobot_book_resyncs_total', 'counter',
+			'Times the book was rebuilt from a reference snapshot.',
+			lambda: book_verifier.resyncs
+		)
+	queue_estimator = fix_trader.queue_estimator
+	if queue_estimator is not None:
+		server.add(
+			'cryptobot_queue_tracked_orders', 'gauge',
+			'Live orders whose queue position is being estimated.',
+			lambda: len(queue_estimator.slots)
+		)
+		server.add(
+			'cryptobot_queue_kept_total', 'counter',
+			'Cancels skipped because the order was expected to fill soon.',
+			lambda: queue_estimator.kept
+		)
+	server.add(
+		'cryptobot_fix_messages_sent_total', 'counter',
+		'FIX messages sent over every session.', msgs_sent_by_type, label='type'
+	)
+	server.add(
+		'cryptobot_fix_messages_received_total', 'counter',
+		'FIX messages received.', lambda: dict(fix_trader.msgs_received_by_type),
+		label='type'
+	)
+	server.add(
+		'cryptobot_fix_send_queue_depth', 'gauge',
+		'Messages waiting for the FIX writer of each session.',
+		lambda: {session.index: len(session.fix_writer.pending) for session in sessions},
+		label='session'
+	)
+	server.add(
+		'cryptobot_fix_session_live_orders', 'gauge',
+		'Live orders routed to each FIX session.',
+		lambda: {session.index: session.live_orders for session in sessions},
+		label='session'
+	)
+	server.add(
+		'cryptobot_fix_session_up', 'gauge',
+		'1 if the FIX session is logged on and answering heartbeats.',
+		lambda: {
+			session.index: int(
+				session.logged_on.is_set() and session.heartbeat_manager.session_alive
+			)
+			for session in sessions
+		},
+		label='session'
+	)
+	server.add_histogram(
+		'cryptobot_fix_priority_wait_seconds',
+		'Time cancels, heartbeats and other priority messages waited to be sent.',
+		{session.index: session.fix_writer.priority_wait for session in sessions},
+		label='session'
+	)
+	server.add_histogram(
+		'cryptobot_fix_order_wait_seconds',
+		'Time new orders and other regular messages waited to be sent.',
+		{session.index: session.fix_writer.order_wait for session in sessions},
+		label='session'
+	)
+	server.add(
+		'cryptobot_fix_orders_dropped_total', 'counter',
+		'New orders dropped after waiting too long for the rate limit.',
+		lambda: {session.index: session.fix_writer.dropped for session in sessions},
+		label='session'
+	)
+	histograms = fix_trader.latency_tracker.histograms
+	server.add_histogram(
+		'cryptobot_order_ack_seconds',
+		'Time from an order being sent to GDAX acknowledging it.',
+		histograms['new_to_ack']
+	)
+	server.add_histogram(
+		'cryptobot_order_fill_seconds',
+		'Time from an order being sent to its first fill.',
+		histograms['new_to_first_fill']
+	)
+	server.add_histogram(
+		'cryptobot_order_cancel_seconds',
+		'Time from a cancel being sent to the order being canceled.',
+		histograms['cancel_to_canceled']
+	)
+	server.add(
+		'cryptobot_thread_cpu_seconds_total', 'counter',
+		'CPU time used by each thread, order threads summed.',
+		thread_cpu_times, label='thread'
+	)
+	server.add(
+		'cryptobot_risk_rejects_total', 'counter',
+		'Orders rejected by the pre-trade risk gate.',
+		lambda: dict(fix_trader.risk_gate.rejects), label='reason'
+	)
+	server.add(
+		'cryptobot_kill_switch', 'gauge',
+		'1 once the kill switch has stopped new orders.',
+		lambda: int(fix_trader.risk_gate.killed)
+	)
+	server.add(
+		'cryptobot_live_orders', 'gauge', 'Orders that are live.',
+		lambda: len(fix_trader.order_tracker.orders_by_cl_oid)
+	)
+	server.add(
+		'cryptobot_log_queue_depth', 'gauge',
+		'Log messages waiting to be written out.', logger.queue.qsize
+	)
+	server.add_histogram(
+		'cryptobot_book_lock_wait_seconds',
+		'Time the book writer waited for ob_updated_cond.',
+		orderbook_ws.lock_wait
+	)
+	server.add_histogram(
+		'cryptobot_account_lock_wait_seconds',
+		'Time spent waiting for the account lock.', account.lock_wait
+	)
+	if gc_tuner is not None:
+		server.add_histogram(
+			'cryptobot_gc_pause_seconds',
+			'Time garbage collections of each generation paused the process.',
+			gc_tuner.pauses, label='generation'
+		)
+		server.add(
+			'cryptobot_gc_scheduled_collections_total', 'counter',
+			'Full collections run by the scheduler while the market was quiet.',
+			lambda: gc_tuner.scheduled_collections
+		)
+		server.add(
+			'cryptobot_gc_forced_collections_total', 'counter',
+			'Scheduled collections run without waiting any longer for quiet.',
+			lambda: gc_tuner.deferred_collections
+		)
+		server.add(
+			'cryptobot_gc_frozen_objects', 'gauge',
+			'Objects frozen out of garbage collection.', gc.get_freeze_count
+		)
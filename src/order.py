@@ -1,14 +1,20 @@
 import sys
 import threading
+import time
 import uuid
 import queue
 
+from .profiler import record_thread_exit
+from .queue_position import level_size
+from .session_journal import ORDER_CANCEL_REQUESTED, ORDER_CLOSED, ORDER_NEW, ORDER_OPEN
 from .truncate import truncate
 
 
 class Order:
 
-	def __init__(self, price, size, order_type, fix_trader):
+	def __init__(
+			self, price, size, order_type, fix_trader, batched=False,
+			strategy=None, recovered=None, session=None):
 		"""
 		Order holds all information needed to make an order and keep tabs
 		on the state of that order (for example, when the order is partially
@@ -27,6 +33,20 @@ class Order:
 			fix_trader; FIXTrader
 				A copy of fix_trader is kept to access information like
 				account, order_tracker, account holdings, etc.
+			batched: bool
+				True if fix_trader submits this order as part of a New Order
+				Batch, in which case the order doesn't send itself.
+			strategy: Strategy
+				Strategy plugin that placed this order, if any. Such orders
+				leave the decision to cancel to their strategy instead of
+				running volume_side_strategy().
+			recovered: tuple
+				(client_order_id, order_id, cumulative_filled) of an order
+				recovered from the session journal after a restart. The
+				order is already live, so it isn't sent again.
+			session: FIXSession
+				Session the order is sent over, and its cancels and status
+				requests after it. Routed by fix_trader if not given.
 		"""
 
 		self.logger = fix_trader.logger
@@ -37,16 +57,49 @@ class Order:
 		self.size = truncate(size, 8)  # Truncating mitigates precision errors
 		self.order_type = order_type
 		self.fix_trader = fix_trader
-		self.client_order_id = str(uuid.uuid4())
-		self.fix_trader.order_tracker.orders_by_cl_oid_lock.acquire()
-		self.fix_trader.order_tracker.orders_by_cl_oid[self.client_order_id] = self
-		self.fix_trader.order_tracker.orders_by_cl_oid_lock.release()
+		self.batched = batched
+		self.strategy = strategy
+		if session is None:
+			session = fix_trader.route_order()
+		self.session = session
+		self.session.add_order()
+		self.cancel_requested = False
+		self.recovered = recovered is not None
 		self.order_state = None
 		self.strategy_state = None
 		self.filled_this_msg = 0
 		self.cumulative_filled = 0
+		if self.recovered:
+			self.client_order_id, self.order_id, self.cumulative_filled = recovered
+			# Admitted before the restart
+			with self.fix_trader.risk_gate.gate_lock:
+				self.fix_trader.risk_gate.reserve(
+					self.order_type, self.price, self.size - self.cumulative_filled
+				)
+		else:
+			self.client_order_id = str(uuid.uuid4())
+		self.fix_trader.order_tracker.orders_by_cl_oid_lock.acquire()
+		self.fix_trader.order_tracker.orders_by_cl_oid[self.client_order_id] = self
+		self.fix_trader.order_tracker.orders_by_cl_oid_lock.release()
+		if self.order_id is not None:
+			self.fix_trader.order_tracker.order_by_oid_lock.acquire()
+			self.fix_trader.order_tracker.orders_by_oid[self.order_id] = self
+			self.fix_trader.order_tracker.order_by_oid_lock.release()
+		if not self.recovered:
+			self.journal(ORDER_NEW)
+		if self.strategy is not None:
+			self.strategy.open_orders.add(self)
+		# volume_side_strategy() only ever looks at the latest book
+		self.book_reader = self.fix_trader.orderbook_ws.conflator.subscribe()
+		self.timeout_timer = None
+		if self.fix_trader.order_timeout is not None:
+			self.timeout_timer = self.fix_trader.scheduler.schedule(
+				self.fix_trader.order_timeout, self.on_timeout
+			)
 		self.logger.add('Launching run method of new order object')
-		threading.Thread(target=self.run).start()
+		# Only waits on this order's messages, and live orders are recovered
+		# from the journal after a restart, so it mustn't hold up exit
+		threading.Thread(target=self.run, name='order', daemon=True).start()
 
 	def __repr__(self):
 		"""
@@ -72,53 +125,62 @@ class Order:
 		Returns:
 			None
 		"""
-		self.fix_trader.request(
-			'order', order_type=self.order_type,
-			order_size=self.size, order_price=self.price,
-			client_order_id=self.client_order_id
-		)
+		if not self.batched and not self.recovered:
+			self.fix_trader.request(
+				'order', order_type=self.order_type,
+				order_size=self.size, order_price=self.price,
+				client_order_id=self.client_order_id, session=self.session
+			)
 
-		# Check if order was rejected
-		msg = self.msgs.get()
+		# Recovered orders were acknowledged before the restart
+		if not self.recovered:
+			# Check if order was rejected
+			msg = self.msgs.get()
 
-		if 'OrdStatus' in msg and msg['OrdStatus'] == 'Rejected':
-			try:
-				ord_rej_reason = msg['OrdRejReason']
-			except KeyError:
-				ord_rej_reason = msg['Text']
+			if 'OrdStatus' in msg and msg['OrdStatus'] == 'Rejected':
+				try:
+					ord_rej_reason = msg['OrdRejReason']
+				except KeyError:
+					ord_rej_reason = msg['Text']
 
-			if ord_rej_reason == 'Insufficient funds':
-				self.logger.add('Insufficient funds! Updating account holdings')
-				# Calculated holdings incorrectly, update over REST
-				with self.fix_trader.account.account_lock:
-					usd, btc = self.fix_trader.account.get_account_holdings()
-					self.fix_trader.account.usd = usd
-					self.fix_trader.account.btc = btc
+				if ord_rej_reason == 'Insufficient funds':
+					self.logger.add('Insufficient funds! Updating account holdings')
+					# Calculated holdings incorrectly, update over REST
+					self.fix_trader.account.refresh_holdings()
 
-			self.order_destructor()
+				self.order_destructor()
 
 		self.order_state = 'open'
-		self.strategy_state = self.volume_side_strategy()
+		self.journal(ORDER_OPEN)
+		self.track_queue_position()
+		self.strategy_state = self.check_strategy()
 		while self.order_state == 'open' and self.strategy_state == 'valid':
 			# Message related stuff
+			# Orders placed by a strategy plugin have nothing else to do
+			# but wait for messages
 			try:
-				msg = self.msgs.get(block=False)
+				msg = self.msgs.get(block=self.strategy is not None)
 				self.order_state, self.filled_this_msg = self.figure_order_state(msg)
 				self.cumulative_filled += self.filled_this_msg
 				self.update_holdings(self.filled_this_msg)
+				if self.filled_this_msg:
+					self.journal(ORDER_OPEN)
+					if self.fix_trader.queue_estimator is not None:
+						self.fix_trader.queue_estimator.on_fill(
+							self.client_order_id, self.filled_this_msg
+						)
 
 			except queue.Empty:
 				pass
 
 			finally:
 				# Strategy related stuff
-				self.strategy_state = self.volume_side_strategy()
+				self.strategy_state = self.check_strategy()
 
 		if self.order_state != 'filled':
-			self.fix_trader.request(
-				'cancel', order_id=self.order_id,
-				client_order_id=self.client_order_id
-			)
+			# Already canceled, or a batch cancel is on its way
+			if self.order_state != 'canceled':
+				self.request_cancel()
 
 			while self.order_state != 'filled' and self.order_state != 'canceled':
 				# Message related stuff
@@ -141,17 +203,132 @@ class Order:
 		Returns:
 			None
 		"""
-		self.fix_trader.order_tracker.orders_by_cl_oid_lock.acquire()
-		del self.fix_trader.order_tracker.orders_by_cl_oid[self.client_order_id]
-		self.fix_trader.order_tracker.orders_by_cl_oid_lock.release()
-
-		self.fix_trader.order_tracker.order_by_oid_lock.acquire()
-		del self.fix_trader.order_tracker.orders_by_oid[self.order_id]
-		self.fix_trader.order_tracker.order_by_oid_lock.release()
+		# Release the order's tracker, session and queue state first, so
+		# nothing below raising can leak a live_orders count. Orders
+		# rejected before GDAX acknowledged them (including ones the rate
+		# limiter dropped) never got an order_id.
+		with self.fix_trader.order_tracker.orders_by_cl_oid_lock:
+			self.fix_trader.order_tracker.orders_by_cl_oid.pop(self.client_order_id, None)
+		with self.fix_trader.order_tracker.order_by_oid_lock:
+			self.fix_trader.order_tracker.orders_by_oid.pop(self.order_id, None)
+		self.session.remove_order()
+		if self.fix_trader.queue_estimator is not None:
+			self.fix_trader.queue_estimator.remove(self.client_order_id)
+
+		if self.timeout_timer is not None:
+			self.fix_trader.scheduler.cancel(self.timeout_timer)
+		self.journal(ORDER_CLOSED)
+		self.fix_trader.risk_gate.on_close(
+			self.order_type, self.price, max(self.size - self.cumulative_filled, 0.0)
+		)
 
 		self.logger.add('Exiting Order Thread')
+		record_thread_exit()
 		sys.exit()
 
+	def journal(self, state):
+		"""
+		Records the order's state in fix_trader's session journal, if it
+		has one.
+
+		Parameters:
+			state: int
+				One of the session_journal.ORDER_* states.
+
+		Returns:
+			None
+		"""
+		if self.fix_trader.journal is not None:
+			self.fix_trader.journal.record_order(self, state)
+
+	def track_queue_position(self):
+		"""
+		Starts estimating the order's queue position once it is live, if
+		fix_trader has a QueuePositionEstimator. Everything on the book at
+		the order's price is taken to be ahead of it, and until the queue
+		has been seen moving it is assumed to move at the rate trades have
+		been hitting the order's side of the book.
+
+		Returns:
+			None
+		"""
+		estimator = self.fix_trader.queue_estimator
+		if estimator is None:
+			return
+
+		book = self.fix_trader.orderbook_ws
+		trades = book.trades
+		# Bids are hit by sellers and asks lifted by buyers
+		if self.order_type == 'buy':
+			hitting = (trades.volume[0] - trades.signed_volume[0]) / 2
+		else:
+			hitting = (trades.volume[0] + trades.signed_volume[0]) / 2
+		estimator.add(
+			self.client_order_id, self.order_type, self.price,
+			self.size - self.cumulative_filled,
+			level_size(book, self.order_type, self.price), time.monotonic(),
+			prior_rate=hitting / trades.windows[0]
+		)
+
+	def keep_queue_position(self, book):
+		"""
+		Whether the order should stay on the book even though its strategy
+		would cancel it, because it is far enough up the queue to be
+		expected to fill within the estimator's keep_time. A replacement
+		would start at the back of the queue.
+
+		Parameters:
+			book: OrderBookWebSocket, RingBook or BookSnapshot
+				Current book.
+
+		Returns:
+			keep: bool
+		"""
+		estimator = self.fix_trader.queue_estimator
+		if estimator is None:
+			return False
+
+		return estimator.keep(self.client_order_id, book, time.monotonic())
+
+	def on_timeout(self):
+		"""
+		Scheduler callback that cancels the order once it has been live for
+		fix_trader.order_timeout seconds. The order's thread sees the cancel
+		go through like any other.
+
+		Returns:
+			None
+		"""
+		if self.order_state == 'open' and not self.cancel_requested:
+			self.logger.add(f'Order {self.client_order_id} timed out, canceling')
+			self.request_cancel()
+
+	def request_cancel(self, send=True):
+		"""
+		Marks the order as being canceled, journals it and sends the
+		cancel. Does nothing if a cancel was already requested.
+
+		Parameters:
+			send: bool
+				False if the caller sends the cancel itself, in a batch.
+
+		Returns:
+			requested: bool
+				False if a cancel had already been requested.
+		"""
+		if self.cancel_requested:
+			return False
+
+		self.cancel_requested = True
+		self.journal(ORDER_CANCEL_REQUESTED)
+		if send:
+			self.fix_trader.request(
+				'cancel', order_id=self.order_id,
+				client_order_id=self.client_order_id, session=self.session
+			)
+
+		return True
+
 	def update_holdings(self, amount_filled):
 		"""
 		Updates account holdings to reflect order fills.
@@ -164,7 +341,9 @@ class Order:
 			None
 		"""
 		if amount_filled > 0:
+			lock_start = time.monotonic()
 			with self.fix_trader.account.account_lock:
+				self.fix_trader.account.lock_wait.observe(time.monotonic() - lock_start)
 				usd_change = self.price * amount_filled
 				btc_change = amount_filled
 				self.logger.add(
@@ -177,6 +356,22 @@ class Order:
 				elif self.order_type == 'sell':
 					self.fix_trader.account.usd += usd_change
 					self.fix_trader.account.btc -= btc_change
+			self.fix_trader.risk_gate.on_fill(self.order_type, self.price, amount_filled)
+
+	def check_strategy(self):
+		"""
+		Determines if the order is still 'valid'. Orders placed by a
+		strategy plugin are canceled by their strategy through
+		StrategyEngine, so they stay 'valid' here.
+
+		Returns:
+			out_msg: string
+				'valid' or 'invalid'.
+		"""
+		if self.strategy is not None:
+			return 'valid'
+
+		return self.volume_side_strategy()
 
 	def volume_side_strategy(self):
 		"""
@@ -186,35 +381,37 @@ class Order:
 		on if it's a buy or sell order) and by whether the order is on the side
 		of the order book with the most volume at that most competitive price.
 		This is used to decide if the order should be canceled since the
-		strategy criteria are no longer met.
+		strategy criteria are no longer met, unless the order is expected to
+		fill soon from where it is in the queue.
 
 		Returns:
 			out_msg: string
 				'valid' or 'invalid'. Whether the
 		"""
-		self.fix_trader.ob_updated_cond.acquire()
-		self.fix_trader.ob_updated_cond.wait()
+		# Wait for the book to change. If it changed several times since the
+		# last check, only the latest book matters.
+		book = self.book_reader.read()
 
 		if self.order_type == 'buy':
-			current_price = self.fix_trader.orderbook_ws.best_buy_price
+			current_price = book.best_buy_price
 		else:
-			current_price = self.fix_trader.orderbook_ws.best_sell_price
+			current_price = book.best_sell_price
 
 		if self.price != current_price:
-			self.logger.add('Order outbid')
-			out_msg = 'invalid'
-		elif self.fix_trader.orderbook_ws.best_buy_size > self.fix_trader.orderbook_ws.best_sell_size \
-				and self.order_type != 'buy':
-			self.logger.add('Strategy no longer valid')
-			out_msg = 'invalid'
-		elif self.fix_trader.orderbook_ws.best_buy_size < self.fix_trader.orderbook_ws.best_sell_size \
-				and self.order_type != 'sell':
-			self.logger.add('Strategy no longer valid')
-			out_msg = 'invalid'
+			reason = 'Order outbid'
+		elif book.best_buy_size > book.best_sell_size and self.order_type != 'buy':
+			reason = 'Strategy no longer valid'
+		elif book.best_buy_size < book.best_sell_size and self.order_type != 'sell':
+			reason = 'Strategy no longer valid'
 		else:
-			out_msg = 'valid'
+			return 'valid'
+
+		# Canceling to re-quote would lose the order's place in the queue
+		if self.keep_queue_position(book):
+			return 'valid'
 
-		self.fix_trader.ob_updated_cond.release()
+		self.logger.add(reason)
+		out_msg = 'invalid'
 
 		return out_msg
 
@@ -1,15 +1,30 @@
+import collections
 import json
+import threading
+import time
 
 import gdax
 import numpy as np
 import websocket
 
+from .book_checksum import BookChecksum
+from .book_conflator import BookConflator
+from .book_depth import BookDepth
+from .book_signals import BookSignals
+from .feed_arbiter import FeedArbiter
+from .md_bus import BookDelta, BookReset, L2Change, MarketDataBus, TopOfBook, Trade
+from .metrics import Histogram
+from .trade_stats import TradeStats
+
 
 class OrderBookWebSocket(gdax.WebsocketClient):
 
 	def __init__(
 			self, ob_updated_cond, logger,
-			order_book_products=['BTC-USD'], ignore_cutoff=.01):
+			order_book_products=['BTC-USD'], ignore_cutoff=.01,
+			signal_levels=10, subscribe_matches=False, trade_windows=(10, 60, 300),
+			ignore_cutoff_vol=None, feed_urls=None, feed_max_lag=.25,
+			feed_stale_timeout=5.0, checksum_levels=10, depth_levels=10):
 		"""
 		Processes order book messages coming from the web socket.
 
@@ -36,6 +51,32 @@ class OrderBookWebSocket(gdax.WebsocketClient):
 				e.g. ignore_cutoff = .01 means only orders within 1% of
 				the recently traded price will be placed in the order book.
 				This helps keep the order book small and speedy.
+			signal_levels: int
+				Number of levels per side that self.signals (depth weighted
+				imbalance, microprice, etc.) are computed over.
+			subscribe_matches: bool
+				Also subscribe to the matches channel. Trades then keep
+				self.trades (VWAP, volatility, etc.) up to date and
+				recent_price becomes the last traded price instead of the
+				mid price.
+			trade_windows: tuple
+				Lengths in seconds of the windows self.trades are computed
+				over.
+			ignore_cutoff_vol: float
+				If given, widens the ignore_cutoff band to this many times the
+				realized volatility over the longest trade window when the
+				market is moving fast. Needs subscribe_matches.
+			feed_urls: list
+				If given, the feed is received over one connection per URL
+				(the same URL may be repeated) instead of a single one, and
+				self.feed_arbiter applies whichever copy of every update
+				arrives first.
+			feed_max_lag, feed_stale_timeout: float
+				Passed to FeedArbiter as max_lag and stale_timeout.
+			checksum_levels: int
+				Number of levels per side self.book_checksum covers.
+			depth_levels: int
+				Number of levels per side self.depth keeps.
 		"""
 
 		super(OrderBookWebSocket, self).__init__(
@@ -43,64 +84,110 @@ class OrderBookWebSocket(gdax.WebsocketClient):
 		)
 		self.logger = logger
 		self.ob_updated_cond = ob_updated_cond
-		# Ping GDAX to get initial values for order book, best prices and sizes
-		# and recent prices
-		# We rebuild these values from the order book snapshot we receive as
-		# the first message in our websocket subscription
-		self.ob_buys, self.ob_sells = self.setup_order_books()
-		self.best_buy_price = self.ob_buys[-1, 0]
-		self.best_buy_size = self.ob_buys[-1, 1]
-		self.best_sell_price = self.ob_sells[0, 0]
-		self.best_sell_size = self.ob_sells[0, 1]
+		# The book is built from the snapshot that is the first message of
+		# the level2 subscription. Until it arrives the book is empty and
+		# changes are ignored.
+		self.ob_buys = np.zeros((0, 2))
+		self.ob_sells = np.zeros((0, 2))
+		self.best_buy_price = 0.0
+		self.best_buy_size = 0.0
+		self.best_sell_price = 0.0
+		self.best_sell_size = 0.0
 		self.ignore_cutoff = ignore_cutoff
 		self.ignore_cutoff_lower = 1 - self.ignore_cutoff
 		self.ignore_cutoff_upper = 1 + self.ignore_cutoff
-		# Assume the recently traded price is the average of the bid and ask
-		# (We just need a number to start with before the official numbers
-		#  come in through the WebSocket)
-		self.recent_price = (self.best_buy_price + self.best_sell_price) / 2
-		self.recent_price_lower = self.ignore_cutoff_lower * self.recent_price
-		self.recent_price_upper = self.ignore_cutoff_upper * self.recent_price
-
-	def setup_order_books(self):
+		self.ignore_cutoff_vol = ignore_cutoff_vol
+		self.subscribe_matches = subscribe_matches
+		# Rolling trade stats, empty unless subscribed to matches
+		self.trades = TradeStats(windows=trade_windows)
+		self.recent_price = 0.0
+		self.recent_price_lower = 0.0
+		self.recent_price_upper = 0.0
+		# Set once the snapshot has been applied and both sides of the book
+		# can be quoted against
+		self.ready = threading.Event()
+		self.ready_time = None
+		# Multi-level signals, kept up to date on every book change so
+		# strategies only ever read attributes
+		self.signals = BookSignals(levels=signal_levels)
+		# Checksum of the top levels, compared against reference snapshots
+		# by a BookVerifier
+		self.book_checksum = BookChecksum(levels=checksum_levels)
+		# Reference snapshot a BookVerifier wants the book rebuilt from.
+		# Only this thread writes the book, so it applies the snapshot
+		# before the next message.
+		self.pending_resync = collections.deque(maxlen=1)
+		# Top levels for consumers that want depth, read without copies
+		# through read-only views that stay valid across updates
+		self.depth = BookDepth(levels=depth_levels)
+		# Latest book for consumers that read through a ConflatedReader
+		self.conflator = BookConflator()
+		# Typed events for any number of subscribers (recorders, signal
+		# engines, exporters) that mustn't slow this thread down
+		self.bus = MarketDataBus()
+		# Metrics, only written by this thread
+		self.msgs_received = 0
+		self.update_time = Histogram()
+		self.lock_wait = Histogram()
+		# Set by main when strategy plugins are in use. Called on every book
+		# update from this thread.
+		self.strategy_engine = None
+		# Set by main when queue_keep_time is set. Sees every level2 change
+		# and trade from this thread, before they are applied to the book.
+		self.queue_estimator = None
+		# Set in the market data process when market data runs in its own
+		# process, every update is published into it
+		self.md_ring = None
+		# Redundant connections, None when the feed comes over a single one
+		self.feed_arbiter = None
+		if feed_urls:
+			self.feed_arbiter = FeedArbiter(
+				self, feed_urls, self.subscription(), logger,
+				stale_timeout=feed_stale_timeout, max_lag=feed_max_lag
+			)
+
+	def start(self):
 		"""
-		Grabs the 50 most competitive bids and asks via REST call through the
-		public GDAX client to get the bids and asks order books populated.
+		Starts gdax.WebsocketClient's thread and names it so profiles and
+		CPU time reports can tell it apart, or the feed arbiter's
+		connections if there are several.
 
 		Returns:
-			ob_buys: numpy.ndarray
-				Array of arrays of length 2 which contain price in the 0th
-				index and size in the 1st index. Sorted from lowest to
-				highest price so the most competitive buy price is the
-				last element.
-			ob_sells: numpy.ndarray
-				Array of arrays of length 2 which contain price in the 0th
-				index and size in the 1st index. Sorted from lowest to
-				highest price so the most competitive sell price is the
-				first element.
+			None
 		"""
 
-		# Ping for the top 50 bids and asks to get the order book populated
-		# pinged_order_book is a list of lists of length 3
-		# [<price>, <size>, <# of people who have an order at this price>]
-		public_client = gdax.PublicClient()
-		pinged_order_book = public_client.get_product_order_book(
-			'BTC-USD', level=2
-		)
+		if self.feed_arbiter is not None:
+			self.feed_arbiter.start()
+			return
 
-		# Trim off the number of people who have an order at a given price
-		ob_buys = np.array(
-			[np.float64(item[:2]) for item in pinged_order_book['bids']]
-		)
-		ob_sells = np.array(
-			[np.float64(item[:2]) for item in pinged_order_book['asks']]
-		)
+		super(OrderBookWebSocket, self).start()
+		self.thread.name = 'websocket'
+
+	def close(self):
+		"""
+		Disconnects from the feed.
+
+		Returns:
+			None
+		"""
 
-		# Sort by price in ascending order
-		ob_buys.sort(axis=0)
-		ob_sells.sort(axis=0)
+		if self.feed_arbiter is not None:
+			self.feed_arbiter.close()
+		else:
+			super(OrderBookWebSocket, self).close()
 
-		return ob_buys, ob_sells
+	def subscription(self):
+		"""
+		Returns:
+			sub_params: dict
+				Subscribe message for the channels this book needs.
+		"""
+
+		return {
+			"type": "subscribe",
+			"product_ids": self.products,
+			"channels": ['level2', 'matches'] if self.subscribe_matches else ['level2']
+		}
 
 	def _connect(self):
 		"""
@@ -122,12 +209,7 @@ class OrderBookWebSocket(gdax.WebsocketClient):
 		self.ws = websocket.create_connection(self.url)
 		self.stop = False
 
-		sub_params = {
-			"type": "subscribe",
-			"product_ids": self.products,
-			"channels": ['level2']
-		}
-		self.ws.send(json.dumps(sub_params))
+		self.ws.send(json.dumps(self.subscription()))
 
 		# sub_params = {'type': 'subscribe', 'product_ids': self.products}
 		# self.ws.send(json.dumps(sub_params))
@@ -135,6 +217,57 @@ class OrderBookWebSocket(gdax.WebsocketClient):
 			sub_params = {"type": "heartbeat", "on": True}
 			self.ws.send(json.dumps(sub_params))
 
+	def update_recent_price(self):
+		"""
+		Updates recent_price, the last traded price if trades are coming in
+		and otherwise the mid price, and the ignore_cutoff band around it.
+
+		Returns:
+			None
+		"""
+
+		if self.trades.count:
+			self.recent_price = self.trades.last_price
+		else:
+			self.recent_price = (self.best_buy_price + self.best_sell_price) / 2
+
+		if self.ignore_cutoff_vol is None:
+			self.recent_price_lower = self.ignore_cutoff_lower * self.recent_price
+			self.recent_price_upper = self.ignore_cutoff_upper * self.recent_price
+		else:
+			cutoff = max(
+				self.ignore_cutoff, self.ignore_cutoff_vol * self.trades.volatility[-1]
+			)
+			self.recent_price_lower = (1 - cutoff) * self.recent_price
+			self.recent_price_upper = (1 + cutoff) * self.recent_price
+
+	def on_match(self, msg, receive_time):
+		"""
+		Handles a trade from the matches channel.
+
+		Parameters:
+			msg: dict
+				'match' or 'last_match' message. side is the maker's side.
+			receive_time: float
+				time.monotonic() at which the message arrived.
+
+		Returns:
+			None
+		"""
+
+		price = float(msg['price'])
+		size = float(msg['size'])
+		# The taker is on the other side of the maker
+		aggressor = 'sell' if msg['side'] == 'buy' else 'buy'
+		self.trades.add(price, size, aggressor, receive_time)
+		if self.ready.is_set():
+			self.update_recent_price()
+		self.bus.publish(Trade, receive_time, msg['side'], price, size, msg.get('trade_id'))
+		if self.queue_estimator is not None:
+			self.queue_estimator.on_trade(msg['side'], price, size, receive_time)
+		if self.md_ring is not None:
+			self.md_ring.publish_trade(msg['side'], price, size, self)
+
 	def on_message(self, msg):
 		"""
 		Overwrites on_message method of gdax.WebsocketClient for more
@@ -152,113 +285,159 @@ class OrderBookWebSocket(gdax.WebsocketClient):
 			None
 		"""
 
+		if self.pending_resync:
+			self.on_message(self.pending_resync.popleft())
+
+		receive_time = time.monotonic()
+		self.msgs_received += 1
+		# Trades age out of their windows even while none are printing
+		self.trades.expire(receive_time)
+
+		if msg.get('type') in ('match', 'last_match'):
+			self.on_match(msg, receive_time)
+			return
+
 		# Update book if there are coins to be traded at the price
 		# Drop row if there are no more coins to be traded at that price
 		# to keep the order book small for efficiency
-		self.ob_updated_cond.acquire()
-		old_best_buy_price = self.best_buy_price
-		old_best_buy_size = self.best_buy_size
-		old_best_sell_price = self.best_sell_price
-		old_best_sell_size = self.best_sell_size
-
-		try:
-			if 'changes' in msg:
-				info = msg['changes'][0]
-				side = info[0]
-				price = np.float64(info[1])
-				size = np.float64(info[2])
-				if size != 0:
-					if self.recent_price_lower < price < self.recent_price_upper:
-						# Update order_book
-						new = np.array([[price, size]], dtype=np.float64)
+		# Released even if a strategy raises, or every order thread waiting
+		# on the condition would hang
+		with self.ob_updated_cond:
+			self.lock_wait.observe(time.monotonic() - receive_time)
+			old_best_buy_price = self.best_buy_price
+			old_best_buy_size = self.best_buy_size
+			old_best_sell_price = self.best_sell_price
+			old_best_sell_size = self.best_sell_size
+
+			try:
+				if 'changes' in msg and self.ready.is_set():
+					# An update can carry several changes, each is applied in turn
+					for side, price, size in msg['changes']:
+						price = np.float64(price)
+						size = np.float64(size)
+						self.bus.publish(L2Change, receive_time, side, price, size)
+						if self.queue_estimator is not None:
+							self.queue_estimator.on_change(side, price, size, receive_time)
+						before = self.ob_buys if side == 'buy' else self.ob_sells
+						if size != 0:
+							if self.recent_price_lower < price < self.recent_price_upper:
+								# Update order_book
+								new = np.array([[price, size]], dtype=np.float64)
+								if side == 'buy':
+									# Note that we have to drop the old price or else
+									# we have multiples of the same prices and the
+									# order sizes are inaccurate
+									self.ob_buys = self.ob_buys[
+										self.ob_buys[:, 0] != price]
+									insert_ind = self.ob_buys[:, 0].searchsorted(price)
+									self.ob_buys = np.concatenate((
+										self.ob_buys[:insert_ind], new, self.ob_buys[insert_ind:]
+									))
+								else:
+									self.ob_sells = self.ob_sells[
+										self.ob_sells[:, 0] != price]
+									insert_ind = self.ob_sells[:, 0].searchsorted(price)
+									self.ob_sells = np.concatenate((
+										self.ob_sells[:insert_ind], new, self.ob_sells[insert_ind:]
+									))
+						else:
+							# Remove row with that price (might exist, might not)
+							# Nothing changes if it doesn't exist in the ob
+							if side == 'buy':
+								self.ob_buys = self.ob_buys[self.ob_buys[:, 0] != price]
+							else:
+								self.ob_sells = self.ob_sells[self.ob_sells[:, 0] != price]
+
+						# Limit the size of order book to 50 to keep array operations
+						# speedy
+						if side == 'buy':
+							# Best buy prices are in the last X rows of the order book
+							self.ob_buys = self.ob_buys[-50:]
+						else:
+							# Best sell prices are in the first X rows of the order book
+							self.ob_sells = self.ob_sells[:50]
+
+						# Update the best bid and ask prices here so that when we see
+						# opportunity, we already have the buy/sell at numbers crunched
 						if side == 'buy':
-							# Note that we have to drop the old price or else
-							# we have multiples of the same prices and the
-							# order sizes are inaccurate
-							self.ob_buys = self.ob_buys[
-								self.ob_buys[:, 0] != price]
-							insert_ind = self.ob_buys[:, 0].searchsorted(price)
-							self.ob_buys = np.concatenate(
-								(self.ob_buys[:insert_ind], new, self.ob_buys[insert_ind:])
-							)
+							self.best_buy_price = self.ob_buys[-1, 0]
+							self.best_buy_size = self.ob_buys[-1, 1]
 						else:
-							self.ob_sells = self.ob_sells[
-								self.ob_sells[:, 0] != price]
-							insert_ind = self.ob_sells[:, 0].searchsorted(price)
-							self.ob_sells = np.concatenate(
-								(self.ob_sells[:insert_ind], new, self.ob_sells[insert_ind:])
-							)
-				else:
-					# Remove row with that price (might exist, might not)
-					# Nothing changes if it doesn't exist in the ob
-					if side == 'buy':
-						self.ob_buys = self.ob_buys[self.ob_buys[:, 0] != price]
-					else:
-						self.ob_sells = self.ob_sells[self.ob_sells[:, 0] != price]
-
-				# Limit the size of order book to 50 to keep array operations
-				# speedy
-				if side == 'buy':
-					# Best buy prices are in the last X rows of the order book
-					self.ob_buys = self.ob_buys[-50:]
-				else:
-					# Best sell prices are in the first X rows of the order book
-					self.ob_sells = self.ob_sells[:50]
-
-				# Update the best bid and ask prices here so that when we see
-				# opportunity, we already have the buy/sell at numbers crunched
-				if side == 'buy':
-					self.best_buy_price = self.ob_buys[-1, 0]
-					self.best_buy_size = self.ob_buys[-1, 1]
-				else:
-					self.best_sell_price = self.ob_sells[0, 0]
-					self.best_sell_size = self.ob_sells[0, 1]
-
-				# Update recent price to determine cutoffs for accepting msgs
-				self.recent_price = (self.best_buy_price + self.best_sell_price) / 2
-				self.recent_price_lower = self.ignore_cutoff_lower * self.recent_price
-				self.recent_price_upper = self.ignore_cutoff_upper * self.recent_price
-
-			elif 'bids' in msg:
-				if msg['type'] == 'snapshot':
-					# This is the first message, build our order books
-					# Going to take the first 50 to keep the initialization simple
-					self.ob_buys = np.array(msg['bids'][:50], dtype=np.float64)
-					self.ob_sells = np.array(msg['asks'][:50], dtype=np.float64)
-
-					# Order the order books from lowest price to highest price so
-					# the best buy price is the last element and best sell price
-					# is the first element
-					self.ob_buys.sort(axis=0)
-					self.ob_sells.sort(axis=0)
-
-					# Initialize best price and size variables
-					self.best_buy_price = self.ob_buys[-1, 0]
-					self.best_buy_size = self.ob_buys[-1, 1]
-					self.best_sell_price = self.ob_sells[0, 0]
-					self.best_sell_size = self.ob_sells[0, 1]
-
-					# Initialize recent prices and bounds for adding incoming
-					# values into our order book
-					self.recent_price = (self.best_buy_price + self.best_sell_price) / 2
-					self.recent_price_lower = self.ignore_cutoff_lower * self.recent_price
-					self.recent_price_upper = self.ignore_cutoff_upper * self.recent_price
-
-		except KeyError:
-			pass
-
-		notify = False
-		try:
-			if side == 'buy':
-				if old_best_buy_price != self.best_buy_price or old_best_buy_size != self.best_buy_size:
-					notify = True
-			else:
-				if old_best_sell_price != self.best_sell_price or old_best_sell_size != self.best_sell_size:
-					notify = True
-		except NameError:
-			self.logger.add('NameError in on_message')
-
-		if notify:
-			self.ob_updated_cond.notify_all()
-
-		self.ob_updated_cond.release()
+							self.best_sell_price = self.ob_sells[0, 0]
+							self.best_sell_size = self.ob_sells[0, 1]
+
+						self.book_checksum.on_change(
+							side, price, before, self.ob_buys if side == 'buy' else self.ob_sells
+						)
+						self.signals.update_side(side, price, self.ob_buys, self.ob_sells)
+						self.bus.publish(BookDelta, receive_time, side, price, size)
+
+						# Update recent price to determine cutoffs for accepting msgs
+						self.update_recent_price()
+
+						if self.md_ring is not None:
+							self.md_ring.publish_delta(side, price, size, self)
+
+				elif 'bids' in msg:
+					if msg['type'] == 'snapshot':
+						# This is the first message, build our order books
+						# Going to take the first 50 to keep the initialization simple
+						self.ob_buys = np.array(msg['bids'][:50], dtype=np.float64)
+						self.ob_sells = np.array(msg['asks'][:50], dtype=np.float64)
+
+						# Order the order books from lowest price to highest price so
+						# the best buy price is the last element and best sell price
+						# is the first element. Rows are sorted by price, sorting
+						# each column on its own would pair prices with the wrong
+						# sizes
+						self.ob_buys = self.ob_buys[self.ob_buys[:, 0].argsort()]
+						self.ob_sells = self.ob_sells[self.ob_sells[:, 0].argsort()]
+
+						# Initialize best price and size variables
+						self.best_buy_price = self.ob_buys[-1, 0]
+						self.best_buy_size = self.ob_buys[-1, 1]
+						self.best_sell_price = self.ob_sells[0, 0]
+						self.best_sell_size = self.ob_sells[0, 1]
+
+						self.signals.update_all(self.ob_buys, self.ob_sells)
+						self.book_checksum.reset(self.ob_buys, self.ob_sells)
+						self.bus.publish(BookReset, receive_time, self.ob_buys, self.ob_sells)
+
+						# Initialize recent prices and bounds for adding incoming
+						# values into our order book
+						self.update_recent_price()
+
+						if not self.ready.is_set() and len(self.ob_buys) and len(self.ob_sells):
+							self.ready_time = time.monotonic()
+							self.ready.set()
+
+			except KeyError:
+				pass
+
+			# Changes to either side, or a snapshot, can move the top of the book
+			notify = \
+				old_best_buy_price != self.best_buy_price \
+				or old_best_buy_size != self.best_buy_size \
+				or old_best_sell_price != self.best_sell_price \
+				or old_best_sell_size != self.best_sell_size
+
+			if notify:
+				self.ob_updated_cond.notify_all()
+				self.bus.publish(
+					TopOfBook, receive_time, self.best_buy_price, self.best_buy_size,
+					self.best_sell_price, self.best_sell_size
+				)
+
+			if self.ready.is_set() and ('changes' in msg or 'bids' in msg):
+				self.book_checksum.record(receive_time)
+				self.depth.update(self.ob_buys, self.ob_sells)
+				self.conflator.publish(self, receive_time)
+
+			if self.md_ring is not None and 'bids' in msg:
+				self.md_ring.publish_snapshot(self)
+
+			if self.strategy_engine is not None and self.ready.is_set() \
+					and ('changes' in msg or 'bids' in msg):
+				self.strategy_engine.on_book_update(self)
+
+		self.update_time.observe(time.monotonic() - receive_time)
@@ -0,0 +1,213 @@
+import collections
+import datetime as dt
+import os
+import sys
+import threading
+import time
+
+
+# CPU seconds of threads that have exited, by name, so per name totals
+# keep counting up as short lived threads (e.g. 'order') come and go
+exited_cpu_times = collections.Counter()
+exited_cpu_times_lock = threading.Lock()
+
+
+def record_thread_exit():
+	"""
+	Adds the calling thread's CPU time to the totals of exited threads.
+	Called by a thread just before it exits.
+
+	Returns:
+		None
+	"""
+
+	thread = threading.current_thread()
+	with exited_cpu_times_lock:
+		exited_cpu_times[thread.name] += time.thread_time()
+		# From here on only counted among the exited threads
+		thread.cpu_time_recorded = True
+
+
+def thread_cpu_times():
+	"""
+	CPU time used so far by each thread, summed over threads that share a
+	name (e.g. every 'order' thread). Threads that exited after calling
+	record_thread_exit() are included, so the totals never go down.
+
+	Returns:
+		cpu_times: dict
+			Thread name -> CPU seconds.
+	"""
+
+	with exited_cpu_times_lock:
+		cpu_times = collections.Counter(exited_cpu_times)
+		for thread in threading.enumerate():
+			if getattr(thread, 'cpu_time_recorded', False):
+				continue
+			try:
+				clock_id = time.pthread_getcpuclockid(thread.ident)
+				cpu_times[thread.name] += time.clock_gettime(clock_id)
+			except (OSError, TypeError):
+				# Exited since enumerate(), or not started yet
+				pass
+
+	return dict(cpu_times)
+
+
+class SamplingProfiler:
+
+	def __init__(self, logger, interval=.005, max_stacks=10000, max_depth=64):
+		"""
+		Sampling profiler that can be switched on and off while the bot is
+		running. While on, a thread samples every other thread's stack every
+		interval seconds and counts identical stacks. Switching it off writes
+		the counts as a collapsed stack file (one 'frame;frame;frame count'
+		line per stack) that flamegraph.pl and speedscope read directly.
+
+		While off there is no thread, no hook and no trace function, so it
+		costs nothing.
+
+		Parameters:
+			logger: Log
+				Used to log messages as needed.
+			interval: float
+				Seconds between samples.
+			max_stacks: int
+				Distinct stacks kept. Samples of further new stacks are
+				counted under a single '[truncated]' stack.
+			max_depth: int
+				Innermost frames kept per stack.
+		"""
+
+		self.logger = logger
+		self.interval = interval
+		self.max_stacks = max_stacks
+		self.max_depth = max_depth
+		self.stacks = collections.Counter()
+		self.samples = 0
+		self.running = False
+		self.sampler_thread = None
+		self.toggle_lock = threading.Lock()
+
+	def on_signal(self, signum, frame):
+		"""
+		Signal handler that toggles the profiler. Runs on the main thread,
+		so the actual work is handed to a thread of its own.
+
+		Returns:
+			None
+		"""
+
+		threading.Thread(target=self.toggle, name='profiler_toggle').start()
+
+	def toggle(self):
+		"""
+		Starts the profiler if it is off, otherwise stops it and writes out
+		what it collected.
+
+		Returns:
+			None
+		"""
+
+		with self.toggle_lock:
+			if self.running:
+				self.stop()
+			else:
+				self.start()
+
+	def start(self):
+		"""
+		Starts sampling.
+
+		Returns:
+			None
+		"""
+
+		self.stacks = collections.Counter()
+		self.samples = 0
+		self.running = True
+		self.sampler_thread = threading.Thread(
+			target=self.run, name='profiler', daemon=True
+		)
+		self.sampler_thread.start()
+		self.logger.add(f'Profiler started, sampling every {self.interval * 1e3:g}ms')
+
+	def stop(self):
+		"""
+		Stops sampling and writes the collapsed stack file.
+
+		Returns:
+			path: string
+				File the stacks were written to.
+		"""
+
+		self.running = False
+		self.sampler_thread.join()
+		path = f'profile {dt.datetime.now().strftime("%m-%d-%Y %Hh %Mm %Ss")}.collapsed'
+		self.write(path)
+		self.logger.add(
+			f'Profiler stopped after {self.samples} samples, wrote {path}. '
+			f'Thread CPU seconds: {thread_cpu_times()}'
+		)
+
+		return path
+
+	def run(self):
+		"""
+		Sampler thread.
+
+		Returns:
+			None
+		"""
+
+		own_ident = threading.get_ident()
+		while self.running:
+			names = {t.ident: t.name for t in threading.enumerate()}
+			for ident, frame in sys._current_frames().items():
+				if ident != own_ident:
+					self.add_sample(names.get(ident, str(ident)), frame)
+			self.samples += 1
+			time.sleep(self.interval)
+
+	def add_sample(self, thread_name, frame):
+		"""
+		Counts one stack.
+
+		Parameters:
+			thread_name: string
+				Name of the thread the stack belongs to, used as the root
+				frame so each thread gets its own tower in the flamegraph.
+			frame: frame
+				Innermost frame of the stack.
+
+		Returns:
+			None
+		"""
+
+		frames = []
+		while frame is not None and len(frames) < self.max_depth:
+			code = frame.f_code
+			frames.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+			frame = frame.f_back
+		frames.append(thread_name)
+		stack = ';'.join(reversed(frames))
+
+		if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+			stack = f'{thread_name};[truncated]'
+		self.stacks[stack] += 1
+
+	def write(self, path):
+		"""
+		Writes the counted stacks in collapsed stack format.
+
+		Parameters:
+			path: string
+				File to write.
+
+		Returns:
+			None
+		"""
+
+		with open(path, 'w') as f:
+			for stack, count in self.stacks.most_common():
+				f.write(f'{stack} {count}\n')
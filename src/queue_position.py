@@ -0,0 +1,351 @@
+import collections
+import math
+import threading
+
+
+# Where an order is estimated to stand in the queue at its price. ahead is
+# the size in front of it at its own price, time_to_fill the expected
+# seconds until it fills completely.
+QueuePosition = collections.namedtuple(
+	'QueuePosition', ['ahead', 'remaining', 'time_to_fill']
+)
+
+
+class QueueSlot:
+
+	__slots__ = (
+		'side', 'price', 'remaining', 'ahead', 'level_size', 'unseen_traded',
+		'depleted', 'start_time', 'prior_rate', 'kept'
+	)
+
+	def __init__(self, side, price, remaining, level_size, now, prior_rate):
+		"""
+		Queue state of one live order, only touched under the estimator's
+		lock.
+
+		Parameters:
+			side: string
+				'buy' or 'sell'.
+			price: float
+				Price of the order.
+			remaining: float
+				Size left to fill.
+			level_size: float
+				Size at the order's price when it was acknowledged, all of
+				it assumed to be ahead of the order.
+			now: float
+				time.monotonic() of the acknowledgement.
+			prior_rate: float
+				Size per second the queue is assumed to move at before any
+				of it has been seen moving.
+		"""
+
+		self.side = side
+		self.price = price
+		self.remaining = remaining
+		self.ahead = level_size
+		self.level_size = level_size
+		# Traded at the level but not yet taken off level_size by a level2
+		# change
+		self.unseen_traded = 0.0
+		# Size that has left the queue in front of the order, or filled it
+		self.depleted = 0.0
+		self.start_time = now
+		self.prior_rate = prior_rate
+		# Whether the order has been kept at least once
+		self.kept = False
+
+
+class QueuePositionEstimator:
+
+	def __init__(self, keep_time=0.0, trades=True, prior_time=5.0):
+		"""
+		Estimates how much size is queued ahead of each live order at its
+		price and when it can be expected to fill, from what the market
+		data shows happening at that level:
+			- Trades at the level take size off the front of the queue.
+			- Level2 decrements a trade doesn't account for are cancels,
+			  taken from anywhere in the queue, so they reduce the size
+			  ahead in proportion to how much of the rest of the level is
+			  ahead.
+			- Increments join the back of the queue and change nothing.
+		Without trades (matches not subscribed) every decrement is assumed
+		to come off the front.
+
+		Expected time to fill is the size ahead plus the order's own size
+		over the rate the queue has been moving at since the order was
+		acknowledged, blended with prior_rate for the first prior_time
+		seconds. Orders expected to fill within keep_time seconds are
+		worth keeping even once their strategy would re-quote them, since
+		a replacement would start at the back of the queue.
+
+		Parameters:
+			keep_time: float
+				Seconds to fill within which an order is kept.
+			trades: bool
+				Whether trades are reported through on_trade().
+			prior_time: float
+				Seconds of prior_rate blended into the observed rate.
+		"""
+
+		self.keep_time = keep_time
+		self.trades = trades
+		self.prior_time = prior_time
+		self.slots = {}
+		# (side, price) -> {client_order_id: QueueSlot}, so market data for
+		# a level without our orders costs one dict lookup
+		self.levels = {}
+		self.slots_lock = threading.Lock()
+		# Orders kept at least once, i.e. cancels avoided
+		self.kept = 0
+
+	def add(self, client_order_id, side, price, remaining, level_size, now, prior_rate=0.0):
+		"""
+		Starts tracking an order once GDAX has acknowledged it.
+
+		Parameters:
+			client_order_id: string
+				Identifies the order.
+			side: string
+				'buy' or 'sell'.
+			price: float
+				Price of the order.
+			remaining: float
+				Size left to fill.
+			level_size: float
+				Size at price on the book right now.
+			now: float
+				time.monotonic().
+			prior_rate: float
+				See QueueSlot.
+
+		Returns:
+			None
+		"""
+
+		slot = QueueSlot(side, price, remaining, level_size, now, prior_rate)
+		with self.slots_lock:
+			self.slots[client_order_id] = slot
+			self.levels.setdefault((side, price), {})[client_order_id] = slot
+
+	def remove(self, client_order_id):
+		"""
+		Stops tracking an order once it has closed.
+
+		Parameters:
+			client_order_id: string
+				Identifies the order.
+
+		Returns:
+			None
+		"""
+
+		with self.slots_lock:
+			slot = self.slots.pop(client_order_id, None)
+			if slot is None:
+				return
+			level = self.levels[(slot.side, slot.price)]
+			del level[client_order_id]
+			if not level:
+				del self.levels[(slot.side, slot.price)]
+
+	def on_fill(self, client_order_id, filled):
+		"""
+		Records a fill of a tracked order. Nothing is ahead of an order
+		that is filling.
+
+		Parameters:
+			client_order_id: string
+				Identifies the order.
+			filled: float
+				Size filled by this Execution Report.
+
+		Returns:
+			None
+		"""
+
+		with self.slots_lock:
+			slot = self.slots.get(client_order_id)
+			if slot is not None:
+				slot.remaining = max(slot.remaining - filled, 0.0)
+				slot.ahead = 0.0
+
+	def on_trade(self, side, price, size, now):
+		"""
+		Called for every trade. side is the maker's side, the side of the
+		book the trade took size from.
+
+		Parameters:
+			side: string
+				'buy' or 'sell'.
+			price: float
+				Trade price.
+			size: float
+				Trade size.
+			now: float
+				time.monotonic().
+
+		Returns:
+			None
+		"""
+
+		level = self.levels.get((side, price))
+		if level is None:
+			return
+
+		with self.slots_lock:
+			for slot in level.values():
+				slot.depleted += size
+				slot.ahead = max(slot.ahead - size, 0.0)
+				slot.unseen_traded += size
+
+	def on_change(self, side, price, size, now):
+		"""
+		Called for every level2 change.
+
+		Parameters:
+			side: string
+				'buy' or 'sell'.
+			price: float
+				Price of the level.
+			size: float
+				New size at the level.
+			now: float
+				time.monotonic().
+
+		Returns:
+			None
+		"""
+
+		level = self.levels.get((side, price))
+		if level is None:
+			return
+
+		with self.slots_lock:
+			for slot in level.values():
+				removed = slot.level_size - size
+				slot.level_size = size
+				if removed <= 0:
+					# Joined behind us
+					continue
+				if size == 0:
+					# Nothing is left in front
+					slot.depleted += slot.ahead
+					slot.ahead = 0.0
+					continue
+				if not self.trades:
+					front = min(removed, slot.ahead)
+					slot.depleted += front
+					slot.ahead -= front
+					continue
+				# Decrements already explained by trades
+				traded = min(removed, slot.unseen_traded)
+				slot.unseen_traded -= traded
+				canceled = removed - traded
+				if canceled > 0 and slot.ahead > 0:
+					others = max(slot.level_size + removed - slot.remaining, slot.ahead)
+					canceled_ahead = canceled * slot.ahead / others
+					slot.depleted += canceled_ahead
+					slot.ahead -= canceled_ahead
+
+	def position(self, client_order_id, now, better=0.0):
+		"""
+		Estimated queue position of an order.
+
+		Parameters:
+			client_order_id: string
+				Identifies the order.
+			now: float
+				time.monotonic().
+			better: float
+				Size at prices better than the order's, which has to trade
+				before the order's level does.
+
+		Returns:
+			position: QueuePosition or None
+				None if the order isn't tracked.
+		"""
+
+		with self.slots_lock:
+			slot = self.slots.get(client_order_id)
+			if slot is None:
+				return None
+			ahead = slot.ahead + better
+			elapsed = now - slot.start_time
+			rate = (slot.depleted + slot.prior_rate * self.prior_time) / (elapsed + self.prior_time)
+			remaining = slot.remaining
+
+		if rate <= 0:
+			return QueuePosition(ahead, remaining, math.inf)
+
+		return QueuePosition(ahead, remaining, (ahead + remaining) / rate)
+
+	def keep(self, client_order_id, book, now):
+		"""
+		Whether an order its strategy would cancel should be kept because
+		it is expected to fill within keep_time.
+
+		Parameters:
+			client_order_id: string
+				Identifies the order.
+			book: OrderBookWebSocket, RingBook or BookSnapshot
+				Current book, for the size at better prices.
+			now: float
+				time.monotonic().
+
+		Returns:
+			keep: bool
+		"""
+
+		slot = self.slots.get(client_order_id)
+		if slot is None or self.keep_time <= 0:
+			return False
+
+		if slot.side == 'buy':
+			better = book.ob_buys[book.ob_buys[:, 0] > slot.price, 1].sum()
+		else:
+			better = book.ob_sells[book.ob_sells[:, 0] < slot.price, 1].sum()
+		position = self.position(client_order_id, now, better)
+		if position is None or position.time_to_fill > self.keep_time:
+			return False
+
+		# Kept on every book update while outbid, but it's one cancel saved
+		if not slot.kept:
+			slot.kept = True
+			self.kept += 1
+		return True
+
+	def stats(self):
+		"""
+		Snapshot of the estimator's counters.
+
+		Returns:
+			out: dict
+		"""
+
+		return {'tracked': len(self.slots), 'kept': self.kept}
+
+
+def level_size(book, side, price):
+	"""
+	Size at a price on one side of the book.
+
+	Parameters:
+		book: OrderBookWebSocket, RingBook or BookSnapshot
+			Book to look in.
+		side: string
+			'buy' or 'sell'.
+		price: float
+			Price of the level.
+
+	Returns:
+		size: float
+			0 if there is no level at price.
+	"""
+
+	levels = book.ob_buys if side == 'buy' else book.ob_sells
+	index = levels[:, 0].searchsorted(price)
+	if index == len(levels) or levels[index, 0] != price:
+		return 0.0
+
+	return float(levels[index, 1])
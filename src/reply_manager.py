@@ -1,7 +1,8 @@
-def reply_manager(fix_trader, logger, buffer=4096):
+def reply_manager(fix_trader, logger, buffer=4096, session=None):
 	"""
-	reply_manager() listens for messages in the FIX socket and sends the
-	message to the order object the message is associated with.
+	reply_manager() listens for messages in a session's FIX socket and sends
+	the message to the order object the message is associated with. One runs
+	per session, all of them sharing fix_trader's OrderTracker.
 
 	Parameters:
 		fix_trader: FIXTrader
@@ -11,50 +12,93 @@ def reply_manager(fix_trader, logger, buffer=4096):
 		buffer: int
 			Maximum buffer size (in bytes) the socket can receive.
 			Experimentally, the default of 4096 is large enough for FIX messages.
+		session: FIXSession
+			Session to listen on. Defaults to fix_trader's first session.
 
 	Returns:
 		None
 	"""
 
+	if session is None:
+		session = fix_trader.sessions[0]
+
 	while True:
-		reply = fix_trader.fix_socket.recv(buffer)
+		reply = session.fix_socket.recv(buffer)
+		if not reply:
+			logger.add(f'FIX session {session.index} disconnected')
+			return
+		session.heartbeat_manager.on_receive()
 		logger.add(f'New reply message raw: {reply}')
 		responses = fix_trader.analyze_fix_msg(reply)
 
 		# Figure out what each response deals with
 		for msg in responses:
 			logger.add(f'New reply message: {msg}')
+			session.on_inbound_seq(msg)
 
 			if 'MsgType' in msg:
 				msg_type = msg['MsgType']
+				fix_trader.msgs_received_by_type[msg_type] += 1
 				if msg_type == 'Heartbeat':
 					logger.add(f'heartbeat msg reply: {msg}')
+				elif msg_type == 'Test Request':
+					logger.add(f'test request msg: {msg}')
+					session.heartbeat_manager.on_test_request(msg.get('TestReqID'))
 				elif msg_type == 'Logon':
 					logger.add(f'logon msg reply: {msg}')
+					session.on_logon()
+				elif msg_type == 'Resend Request':
+					logger.add(f'resend request msg: {msg}')
+					session.request(
+						'sequence_reset',
+						seq_range=(int(msg['BeginSeqNo']), int(msg['EndSeqNo']))
+					)
+				elif msg_type == 'Sequence Reset':
+					logger.add(f'sequence reset msg: {msg}')
+					session.expected_inbound_seq = int(msg['NewSeqNo'])
 				elif msg_type == 'Order Cancel Request':
 					logger.add(f'cancel msg reply: {msg}')
+				elif msg_type == 'New Order Batch Reject':
+					logger.add(f'batch order msg reply: {msg}')
+					# None of the batch's orders will get an Execution Report,
+					# reject each of them so their threads exit
+					orders = fix_trader.order_batches.pop(msg.get('BatchID'), [])
+					for order in orders:
+						order.msgs.put({
+							'OrdStatus': 'Rejected', 'Text': msg.get('Text', '')
+						})
+				elif msg_type == 'Order Cancel Batch Reject':
+					logger.add(f'batch cancel msg reply: {msg}')
+					# Fall back to canceling the batch's orders one at a time
+					orders = fix_trader.order_batches.pop(msg.get('BatchID'), [])
+					for order in orders:
+						fix_trader.request(
+							'cancel', order_id=order.order_id,
+							client_order_id=order.client_order_id, session=order.session
+						)
 				elif msg_type == 'Execution Report':
 					logger.add(f'order msg reply: {msg}')
 					try:
+						# A lookup that misses must still release the lock,
+						# other sessions' reply_managers share it
 						if 'ClOrdID' in msg:
-							fix_trader.order_tracker.orders_by_cl_oid_lock.acquire()
-							order = fix_trader.order_tracker.orders_by_cl_oid[msg['ClOrdID']]
-							fix_trader.order_tracker.orders_by_cl_oid_lock.release()
+							with fix_trader.order_tracker.orders_by_cl_oid_lock:
+								order = fix_trader.order_tracker.orders_by_cl_oid[msg['ClOrdID']]
 
 							order.order_id = msg['OrderID']
 
-							fix_trader.order_tracker.order_by_oid_lock.acquire()
-							fix_trader.order_tracker.orders_by_oid[msg['OrderID']] = order
-							fix_trader.order_tracker.order_by_oid_lock.release()
+							with fix_trader.order_tracker.order_by_oid_lock:
+								fix_trader.order_tracker.orders_by_oid[msg['OrderID']] = order
 
-						fix_trader.order_tracker.order_by_oid_lock.acquire()
-						order = fix_trader.order_tracker.orders_by_oid[msg['OrderID']]
-						fix_trader.order_tracker.order_by_oid_lock.release()
+						with fix_trader.order_tracker.order_by_oid_lock:
+							order = fix_trader.order_tracker.orders_by_oid[msg['OrderID']]
 
-						order.condition.acquire()
+						fix_trader.latency_tracker.on_execution_report(
+							order.client_order_id, msg
+						)
 						order.msgs.put(msg)
-						order.condition.notify()
-						order.condition.release()
+						if fix_trader.strategy_engine is not None:
+							fix_trader.strategy_engine.on_execution_report(order, msg)
 
 					except KeyError:
 						logger.add("KeyError in Buffer Manager")
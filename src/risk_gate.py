@@ -0,0 +1,279 @@
+import collections
+import math
+import threading
+import time
+
+
+class RiskGate:
+
+	def __init__(
+			self, account, orderbook_ws, max_order_size=math.inf,
+			max_notional=math.inf, max_open_orders=10, max_position=math.inf,
+			min_position=0.0, price_band=.01):
+		"""
+		Pre-trade checks every new order has to pass before it is sent.
+		Everything a check needs is kept up to date as orders are admitted,
+		filled and closed (open order count, size and notional reserved by
+		live orders) or is read straight off the account and the book, so
+		admitting an order is a handful of comparisons whatever the number
+		of live orders. Run `python -m src.risk_gate` to benchmark it.
+
+		Parameters:
+			account: GDAXAccount
+				Holdings orders are checked against. account.btc is the
+				position.
+			orderbook_ws: OrderBookWebSocket or RingBook
+				Book prices are checked against.
+			max_order_size: float
+				Largest order, in BTC.
+			max_notional: float
+				Largest order, in USD.
+			max_open_orders: int
+				Most orders live at once.
+			max_position: float
+				Most BTC held if every live buy order filled.
+			min_position: float
+				Least BTC held if every live sell order filled. 0 stops
+				selling more than is held.
+			price_band: float
+				Largest distance of an order's price from the mid price, as
+				a fraction of the mid price.
+		"""
+
+		self.account = account
+		self.orderbook_ws = orderbook_ws
+		self.max_order_size = max_order_size
+		self.max_notional = max_notional
+		self.max_open_orders = max_open_orders
+		self.max_position = max_position
+		self.min_position = min_position
+		self.price_band = price_band
+		self.gate_lock = threading.Lock()
+		# Reserved by live orders, for the unfilled part of each
+		self.open_orders = 0
+		self.open_buy_size = 0.0
+		self.open_buy_notional = 0.0
+		self.open_sell_size = 0.0
+		self.killed = False
+		self.kill_reason = None
+		# Reason -> orders rejected for it
+		self.rejects = collections.Counter()
+		self.last_reject = None
+
+	def check(self, order_type, price, size):
+		"""
+		Runs every check against the current state without changing it.
+
+		Parameters:
+			order_type: string
+				'buy' or 'sell'.
+			price: float
+				Price of the order.
+			size: float
+				Size of the order.
+
+		Returns:
+			reason: string or None
+				Why the order would be rejected, None if it passes.
+		"""
+
+		if self.killed:
+			return 'kill switch'
+		if not 0 < size <= self.max_order_size:
+			return 'order size'
+		notional = price * size
+		if not 0 < notional <= self.max_notional:
+			return 'notional'
+		if self.open_orders >= self.max_open_orders:
+			return 'open orders'
+
+		book = self.orderbook_ws
+		mid = (book.best_buy_price + book.best_sell_price) * .5
+		if not book.best_buy_price or not book.best_sell_price \
+				or abs(price - mid) > self.price_band * mid:
+			return 'price band'
+
+		account = self.account
+		if order_type == 'buy':
+			if account.btc + self.open_buy_size + size > self.max_position:
+				return 'position'
+			if self.open_buy_notional + notional > account.usd:
+				return 'funds'
+		elif account.btc - self.open_sell_size - size < self.min_position:
+			return 'position'
+
+		return None
+
+	def admit(self, order_type, price, size):
+		"""
+		Checks an order and, if it passes, reserves what it needs until it
+		is closed. The order must report its fills to on_fill() and its end
+		to on_close().
+
+		Parameters:
+			order_type, price, size:
+				See check().
+
+		Returns:
+			reason: string or None
+				Why the order was rejected, None if it was admitted.
+		"""
+
+		with self.gate_lock:
+			reason = self.check(order_type, price, size)
+			if reason is None:
+				self.reserve(order_type, price, size)
+			else:
+				self.rejects[reason] += 1
+
+		return reason
+
+	def reserve(self, order_type, price, size):
+		"""
+		Reserves for an order without checking it, e.g. one that was already
+		live before a restart. Must hold gate_lock.
+
+		Parameters:
+			order_type, price, size:
+				See check().
+
+		Returns:
+			None
+		"""
+
+		self.open_orders += 1
+		if order_type == 'buy':
+			self.open_buy_size += size
+			self.open_buy_notional += price * size
+		else:
+			self.open_sell_size += size
+
+	def on_fill(self, order_type, price, amount_filled):
+		"""
+		Releases the filled part of an order, which is now part of the
+		account's holdings.
+
+		Parameters:
+			order_type: string
+				'buy' or 'sell'.
+			price: float
+				Price of the order.
+			amount_filled: float
+				Amount filled.
+
+		Returns:
+			None
+		"""
+
+		with self.gate_lock:
+			if order_type == 'buy':
+				self.open_buy_size -= amount_filled
+				self.open_buy_notional -= price * amount_filled
+			else:
+				self.open_sell_size -= amount_filled
+
+	def on_close(self, order_type, price, remaining):
+		"""
+		Releases what is left of an order once it is no longer live.
+
+		Parameters:
+			order_type: string
+				'buy' or 'sell'.
+			price: float
+				Price of the order.
+			remaining: float
+				Part of the order that never filled.
+
+		Returns:
+			None
+		"""
+
+		with self.gate_lock:
+			self.open_orders -= 1
+			if self.open_orders <= 0:
+				# Nothing is live, clear any float drift
+				self.open_orders = 0
+				self.open_buy_size = 0.0
+				self.open_buy_notional = 0.0
+				self.open_sell_size = 0.0
+			elif order_type == 'buy':
+				self.open_buy_size -= remaining
+				self.open_buy_notional -= price * remaining
+			else:
+				self.open_sell_size -= remaining
+
+	def kill(self, reason):
+		"""
+		Rejects every new order from now on.
+
+		Parameters:
+			reason: string
+				Why, for the log.
+
+		Returns:
+			None
+		"""
+
+		self.killed = True
+		self.kill_reason = reason
+
+	def stats(self):
+		"""
+		Returns:
+			stats: dict
+				Reserved amounts, reject counts and kill switch state.
+		"""
+
+		return {
+			'open_orders': self.open_orders,
+			'open_buy_size': self.open_buy_size,
+			'open_buy_notional': self.open_buy_notional,
+			'open_sell_size': self.open_sell_size,
+			'rejects': dict(self.rejects),
+			'killed': self.killed,
+		}
+
+
+def benchmark(n=200000):
+	"""
+	Times RiskGate.check() and a full admit() / on_close() round trip
+	against stand-in account and book objects.
+
+	Parameters:
+		n: int
+			Calls timed of each.
+
+	Returns:
+		timings: dict
+			Name -> (p50, p99) in microseconds.
+	"""
+
+	account = collections.namedtuple('Account', ['usd', 'btc'])(100000.0, 1.0)
+	book = collections.namedtuple('Book', ['best_buy_price', 'best_sell_price'])(
+		10000.0, 10000.01
+	)
+	gate = RiskGate(account, book, max_order_size=5, max_notional=50000, max_position=10)
+	clock = time.perf_counter_ns
+
+	def admit_and_close():
+		gate.admit('buy', 10000.0, .5)
+		gate.on_close('buy', 10000.0, .5)
+
+	timings = {}
+	for name, call in (
+			('check', lambda: gate.check('buy', 10000.0, .5)),
+			('admit_and_close', admit_and_close)):
+		samples = []
+		for _ in range(n):
+			start = clock()
+			call()
+			samples.append(clock() - start)
+		samples.sort()
+		timings[name] = (samples[n // 2] / 1e3, samples[n * 99 // 100] / 1e3)
+
+	return timings
+
+
+if __name__ == '__main__':
+	for name, (p50, p99) in benchmark().items():
+		print(f'{name}: p50 {p50:.2f}us, p99 {p99:.2f}us')
@@ -0,0 +1,284 @@
+import collections
+import gc
+import os
+import threading
+import time
+import weakref
+
+from .metrics import Histogram
+
+
+class GCTuner:
+
+	def __init__(
+			self, logger, scheduler, thresholds=None, collect_interval=0.0,
+			quiet_time=.05, max_defer=2.0, is_quiet=None):
+		"""
+		Keeps garbage collection pauses off the tick-to-trade path:
+			- freeze() moves everything allocated during startup (the book,
+			  FIX dicts, sessions, ...) into the permanent generation, so
+			  later collections don't walk it.
+			- thresholds raises automatic collection thresholds while
+			  trading, or disables automatic collection with a first
+			  threshold of 0.
+			- Every collect_interval seconds a full collection is run from
+			  the scheduler, but only once is_quiet() says nothing is
+			  happening or it has been put off for max_defer seconds.
+		Every collection, automatic or not, is timed through gc.callbacks.
+
+		Parameters:
+			logger: Log
+				Used to log messages as needed.
+			scheduler: TimerWheel
+				Runs the scheduled collections.
+			thresholds: tuple
+				Passed to gc.set_threshold(). Python's defaults if None.
+			collect_interval: float
+				Seconds between scheduled collections, 0 for none.
+			quiet_time: float
+				Seconds between checks for quiet while a scheduled collection
+				is waiting.
+			max_defer: float
+				Most seconds a scheduled collection waits for quiet.
+			is_quiet: function
+				Called with no arguments, returns True when a pause would
+				hurt nothing. Always quiet if not given.
+		"""
+
+		self.logger = logger
+		self.scheduler = scheduler
+		self.thresholds = thresholds
+		self.collect_interval = collect_interval
+		self.quiet_time = quiet_time
+		self.max_defer = max_defer
+		self.is_quiet = is_quiet
+		# Pause length per generation
+		self.pauses = {generation: Histogram() for generation in range(3)}
+		self.collections = collections.Counter()
+		self.collected = 0
+		self.scheduled_collections = 0
+		self.deferred_collections = 0
+		self.max_pause = 0.0
+		self.pause_start = None
+		self.defer_start = None
+
+	def start(self):
+		"""
+		Starts timing collections, applies thresholds and schedules
+		collections.
+
+		Returns:
+			None
+		"""
+
+		gc.callbacks.append(self.on_gc)
+		if self.thresholds is not None:
+			gc.set_threshold(*self.thresholds)
+			self.logger.add(f'GC thresholds set to {gc.get_threshold()}')
+		if self.collect_interval > 0:
+			self.scheduler.schedule_every(self.collect_interval, self.on_collect_timer)
+
+	def freeze(self):
+		"""
+		Collects once and then freezes every object still alive, which are
+		assumed to live as long as the process. Call once startup is done.
+
+		Returns:
+			None
+		"""
+
+		gc.collect()
+		gc.freeze()
+		self.logger.add(f'Froze {gc.get_freeze_count()} objects out of GC')
+
+	def on_gc(self, phase, info):
+		"""
+		gc.callbacks hook, runs at the start and end of every collection in
+		whichever thread triggered it.
+
+		Parameters:
+			phase: string
+				'start' or 'stop'.
+			info: dict
+				generation, collected and uncollectable.
+
+		Returns:
+			None
+		"""
+
+		if phase == 'start':
+			self.pause_start = time.perf_counter()
+			return
+		if self.pause_start is None:
+			return
+
+		pause = time.perf_counter() - self.pause_start
+		self.pause_start = None
+		generation = info['generation']
+		self.pauses[generation].observe(pause)
+		self.collections[generation] += 1
+		self.collected += info['collected']
+		if pause > self.max_pause:
+			self.max_pause = pause
+
+	def on_collect_timer(self):
+		"""
+		Scheduler callback, starts waiting for a quiet moment to collect.
+
+		Returns:
+			None
+		"""
+
+		# Still waiting on the last one
+		if self.defer_start is not None:
+			return
+
+		self.defer_start = time.monotonic()
+		self.collect_when_quiet()
+
+	def collect_when_quiet(self):
+		"""
+		Runs a full collection if it's quiet or the collection has waited
+		max_defer seconds, otherwise checks again in quiet_time seconds.
+
+		Returns:
+			None
+		"""
+
+		waited = time.monotonic() - self.defer_start
+		if self.is_quiet is not None and not self.is_quiet() and waited < self.max_defer:
+			self.scheduler.schedule(self.quiet_time, self.collect_when_quiet)
+			return
+
+		if waited >= self.max_defer:
+			self.deferred_collections += 1
+		self.defer_start = None
+		self.scheduled_collections += 1
+		gc.collect()
+
+	def stats(self):
+		"""
+		Snapshot of the collection counters.
+
+		Returns:
+			out: dict
+		"""
+
+		return {
+			'collections': dict(self.collections),
+			'collected': self.collected,
+			'scheduled': self.scheduled_collections,
+			'forced': self.deferred_collections,
+			'pause_total': sum(histogram.sum for histogram in self.pauses.values()),
+			'pause_max': self.max_pause,
+			'frozen': gc.get_freeze_count(),
+		}
+
+
+def parse_affinity(text):
+	"""
+	Parses the cpu_affinity setting.
+
+	Parameters:
+		text: string
+			Comma separated name:cores entries, where cores is a core
+			number or a range like 2-3, e.g. 'websocket:2, strategy:1'.
+
+	Returns:
+		affinity: dict
+			Thread or process name -> set of cores.
+	"""
+
+	affinity = {}
+	for entry in text.split(','):
+		if not entry.strip():
+			continue
+		name, cores = entry.split(':')
+		first, _, last = cores.strip().partition('-')
+		affinity[name.strip()] = set(range(int(first), int(last or first) + 1))
+
+	return affinity
+
+
+class ThreadPinner:
+
+	def __init__(self, logger, affinity):
+		"""
+		Pins threads to cores by name so the OS doesn't migrate the hot
+		threads between cores. A name also covers its numbered threads, so
+		'reply_manager' pins reply_manager_1 and so on. Threads a pinned
+		thread starts (e.g. order threads) inherit its cores.
+
+		Parameters:
+			logger: Log
+				Used to log messages as needed.
+			affinity: dict
+				Thread or process name -> set of cores, as returned by
+				parse_affinity().
+		"""
+
+		self.logger = logger
+		self.affinity = affinity
+		# Child processes pinned by name, e.g. 'market_data'
+		self.processes = {}
+		self.pinned = weakref.WeakSet()
+		self.pinned_pids = set()
+
+	def cores_for(self, name):
+		"""
+		Cores a thread should be pinned to.
+
+		Parameters:
+			name: string
+				Thread name.
+
+		Returns:
+			cores: set or None
+		"""
+
+		cores = self.affinity.get(name)
+		if cores is None:
+			prefix, _, index = name.rpartition('_')
+			if index.isdigit():
+				cores = self.affinity.get(prefix)
+
+		return cores
+
+	def pin(self):
+		"""
+		Pins every thread and process not yet pinned. Cheap enough to run
+		periodically to catch threads started since, like reconnected
+		websockets.
+
+		Returns:
+			None
+		"""
+
+		for thread in threading.enumerate():
+			if thread in self.pinned or thread.native_id is None:
+				continue
+			cores = self.cores_for(thread.name)
+			if cores is None:
+				continue
+			# Not retried if it fails, the error won't go away
+			self.pinned.add(thread)
+			try:
+				os.sched_setaffinity(thread.native_id, cores)
+			except OSError as error:
+				self.logger.add(f'Could not pin {thread.name} to {cores}: {error}')
+				continue
+			self.logger.add(f'Pinned {thread.name} to cores {sorted(cores)}')
+
+		for name, process in self.processes.items():
+			cores = self.affinity.get(name)
+			if cores is None or process.pid is None or process.pid in self.pinned_pids:
+				continue
+			self.pinned_pids.add(process.pid)
+			# Every thread of the process, not just its main thread
+			try:
+				for task in os.listdir(f'/proc/{process.pid}/task'):
+					os.sched_setaffinity(int(task), cores)
+			except OSError as error:
+				self.logger.add(f'Could not pin {name} to {cores}: {error}')
+				continue
+			self.logger.add(f'Pinned {name} process to cores {sorted(cores)}')
@@ -0,0 +1,259 @@
+import mmap
+import os
+import struct
+import threading
+import time
+
+
+# Record types
+OUTBOUND_SEQ = 1
+INBOUND_SEQ = 2
+ORDER = 3
+
+# Order states
+ORDER_NEW = 1
+ORDER_OPEN = 2
+ORDER_CANCEL_REQUESTED = 3
+ORDER_CLOSED = 4
+
+SIDES = {'buy': 1, 'sell': 2}
+SIDE_NAMES = {1: 'buy', 2: 'sell'}
+
+MAGIC = b'FIXJRNL1'
+# type, side, state, seq_num, time, price, size, filled, client_order_id,
+# order_id, padded to 128 bytes
+RECORD = struct.Struct('<BBB5xqdddd36s36s8x')
+
+
+class SessionJournal:
+
+	def __init__(self, path, capacity=1 << 19):
+		"""
+		Append-only journal of the FIX session, memory-mapped so that
+		appending a record is a struct.pack_into() into the page cache with
+		no system call. It records the last outbound and inbound MsgSeqNum
+		and every order state transition, which is enough for a restarted
+		process to log back on with the right sequence numbers and rebuild
+		its live orders instead of starting from scratch.
+
+		Records are fixed size and the file is preallocated, so the end of
+		the journal is the first all-zero record. When the file fills up it
+		is compacted down to the current sequence numbers and live orders.
+
+		Parameters:
+			path: string
+				Journal file. Created if it doesn't exist.
+			capacity: int
+				Number of records the file holds before being compacted.
+		"""
+
+		self.path = path
+		self.capacity = capacity
+		self.size = len(MAGIC) + capacity * RECORD.size
+		self.journal_lock = threading.Lock()
+		# Current state, mirrored in memory for compaction
+		self.last_outbound_seq = -1
+		self.last_inbound_seq = 0
+		self.live_orders = {}
+		self.load()
+
+	def load(self):
+		"""
+		Maps the journal file and replays it into the in-memory state.
+
+		Returns:
+			None
+		"""
+
+		if not os.path.exists(self.path) or os.path.getsize(self.path) < self.size:
+			with open(self.path, 'ab') as f:
+				f.truncate(self.size)
+		with open(self.path, 'r+b') as f:
+			self.journal_map = mmap.mmap(f.fileno(), self.size)
+
+		if self.journal_map[:len(MAGIC)] != MAGIC:
+			self.journal_map[:len(MAGIC)] = MAGIC
+
+		self.count = 0
+		offset = len(MAGIC)
+		while self.count < self.capacity:
+			record = RECORD.unpack_from(self.journal_map, offset)
+			if record[0] == 0:
+				break
+			self.apply(record)
+			self.count += 1
+			offset += RECORD.size
+
+	def apply(self, record):
+		"""
+		Updates the in-memory state with a record.
+
+		Parameters:
+			record: tuple
+				Unpacked RECORD.
+
+		Returns:
+			None
+		"""
+
+		record_type, side, state, seq_num, _, price, size, filled, cl_oid, oid = record
+		if record_type == OUTBOUND_SEQ:
+			self.last_outbound_seq = seq_num
+		elif record_type == INBOUND_SEQ:
+			self.last_inbound_seq = seq_num
+		elif record_type == ORDER:
+			client_order_id = cl_oid.rstrip(b'\0').decode()
+			if state == ORDER_CLOSED:
+				self.live_orders.pop(client_order_id, None)
+			else:
+				order_id = oid.rstrip(b'\0').decode() or None
+				self.live_orders[client_order_id] = (
+					SIDE_NAMES.get(side), state, price, size, filled, order_id
+				)
+
+	def append(
+			self, record_type, side=0, state=0, seq_num=0, price=0.0, size=0.0,
+			filled=0.0, client_order_id=b'', order_id=b''):
+		"""
+		Appends a record, compacting the journal first if it's full.
+
+		Parameters:
+			record_type: int
+				OUTBOUND_SEQ, INBOUND_SEQ or ORDER.
+			side, state, price, size, filled, client_order_id, order_id:
+				Order fields, for ORDER records.
+			seq_num: int
+				MsgSeqNum, for OUTBOUND_SEQ and INBOUND_SEQ records.
+
+		Returns:
+			None
+		"""
+
+		record = (
+			record_type, side, state, seq_num, time.time(), price, size, filled,
+			client_order_id, order_id
+		)
+		with self.journal_lock:
+			if self.count == self.capacity:
+				self.compact()
+			RECORD.pack_into(
+				self.journal_map, len(MAGIC) + self.count * RECORD.size, *record
+			)
+			self.count += 1
+			self.apply(record)
+
+	def record_outbound(self, seq_num):
+		"""
+		Records the last MsgSeqNum sent.
+
+		Parameters:
+			seq_num: int
+				MsgSeqNum of the last message written to the socket.
+
+		Returns:
+			None
+		"""
+
+		self.append(OUTBOUND_SEQ, seq_num=seq_num)
+
+	def record_inbound(self, seq_num):
+		"""
+		Records the last MsgSeqNum received.
+
+		Parameters:
+			seq_num: int
+				MsgSeqNum of the last message read off the socket.
+
+		Returns:
+			None
+		"""
+
+		self.append(INBOUND_SEQ, seq_num=seq_num)
+
+	def record_order(self, order, state):
+		"""
+		Records an order's state.
+
+		Parameters:
+			order: Order
+				Order whose state changed.
+			state: int
+				One of the ORDER_* states.
+
+		Returns:
+			None
+		"""
+
+		self.append(
+			ORDER, side=SIDES.get(order.order_type, 0), state=state,
+			price=order.price, size=order.size, filled=order.cumulative_filled,
+			client_order_id=order.client_order_id.encode(),
+			order_id=(order.order_id or '').encode()
+		)
+
+	def compact(self):
+		"""
+		Rewrites the journal as just the current sequence numbers and live
+		orders. Must hold journal_lock.
+
+		Returns:
+			None
+		"""
+
+		records = [
+			(OUTBOUND_SEQ, 0, 0, self.last_outbound_seq, time.time(), 0.0, 0.0, 0.0, b'', b''),
+			(INBOUND_SEQ, 0, 0, self.last_inbound_seq, time.time(), 0.0, 0.0, 0.0, b'', b''),
+		]
+		for client_order_id, order in self.live_orders.items():
+			side, state, price, size, filled, order_id = order
+			records.append((
+				ORDER, SIDES.get(side, 0), state, 0, time.time(), price, size,
+				filled, client_order_id.encode(), (order_id or '').encode()
+			))
+
+		compact_path = self.path + '.compact'
+		with open(compact_path, 'wb') as f:
+			f.truncate(self.size)
+		with open(compact_path, 'r+b') as f:
+			compact_map = mmap.mmap(f.fileno(), self.size)
+		compact_map[:len(MAGIC)] = MAGIC
+		for i, record in enumerate(records):
+			RECORD.pack_into(compact_map, len(MAGIC) + i * RECORD.size, *record)
+		compact_map.flush()
+
+		os.replace(compact_path, self.path)
+		self.journal_map.close()
+		self.journal_map = compact_map
+		self.count = len(records)
+
+	def recover(self):
+		"""
+		State to resume the session from.
+
+		Returns:
+			next_outbound_seq: int
+				MsgSeqNum to send next.
+			last_inbound_seq: int
+				Last MsgSeqNum received.
+			live_orders: dict
+				client order id -> (order_type, state, price, size,
+				cumulative_filled, order_id) of every order that wasn't
+				closed.
+		"""
+
+		with self.journal_lock:
+			return \
+				self.last_outbound_seq + 1, self.last_inbound_seq, \
+				dict(self.live_orders)
+
+	def close(self):
+		"""
+		Flushes the journal to disk and unmaps it.
+
+		Returns:
+			None
+		"""
+
+		with self.journal_lock:
+			self.journal_map.flush()
+			self.journal_map.close()
@@ -0,0 +1,478 @@
+import argparse
+import collections
+import csv
+import os
+import resource
+import threading
+import time
+
+import numpy as np
+
+from .book_checksum import BookVerifier
+from .feed_simulator import FeedSimulator
+from .fix_simulator import FIXSimulator
+from .fix_trader import FIXTrader
+from .log import Log
+from .md_bus import L2Change
+from .metrics import Histogram
+from .orderbook_ws import OrderBookWebSocket
+from .profiler import thread_cpu_times
+from .reply_manager import reply_manager
+from .strategy import StrategyEngine, VolumeSideStrategy
+from .timer_wheel import TimerWheel
+
+
+# Columns of every report line
+REPORT_COLUMNS = (
+	'elapsed_s', 'multiple', 'generated_per_s', 'received_per_s', 'lag_p50_ms',
+	'lag_p99_ms', 'lag_max_ms', 'late', 'dropped', 'bus_dropped', 'decision_p50_us',
+	'decision_p99_us', 'decision_max_us', 'live_orders', 'ack_p50_us', 'ack_p99_us',
+	'threads', 'rss_mb',
+)
+
+
+class SoakAccount:
+
+	def __init__(self, usd, btc):
+		"""
+		Stand-in for GDAXAccount with the same attributes the order path
+		uses, so a soak test never talks to the REST API.
+
+		Parameters:
+			usd: float
+				Starting USD.
+			btc: float
+				Starting BTC.
+		"""
+
+		self.usd = usd
+		self.btc = btc
+		self.account_lock = threading.RLock()
+		self.lock_wait = Histogram()
+
+	def refresh_holdings(self):
+		"""
+		Calculated holdings are all there is.
+
+		Returns:
+			None
+		"""
+
+
+class SoakStrategy(VolumeSideStrategy):
+
+	def __init__(self, account):
+		"""
+		VolumeSideStrategy that also measures decision latency: the time
+		from a market data message arriving to the strategy having decided
+		what to do about it.
+
+		Parameters:
+			account: SoakAccount
+				Used to size orders.
+		"""
+
+		super(SoakStrategy, self).__init__(account)
+		# Seconds, swapped out by SoakMonitor every report
+		self.decision_times = []
+
+	def on_book_update(self, book):
+		"""
+		VolumeSideStrategy.on_book_update(), timed from the arrival of the
+		message that updated the book.
+
+		Returns:
+			intents: list
+				OrderIntents to carry out.
+		"""
+
+		intents = super(SoakStrategy, self).on_book_update(book)
+		self.decision_times.append(time.monotonic() - book.conflator.latest.time)
+
+		return intents
+
+
+class SoakMonitor:
+
+	def __init__(self, simulator, orderbook_ws, fix_trader, strategy, late_after=.1, max_age=10.0):
+		"""
+		Matches every level2 change the feed simulator generates to the
+		L2Change the book publishes for it, to measure feed lag (generated
+		to received by the book) and count late and dropped updates.
+		Changes are matched by side, price and size, oldest first.
+
+		Parameters:
+			simulator: FeedSimulator
+				Feed the book is connected to.
+			orderbook_ws: OrderBookWebSocket
+				Book under test.
+			fix_trader: FIXTrader
+				Order path under test.
+			strategy: SoakStrategy
+				Strategy whose decisions are timed.
+			late_after: float
+				Seconds of feed lag after which an update counts as late.
+			max_age: float
+				Seconds after which a change that never arrived counts as
+				dropped.
+		"""
+
+		self.simulator = simulator
+		self.orderbook_ws = orderbook_ws
+		self.fix_trader = fix_trader
+		self.strategy = strategy
+		self.late_after = late_after
+		self.max_age = max_age
+		self.subscription = orderbook_ws.bus.subscribe('soak', (L2Change,), capacity=1 << 20)
+		# (side, price, size) -> generation times of changes not yet seen
+		self.pending = collections.defaultdict(collections.deque)
+		self.pending_lock = threading.Lock()
+		simulator.on_change = self.on_generated
+		# Counters since the last report
+		self.generated = 0
+		self.lags = []
+		self.late = 0
+		self.dropped = 0
+		self.running = False
+		self.monitor_thread = threading.Thread(target=self.run, name='soak_monitor', daemon=True)
+
+	def start(self):
+		"""
+		Starts matching. Changes generated before the book was ready were
+		never sent to it, so they are forgotten.
+
+		Returns:
+			None
+		"""
+
+		with self.pending_lock:
+			self.pending.clear()
+		self.running = True
+		self.monitor_thread.start()
+
+	def on_generated(self, side, price, size, generate_time):
+		"""
+		FeedSimulator.on_change callback, on the simulator's thread.
+
+		Returns:
+			None
+		"""
+
+		with self.pending_lock:
+			self.pending[(side, round(price, 2), round(size, 8))].append(generate_time)
+			self.generated += 1
+
+	def run(self):
+		"""
+		Monitor thread. Matches L2Change events as they come and expires
+		changes that never arrived.
+
+		Returns:
+			None
+		"""
+
+		next_expiry = time.monotonic() + 1
+		while self.running:
+			event = self.subscription.get(timeout=.5)
+			while event is not None:
+				key = (event.side, round(float(event.price), 2), round(float(event.size), 8))
+				with self.pending_lock:
+					times = self.pending.get(key)
+					generate_time = times.popleft() if times else None
+					if times is not None and not times:
+						del self.pending[key]
+				if generate_time is not None:
+					lag = event.time - generate_time
+					self.lags.append(lag)
+					if lag > self.late_after:
+						self.late += 1
+				event = self.subscription.poll()
+
+			now = time.monotonic()
+			if now >= next_expiry:
+				next_expiry = now + 1
+				self.expire(now - self.max_age)
+
+	def expire(self, cutoff):
+		"""
+		Counts changes generated before cutoff that never arrived as
+		dropped.
+
+		Parameters:
+			cutoff: float
+				time.monotonic() before which changes are given up on.
+
+		Returns:
+			None
+		"""
+
+		with self.pending_lock:
+			for key in list(self.pending):
+				times = self.pending[key]
+				while times and times[0] < cutoff:
+					times.popleft()
+					self.dropped += 1
+				if not times:
+					del self.pending[key]
+
+	def report(self, elapsed, multiple, interval, last_received):
+		"""
+		Takes the counters since the last report.
+
+		Parameters:
+			elapsed: float
+				Seconds since the soak test started.
+			multiple: float
+				Current multiple of the peak rate.
+			interval: float
+				Seconds since the last report.
+			last_received: int
+				orderbook_ws.msgs_received at the last report.
+
+		Returns:
+			row: dict
+				The REPORT_COLUMNS.
+		"""
+
+		with self.pending_lock:
+			generated, self.generated = self.generated, 0
+		lags, self.lags = np.array(self.lags), []
+		late, self.late = self.late, 0
+		dropped, self.dropped = self.dropped, 0
+		decisions, self.strategy.decision_times = np.array(self.strategy.decision_times), []
+		ack = self.fix_trader.latency_tracker.summary()['new_to_ack']
+
+		def percentiles(values, scale):
+			if not len(values):
+				return 0.0, 0.0, 0.0
+			p50, p99 = np.percentile(values, [50, 99]) * scale
+			return float(p50), float(p99), float(values.max() * scale)
+
+		lag_p50, lag_p99, lag_max = percentiles(lags, 1e3)
+		decision_p50, decision_p99, decision_max = percentiles(decisions, 1e6)
+
+		return {
+			'elapsed_s': elapsed,
+			'multiple': multiple,
+			'generated_per_s': generated / interval,
+			'received_per_s': (self.orderbook_ws.msgs_received - last_received) / interval,
+			'lag_p50_ms': lag_p50,
+			'lag_p99_ms': lag_p99,
+			'lag_max_ms': lag_max,
+			'late': late,
+			'dropped': dropped,
+			'bus_dropped': self.subscription.dropped,
+			'decision_p50_us': decision_p50,
+			'decision_p99_us': decision_p99,
+			'decision_max_us': decision_max,
+			'live_orders': len(self.fix_trader.order_tracker.orders_by_cl_oid),
+			'ack_p50_us': ack.get('p50_us', 0.0),
+			'ack_p99_us': ack.get('p99_us', 0.0),
+			'threads': threading.active_count(),
+			'rss_mb': rss_bytes() / 2 ** 20,
+		}
+
+
+def rss_bytes():
+	"""
+	Returns:
+		rss: int
+			Resident set size of this process, or its peak where the
+			current size isn't available.
+	"""
+
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except OSError:
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_soak(
+		multiples=(1, 2, 4), stage_duration=600.0, peak_rate=500.0, report_interval=10.0,
+		feeds=1, first_port=8765, max_changes=5, burst_interval=5.0, burst_size=500,
+		snapshot_interval=60.0, replay=None, fill_delay=.5, usd=10000.0, btc=1.0,
+		late_after=.1, fix_sessions=1, verify_interval=0.0, out=None):
+	"""
+	Runs the bot's real market data and order paths against the feed and
+	FIX stand-ins, stepping the feed through multiples of the peak rate,
+	and prints a report line every report_interval seconds.
+
+	Parameters:
+		multiples: tuple
+			Multiples of peak_rate to run at, in order.
+		stage_duration: float
+			Seconds to run each multiple for.
+		peak_rate: float
+			Level2 changes per second taken as the real peak rate.
+		report_interval: float
+			Seconds between report lines.
+		feeds: int
+			Redundant feed connections, each to its own simulator port.
+		first_port: int
+			Port of the first feed.
+		max_changes, burst_interval, burst_size, snapshot_interval:
+			Passed to FeedSimulator. Bursts are scaled by the multiple.
+		replay: string
+			tick_store_path to replay instead of a random walk.
+		fill_delay: float
+			Seconds the FIX stand-in waits before filling an order.
+		usd, btc: float
+			Starting holdings.
+		late_after: float
+			Seconds of feed lag after which an update counts as late.
+		fix_sessions: int
+			FIX sessions FIXTrader spreads orders over.
+		verify_interval: float
+			Seconds between checks of the book against the feed stand-in's
+			own book, 0 to not check.
+		out: string
+			CSV file to also write the report lines to.
+
+	Returns:
+		rows: list
+			Every report line.
+	"""
+
+	ports = tuple(range(first_port, first_port + feeds))
+	simulator = FeedSimulator(
+		ports, (0.0,) * feeds, rate=peak_rate * multiples[0], max_changes=max_changes,
+		burst_interval=burst_interval, burst_size=int(burst_size * multiples[0]),
+		snapshot_interval=snapshot_interval
+	)
+	if replay:
+		simulator.replay(replay)
+	simulator.start()
+	fix_simulator = FIXSimulator(fill_delay=fill_delay)
+	threading.Thread(
+		target=fix_simulator.serve_forever, name='fix_simulator', daemon=True
+	).start()
+
+	logger = Log()
+	ob_updated_cond = threading.Condition()
+	scheduler = TimerWheel(logger)
+	scheduler.start()
+	account = SoakAccount(usd, btc)
+	orderbook_ws = OrderBookWebSocket(
+		ob_updated_cond, logger, subscribe_matches=True,
+		feed_urls=[f'ws://127.0.0.1:{port}' for port in ports]
+	)
+	# The stand-in doesn't check the signature, but the secret must be
+	# base64 for the Logon to be signed at all
+	fix_trader = FIXTrader(
+		'key', 'c2VjcmV0', 'passphrase', account, orderbook_ws, ob_updated_cond,
+		logger, scheduler, sessions=fix_sessions
+	)
+	for session in fix_trader.sessions:
+		name = 'reply_manager' if session.index == 0 else f'reply_manager_{session.index}'
+		threading.Thread(
+			target=reply_manager, args=(fix_trader, logger),
+			kwargs={'session': session}, name=name, daemon=True
+		).start()
+	strategy = SoakStrategy(account)
+	monitor = SoakMonitor(simulator, orderbook_ws, fix_trader, strategy, late_after=late_after)
+
+	orderbook_ws.start()
+	orderbook_ws.ready.wait()
+	fix_trader.logged_on.wait()
+	monitor.start()
+	book_verifier = None
+	if verify_interval > 0:
+		book_verifier = BookVerifier(
+			orderbook_ws, simulator.book_snapshot, logger, interval=verify_interval
+		)
+		book_verifier.start()
+	strategy_engine = StrategyEngine(fix_trader, logger)
+	strategy_engine.add(strategy)
+	fix_trader.strategy_engine = strategy_engine
+	orderbook_ws.strategy_engine = strategy_engine
+
+	rows = []
+	writer = None
+	if out:
+		out_file = open(out, 'w', newline='')
+		writer = csv.DictWriter(out_file, fieldnames=REPORT_COLUMNS)
+		writer.writeheader()
+	print('  '.join(REPORT_COLUMNS))
+
+	start = last_report = time.monotonic()
+	last_received = orderbook_ws.msgs_received
+	for multiple in multiples:
+		simulator.rate = peak_rate * multiple
+		simulator.burst_size = int(burst_size * multiple)
+		stage_end = time.monotonic() + stage_duration
+		while time.monotonic() < stage_end:
+			time.sleep(max(min(report_interval, stage_end - time.monotonic()), 0))
+			now = time.monotonic()
+			row = monitor.report(now - start, multiple, now - last_report, last_received)
+			last_report, last_received = now, orderbook_ws.msgs_received
+			rows.append(row)
+			print('  '.join(
+				f'{row[c]:.1f}' if isinstance(row[c], float) else str(row[c])
+				for c in REPORT_COLUMNS
+			), flush=True)
+			if writer is not None:
+				writer.writerow(row)
+				out_file.flush()
+			logger.flush()
+
+	logger.add(f'Soak test thread CPU seconds: {thread_cpu_times()}')
+	logger.add(f'Soak test strategy stats: {strategy_engine.stats()}')
+	if book_verifier is not None:
+		logger.add(f'Soak test book verifier stats: {book_verifier.stats()}')
+	logger.flush()
+	if writer is not None:
+		out_file.close()
+
+	return rows
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(
+		description=(
+			'Soak test the market data and order paths against local feed and '
+			'FIX stand-ins.'
+		)
+	)
+	parser.add_argument(
+		'--multiples', type=float, nargs='+', default=[1, 2, 4],
+		help='Multiples of the peak rate to run at, in order'
+	)
+	parser.add_argument(
+		'--stage-duration', type=float, default=600, help='Seconds per multiple'
+	)
+	parser.add_argument(
+		'--peak-rate', type=float, default=500,
+		help='Level2 changes per second taken as the real peak rate'
+	)
+	parser.add_argument('--report-interval', type=float, default=10)
+	parser.add_argument('--feeds', type=int, default=1, help='Redundant feed connections')
+	parser.add_argument('--max-changes', type=int, default=5, help='Most changes per l2update')
+	parser.add_argument('--burst-interval', type=float, default=5)
+	parser.add_argument(
+		'--burst-size', type=int, default=500, help='Changes per burst at a multiple of 1'
+	)
+	parser.add_argument('--snapshot-interval', type=float, default=60)
+	parser.add_argument('--replay', help='tick_store_path to replay instead of a random walk')
+	parser.add_argument('--fill-delay', type=float, default=.5)
+	parser.add_argument('--late-after', type=float, default=.1)
+	parser.add_argument('--fix-sessions', type=int, default=1)
+	parser.add_argument(
+		'--verify-interval', type=float, default=0,
+		help='Seconds between checks of the book against the stand-in\'s'
+	)
+	parser.add_argument('--out', help='CSV file to also write the report to')
+	args = parser.parse_args()
+
+	run_soak(
+		multiples=args.multiples, stage_duration=args.stage_duration,
+		peak_rate=args.peak_rate, report_interval=args.report_interval,
+		feeds=args.feeds, max_changes=args.max_changes,
+		burst_interval=args.burst_interval, burst_size=args.burst_size,
+		snapshot_interval=args.snapshot_interval, replay=args.replay,
+		fill_delay=args.fill_delay, late_after=args.late_after,
+		fix_sessions=args.fix_sessions, verify_interval=args.verify_interval,
+		out=args.out
+	)
+	# The scheduler and FIX writer threads aren't daemons
+	os._exit(0)
@@ -0,0 +1,393 @@
+import collections
+import time
+
+from .order import Order
+
+
+# What a strategy wants done. action is 'order' or 'cancel'. 'order' uses
+# order_type ('buy' or 'sell'), price and size; 'cancel' uses order.
+OrderIntent = collections.namedtuple(
+	'OrderIntent', ['action', 'order_type', 'price', 'size', 'order']
+)
+
+
+def order_intent(order_type, price, size):
+	"""
+	Shorthand for an OrderIntent that places a new order.
+
+	Parameters:
+		order_type: string
+			'buy' or 'sell'.
+		price: float
+			Price to enter at.
+		size: float
+			Size of the order.
+
+	Returns:
+		intent: OrderIntent
+	"""
+
+	return OrderIntent('order', order_type, price, size, None)
+
+
+def cancel_intent(order):
+	"""
+	Shorthand for an OrderIntent that cancels an order.
+
+	Parameters:
+		order: Order
+			Order to cancel.
+
+	Returns:
+		intent: OrderIntent
+	"""
+
+	return OrderIntent('cancel', None, None, None, order)
+
+
+class Strategy:
+
+	def __init__(self, account):
+		"""
+		Base class for strategy plugins. StrategyEngine calls the on_*
+		methods directly from the thread the event happens on (the websocket
+		thread for book updates, the reply thread for fills and rejects), so
+		they must return quickly and never block. Each returns a list of
+		OrderIntents for the engine to carry out.
+
+		Parameters:
+			account: GDAXAccount
+				Used to size orders.
+		"""
+
+		self.account = account
+		self.name = type(self).__name__
+		# Orders this strategy placed that are still live. Orders add
+		# themselves and StrategyEngine removes them from other threads, so
+		# iterate over a copy.
+		self.open_orders = set()
+
+	def on_book_update(self, book):
+		"""
+		Called after every order book update, while the book is locked.
+
+		Parameters:
+			book: OrderBookWebSocket
+				The updated order book. book.signals holds multi-level book
+				signals and book.trades rolling trade stats (last trade
+				price, VWAP, volatility, etc.) when matches are subscribed.
+
+		Returns:
+			intents: list
+				OrderIntents to carry out.
+		"""
+
+		return []
+
+	def on_fill(self, order, amount_filled):
+		"""
+		Called when one of this strategy's orders is (partially) filled.
+
+		Parameters:
+			order: Order
+				The order that was filled.
+			amount_filled: float
+				Amount filled by this execution.
+
+		Returns:
+			intents: list
+				OrderIntents to carry out.
+		"""
+
+		return []
+
+	def on_reject(self, order, msg):
+		"""
+		Called when one of this strategy's orders is rejected.
+
+		Parameters:
+			order: Order
+				The order that was rejected.
+			msg: dict
+				Parsed FIX Execution Report.
+
+		Returns:
+			intents: list
+				OrderIntents to carry out.
+		"""
+
+		return []
+
+
+class VolumeSideStrategy(Strategy):
+
+	def __init__(self, account, gdax_min_trade_size_btc=.001, size_factor=.995):
+		"""
+		Plugin version of strategy_manager() and
+		Order.volume_side_strategy(): enters on the side of the book with
+		more size at the best price and cancels once the order is outbid or
+		the size imbalance flips, unless the order is expected to fill soon
+		from where it is in the queue.
+
+		Parameters:
+			account: GDAXAccount
+				Used to size orders.
+			gdax_min_trade_size_btc: float
+				Ensures that the GDAX minimum bitcoin trade size criteria is
+				met before attempting to place an order.
+			size_factor: float
+				Fraction of (calculated) holdings each order is for.
+		"""
+
+		super(VolumeSideStrategy, self).__init__(account)
+		self.gdax_min_trade_size_btc = gdax_min_trade_size_btc
+		self.size_factor = size_factor
+
+	def on_book_update(self, book):
+		"""
+		Enters a position if there is none, otherwise checks whether the
+		live order is still valid.
+
+		Parameters:
+			book: OrderBookWebSocket
+				The updated order book.
+
+		Returns:
+			intents: list
+				OrderIntents to carry out.
+		"""
+
+		if book.best_buy_size > book.best_sell_size:
+			strategy = 'buy'
+		else:
+			strategy = 'sell'
+
+		open_orders = tuple(self.open_orders)
+		if open_orders:
+			intents = []
+			for order in open_orders:
+				# Wait for the order to be acknowledged before canceling it
+				if order.cancel_requested or order.order_id is None:
+					continue
+				if order.order_type == 'buy':
+					current_price = book.best_buy_price
+				else:
+					current_price = book.best_sell_price
+				if order.price != current_price or order.order_type != strategy:
+					# Unless it's close enough to the front of the queue
+					if not order.keep_queue_position(book):
+						intents.append(cancel_intent(order))
+			return intents
+
+		# Trade with a little less than (calculated) holdings to minimize
+		# insufficient funds messages
+		if strategy == 'buy':
+			price = book.best_buy_price
+			if self.account.usd > self.gdax_min_trade_size_btc * book.recent_price:
+				return [order_intent('buy', price, self.account.usd * self.size_factor / price)]
+		else:
+			price = book.best_sell_price
+			if self.account.btc > self.gdax_min_trade_size_btc:
+				return [order_intent('sell', price, self.account.btc * self.size_factor)]
+
+		return []
+
+
+# Strategies that can be enabled by name in config.ini
+STRATEGIES = {
+	'volume_side': VolumeSideStrategy,
+}
+
+
+class StrategyEngine:
+
+	def __init__(self, fix_trader, logger):
+		"""
+		Runs any number of Strategy plugins side by side. The engine's
+		on_* methods are called directly from the order book and reply
+		manager, pass the event to each strategy in turn and carry out the
+		OrderIntents they return. Time spent in each strategy's callbacks
+		is recorded per strategy.
+
+		Parameters:
+			fix_trader: FIXTrader
+				Used to place and cancel orders.
+			logger: Log
+				Used to log messages as needed.
+		"""
+
+		self.fix_trader = fix_trader
+		self.logger = logger
+		self.strategies = []
+		# strategy name -> [calls, total seconds, max seconds, intents]
+		self.latency = {}
+		# strategy name -> exceptions raised
+		self.errors = collections.Counter()
+
+	def add(self, strategy):
+		"""
+		Starts running strategy on every event.
+
+		Parameters:
+			strategy: Strategy
+				Strategy plugin to run.
+
+		Returns:
+			None
+		"""
+
+		# Running the same plugin twice still needs separate counters
+		if strategy.name in self.latency:
+			strategy.name = f'{strategy.name}_{len(self.strategies)}'
+		self.strategies.append(strategy)
+		self.latency[strategy.name] = [0, 0.0, 0.0, 0]
+		self.logger.add(f'Added strategy {strategy.name}')
+
+	def on_book_update(self, book):
+		"""
+		Passes an order book update to every strategy.
+
+		Parameters:
+			book: OrderBookWebSocket
+				The updated order book.
+
+		Returns:
+			None
+		"""
+
+		for strategy in self.strategies:
+			# One failing plugin mustn't take the book's thread down
+			try:
+				start = time.perf_counter()
+				intents = strategy.on_book_update(book)
+				self.record(strategy, start, intents)
+				if intents:
+					self.execute(strategy, intents)
+			except Exception as error:
+				self.on_error(strategy, error)
+
+	def on_execution_report(self, order, msg):
+		"""
+		Passes fills and rejects of a strategy's order to that strategy and
+		forgets orders that are no longer live.
+
+		Parameters:
+			order: Order
+				Order the Execution Report is for.
+			msg: dict
+				Parsed FIX Execution Report.
+
+		Returns:
+			None
+		"""
+
+		strategy = order.strategy
+		if strategy is None:
+			return
+
+		ord_status = msg.get('OrdStatus')
+		if ord_status in ('Done for day', 'Canceled', 'Rejected'):
+			strategy.open_orders.discard(order)
+
+		# One failing plugin mustn't take the reply_manager's thread down
+		try:
+			start = time.perf_counter()
+			intents = []
+			if ord_status == 'Rejected':
+				intents = strategy.on_reject(order, msg)
+			elif 'LastShares' in msg:
+				intents = strategy.on_fill(order, float(msg['LastShares']))
+			self.record(strategy, start, intents)
+			if intents:
+				self.execute(strategy, intents)
+		except Exception as error:
+			self.on_error(strategy, error)
+
+	def on_error(self, strategy, error):
+		"""
+		Logs an exception raised by a strategy's callback, or while
+		carrying out its intents, and counts it.
+
+		Parameters:
+			strategy: Strategy
+				Strategy whose callback failed.
+			error: Exception
+				What it raised.
+
+		Returns:
+			None
+		"""
+
+		self.errors[strategy.name] += 1
+		self.logger.add(f'Strategy {strategy.name} failed: {error!r}')
+
+	def record(self, strategy, start, intents):
+		"""
+		Updates a strategy's latency counters.
+
+		Parameters:
+			strategy: Strategy
+				Strategy whose callback just returned.
+			start: float
+				time.perf_counter() when the callback was called.
+			intents: list
+				OrderIntents the callback returned.
+
+		Returns:
+			None
+		"""
+
+		elapsed = time.perf_counter() - start
+		counters = self.latency[strategy.name]
+		counters[0] += 1
+		counters[1] += elapsed
+		if elapsed > counters[2]:
+			counters[2] = elapsed
+		counters[3] += len(intents)
+
+	def execute(self, strategy, intents):
+		"""
+		Carries out a strategy's OrderIntents.
+
+		Parameters:
+			strategy: Strategy
+				Strategy the intents came from.
+			intents: list
+				OrderIntents to carry out.
+
+		Returns:
+			None
+		"""
+
+		for intent in intents:
+			if intent.action == 'order':
+				if self.fix_trader.admit_order(intent.order_type, intent.price, intent.size):
+					Order(
+						intent.price, intent.size, intent.order_type,
+						self.fix_trader, strategy=strategy
+					)
+			elif intent.action == 'cancel':
+				intent.order.request_cancel()
+
+	def stats(self):
+		"""
+		Per strategy latency and error counters.
+
+		Returns:
+			out: dict
+				strategy name -> dict of callback count, mean and max
+				callback time in seconds, number of intents returned and
+				number of exceptions raised.
+		"""
+
+		out = {}
+		for name, (calls, total, max_time, intents) in self.latency.items():
+			out[name] = {
+				'calls': calls,
+				'mean': total / calls if calls else 0.0,
+				'max': max_time,
+				'intents': intents,
+				'errors': self.errors[name],
+			}
+
+		return out
@@ -1,3 +1,5 @@
+import time
+
 from .truncate import truncate
 
 
@@ -7,13 +9,9 @@ def strategy_manager(fix_trader, logger, gdax_min_trade_size_btc=.001):
 	outstanding orders. If not, it creates an order on the side with more
 	orders and attempts to capture the spread between the bid and ask prices.
 
-	TODO: make strategy_manager() run only if the order book updates
-	Currently, if the order book is updated and the update moves the
-	most competitive bid or ask price, ob_updated_cond is notified and
-	outstanding orders check if they should be canceled given this new info.
-	Updating strategy_manager() to run on this notification would make
-	cryptobot more event-driven and fit in with the way existing orders
-	handle order book updates.
+	Runs once per order book update. Updates are conflated, so if several
+	arrive while a decision is being made, the next decision is made on the
+	latest book only.
 
 	Parameters:
 		fix_trader: FIXTrader
@@ -30,8 +28,12 @@ def strategy_manager(fix_trader, logger, gdax_min_trade_size_btc=.001):
 		None
 	"""
 
+	book_reader = fix_trader.orderbook_ws.conflator.subscribe()
 	while True:
+		book = book_reader.read()
+		lock_start = time.monotonic()
 		with fix_trader.account.account_lock:
+			fix_trader.account.lock_wait.observe(time.monotonic() - lock_start)
 
 			if fix_trader.order_tracker.orders_by_cl_oid:
 				order_exists = True
@@ -50,9 +52,9 @@ def strategy_manager(fix_trader, logger, gdax_min_trade_size_btc=.001):
 			usd_holding_truncated = truncate(usd_holding, 2)
 			btc_holding_truncated = truncate(btc_holding, 8)
 
-			recent_price = fix_trader.orderbook_ws.recent_price
-			best_buy_size = fix_trader.orderbook_ws.best_buy_size
-			best_sell_size = fix_trader.orderbook_ws.best_sell_size
+			recent_price = book.recent_price
+			best_buy_size = book.best_buy_size
+			best_sell_size = book.best_sell_size
 
 			if best_buy_size > best_sell_size:
 				strategy = 'buy'
@@ -0,0 +1,616 @@
+import datetime as dt
+import os
+import threading
+import time
+
+import numpy as np
+
+from .md_bus import L2Change, TopOfBook, Trade
+
+
+# Columns of every table as (name, dtype, values per row). Each column is
+# a file of fixed width values appended row by row, so a file's size alone
+# says how many rows it holds.
+TABLES = {
+	'top': (
+		('time_ns', np.int64, 1),
+		('best_buy_price', np.float64, 1),
+		('best_buy_size', np.float64, 1),
+		('best_sell_price', np.float64, 1),
+		('best_sell_size', np.float64, 1),
+	),
+	'trades': (
+		('time_ns', np.int64, 1),
+		('price', np.float64, 1),
+		('size', np.float64, 1),
+		# Maker's side, 1 for buy and 2 for sell
+		('side', np.int8, 1),
+		('trade_id', np.int64, 1),
+	),
+	# Level2 changes as they arrived, before the book filtered them, so a
+	# backtest can rebuild the book with other filter settings
+	'changes': (
+		('time_ns', np.int64, 1),
+		('side', np.int8, 1),
+		('price', np.float64, 1),
+		('size', np.float64, 1),
+	),
+	'depth': (
+		('time_ns', np.int64, 1),
+		# Best first, padded with zeros past the last level
+		('bid_prices', np.float64, 'levels'),
+		('bid_sizes', np.float64, 'levels'),
+		('ask_prices', np.float64, 'levels'),
+		('ask_sizes', np.float64, 'levels'),
+	),
+}
+
+# Every INDEX_STRIDE-th row's time goes into a table's time_index file, so a
+# range query finds its rows by searching the small index and then a single
+# stride of the time column. 512 int64 times fill one 4KiB page.
+INDEX_STRIDE = 512
+
+# Same encoding as md_ring's
+SIDES = {'buy': 1, 'sell': 2}
+
+
+def day_dir(root, product, day):
+	"""
+	Parameters:
+		root: string
+			Directory of the store.
+		product: string
+			e.g. 'BTC-USD'.
+		day: datetime.date
+			UTC day.
+
+	Returns:
+		path: string
+			Directory holding one product's tables for one day.
+	"""
+
+	return os.path.join(root, product, day.isoformat())
+
+
+class TableWriter:
+
+	def __init__(self, path, columns, levels):
+		"""
+		Appends rows to one table's column files and keeps its time index
+		up to date.
+
+		Parameters:
+			path: string
+				Directory of the table, created if missing.
+			columns: tuple
+				The table's entry in TABLES.
+			levels: int
+				Values per row of 'levels' wide columns.
+		"""
+
+		os.makedirs(path, exist_ok=True)
+		self.columns = [
+			(name, dtype, levels if width == 'levels' else width)
+			for name, dtype, width in columns
+		]
+		# Rows already on disk, picking up where an earlier run left off
+		self.files = {}
+		row_bytes = {}
+		for name, dtype, width in self.columns:
+			self.files[name] = open(os.path.join(path, name), 'ab')
+			row_bytes[name] = np.dtype(dtype).itemsize * width
+		self.rows = min(
+			os.path.getsize(os.path.join(path, name)) // row_bytes[name] for name in self.files
+		)
+		# A flush cut short (a crash or a full disk between column writes)
+		# leaves some columns longer than others. They are cut back to the
+		# rows every column has, or they would stay out of step from here on.
+		for name, f in self.files.items():
+			f.truncate(self.rows * row_bytes[name])
+		self.index_file = open(os.path.join(path, 'time_index'), 'ab')
+		self.repair_index(path)
+		self.pending = []
+
+	def repair_index(self, path):
+		"""
+		Makes the time index hold exactly one entry per INDEX_STRIDE rows
+		on disk, dropping entries past the last row and adding any that a
+		flush cut short didn't write.
+
+		Parameters:
+			path: string
+				Directory of the table.
+
+		Returns:
+			None
+		"""
+
+		itemsize = np.dtype(np.int64).itemsize
+		entries = -(-self.rows // INDEX_STRIDE)
+		existing = min(os.path.getsize(os.path.join(path, 'time_index')) // itemsize, entries)
+		self.index_file.truncate(existing * itemsize)
+		if existing < entries:
+			times = np.memmap(
+				os.path.join(path, 'time_ns'), dtype=np.int64, mode='r', shape=(self.rows,)
+			)
+			self.index_file.write(times[existing * INDEX_STRIDE::INDEX_STRIDE].tobytes())
+			self.index_file.flush()
+
+	def append(self, row):
+		"""
+		Buffers a row until the next flush().
+
+		Parameters:
+			row: tuple
+				One value (or sequence of values for wide columns) per column.
+
+		Returns:
+			None
+		"""
+
+		self.pending.append(row)
+
+	def flush(self):
+		"""
+		Writes buffered rows out, one contiguous write per column.
+
+		Returns:
+			None
+		"""
+
+		if not self.pending:
+			return
+
+		rows = self.pending
+		self.pending = []
+		for i, (name, dtype, width) in enumerate(self.columns):
+			values = np.array([row[i] for row in rows], dtype=dtype)
+			self.files[name].write(values.tobytes())
+			self.files[name].flush()
+
+		# Index every row whose number is a multiple of INDEX_STRIDE
+		first = -self.rows % INDEX_STRIDE
+		times = np.array([row[0] for row in rows[first::INDEX_STRIDE]], dtype=np.int64)
+		if len(times):
+			self.index_file.write(times.tobytes())
+			self.index_file.flush()
+		self.rows += len(rows)
+
+	def close(self):
+		"""
+		Flushes and closes every file.
+
+		Returns:
+			None
+		"""
+
+		self.flush()
+		for f in self.files.values():
+			f.close()
+		self.index_file.close()
+
+
+class TickRecorder:
+
+	def __init__(
+			self, orderbook_ws, root, product='BTC-USD', levels=10,
+			depth_interval=1.0, flush_interval=1.0):
+		"""
+		Records top of book changes, trades, raw level2 changes and periodic
+		depth snapshots into a TickStore. Everything is taken off the book
+		writer's thread: top of book and trades through a MarketDataBus
+		subscription, and depth from the conflator's latest snapshot, so
+		recording adds nothing to the market data path but the bus publish.
+
+		Files are split by product and UTC day as
+		root/product/YYYY-MM-DD/table/column.
+
+		Parameters:
+			orderbook_ws: OrderBookWebSocket or RingBook
+				Book to record.
+			root: string
+				Directory of the store.
+			product: string
+				Product the book is for.
+			levels: int
+				Levels per side in depth snapshots.
+			depth_interval: float
+				Seconds between depth snapshots. A snapshot is only written
+				if the book changed since the last one.
+			flush_interval: float
+				Seconds between writes to disk.
+		"""
+
+		self.orderbook_ws = orderbook_ws
+		self.root = root
+		self.product = product
+		self.levels = levels
+		self.depth_interval = depth_interval
+		self.flush_interval = flush_interval
+		self.subscription = orderbook_ws.bus.subscribe(
+			'tick_recorder', (TopOfBook, Trade, L2Change), capacity=65536
+		)
+		# Bus and book times are time.monotonic(), files hold wall clock
+		# nanoseconds
+		self.wall_offset = time.time() - time.monotonic()
+		self.day = None
+		self.tables = {}
+		self.last_depth_version = None
+		self.running = False
+		self.recorder_thread = threading.Thread(
+			target=self.run, name='tick_recorder', daemon=True
+		)
+		# Stats, only written by the recorder thread
+		self.rows_written = {table: 0 for table in TABLES}
+
+	def start(self):
+		"""
+		Launches the recorder thread.
+
+		Returns:
+			None
+		"""
+
+		self.running = True
+		self.recorder_thread.start()
+
+	def stop(self):
+		"""
+		Stops the recorder thread and writes out whatever is buffered.
+
+		Returns:
+			None
+		"""
+
+		self.running = False
+		self.recorder_thread.join()
+
+	def run(self):
+		"""
+		Recorder thread.
+
+		Returns:
+			None
+		"""
+
+		next_depth = next_flush = time.monotonic()
+		while self.running:
+			event = self.subscription.get(timeout=min(self.depth_interval, self.flush_interval))
+			while event is not None:
+				self.record(event)
+				event = self.subscription.poll()
+
+			now = time.monotonic()
+			if now >= next_depth:
+				next_depth = now + self.depth_interval
+				self.record_depth()
+			if now >= next_flush:
+				next_flush = now + self.flush_interval
+				self.flush()
+
+		self.close()
+
+	def table(self, name, time_ns):
+		"""
+		Returns the writer of a table for the UTC day time_ns falls on,
+		moving every table on to a new day's files at midnight.
+
+		Parameters:
+			name: string
+				Table name from TABLES.
+			time_ns: int
+				Wall clock nanoseconds of the row about to be written.
+
+		Returns:
+			writer: TableWriter
+		"""
+
+		day = dt.datetime.fromtimestamp(time_ns / 1e9, dt.timezone.utc).date()
+		if day != self.day:
+			self.close()
+			self.day = day
+		writer = self.tables.get(name)
+		if writer is None:
+			path = os.path.join(day_dir(self.root, self.product, day), name)
+			writer = self.tables[name] = TableWriter(path, TABLES[name], self.levels)
+
+		return writer
+
+	def record(self, event):
+		"""
+		Buffers a row for a bus event.
+
+		Parameters:
+			event: TopOfBook, Trade or L2Change
+
+		Returns:
+			None
+		"""
+
+		time_ns = int((event.time + self.wall_offset) * 1e9)
+		if type(event) is TopOfBook:
+			self.table('top', time_ns).append((
+				time_ns, event.best_buy_price, event.best_buy_size,
+				event.best_sell_price, event.best_sell_size
+			))
+		elif type(event) is L2Change:
+			self.table('changes', time_ns).append((
+				time_ns, SIDES.get(event.side, 0), event.price, event.size
+			))
+		else:
+			trade_id = event.trade_id if event.trade_id is not None else -1
+			self.table('trades', time_ns).append((
+				time_ns, event.price, event.size, SIDES.get(event.side, 0), trade_id
+			))
+
+	def record_depth(self):
+		"""
+		Buffers a depth snapshot of the latest book, if it changed since
+		the last one.
+
+		Returns:
+			None
+		"""
+
+		book = self.orderbook_ws.conflator.latest
+		if book is None or book.version == self.last_depth_version:
+			return
+		self.last_depth_version = book.version
+
+		levels = self.levels
+		bids = np.zeros((levels, 2))
+		asks = np.zeros((levels, 2))
+		# Best bid is the last row of ob_buys, best ask the first of ob_sells
+		top_bids = book.ob_buys[::-1][:levels]
+		top_asks = book.ob_sells[:levels]
+		bids[:len(top_bids)] = top_bids
+		asks[:len(top_asks)] = top_asks
+		time_ns = int((book.time + self.wall_offset) * 1e9)
+		self.table('depth', time_ns).append((
+			time_ns, bids[:, 0], bids[:, 1], asks[:, 0], asks[:, 1]
+		))
+
+	def flush(self):
+		"""
+		Writes every table's buffered rows out.
+
+		Returns:
+			None
+		"""
+
+		for name, writer in self.tables.items():
+			self.rows_written[name] += len(writer.pending)
+			writer.flush()
+
+	def close(self):
+		"""
+		Flushes and closes the current day's files.
+
+		Returns:
+			None
+		"""
+
+		self.flush()
+		for writer in self.tables.values():
+			writer.close()
+		self.tables = {}
+
+	def stats(self):
+		"""
+		Returns:
+			stats: dict
+				Rows written per table and the bus subscription's stats.
+		"""
+
+		return {'rows_written': dict(self.rows_written), **self.subscription.stats()}
+
+
+class TickStore:
+
+	def __init__(self, root, levels=10):
+		"""
+		Read side of the files TickRecorder writes. Columns are memory
+		mapped read only and a query slices them, so only the pages holding
+		the requested rows are ever read from disk.
+
+		Parameters:
+			root: string
+				Directory of the store.
+			levels: int
+				Levels per side the depth table was recorded with.
+		"""
+
+		self.root = root
+		self.levels = levels
+
+	def days(self, product):
+		"""
+		Parameters:
+			product: string
+				e.g. 'BTC-USD'.
+
+		Returns:
+			days: list
+				datetime.date of every day recorded for product, in order.
+		"""
+
+		path = os.path.join(self.root, product)
+		if not os.path.isdir(path):
+			return []
+
+		return sorted(dt.date.fromisoformat(name) for name in os.listdir(path))
+
+	def span(self, product):
+		"""
+		Parameters:
+			product: string
+				e.g. 'BTC-USD'.
+
+		Returns:
+			start, end: datetime.datetime
+				Start of the first and end of the last day recorded for
+				product, None if there are none.
+		"""
+
+		days = self.days(product)
+		if not days:
+			return None, None
+
+		return (
+			dt.datetime.combine(days[0], dt.time()),
+			dt.datetime.combine(days[-1] + dt.timedelta(days=1), dt.time())
+		)
+
+	def column(self, path, dtype, width):
+		"""
+		Memory maps one column file.
+
+		Returns:
+			values: numpy.memmap or numpy.ndarray
+				One entry per row, or one row of width values per row.
+		"""
+
+		row_bytes = np.dtype(dtype).itemsize * width
+		rows = os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+		if rows == 0:
+			return np.zeros((0, width) if width > 1 else 0, dtype=dtype)
+		values = np.memmap(path, dtype=dtype, mode='r', shape=(rows * width,))
+
+		return values.reshape(rows, width) if width > 1 else values
+
+	def query(self, product, table, start, end, columns=None):
+		"""
+		Rows of a table recorded between two times.
+
+		Parameters:
+			product: string
+				e.g. 'BTC-USD'.
+			table: string
+				'top', 'trades', 'changes' or 'depth'.
+			start, end: datetime.datetime
+				UTC time range, start inclusive and end exclusive. Naive
+				datetimes are taken to be UTC.
+			columns: list
+				Columns to return, every column by default. time_ns is always
+				returned.
+
+		Returns:
+			result: dict
+				Column name -> values in the range. Read straight from the
+				memory mapped files when the range is within one day, copied
+				into memory otherwise. See query_days() to avoid the copy.
+		"""
+
+		parts = self.query_days(product, table, start, end, columns)
+		if len(parts) == 1:
+			return parts[0]
+
+		result = {}
+		for name, dtype, width in self.schema(table, columns):
+			if parts:
+				result[name] = np.concatenate([part[name] for part in parts])
+			else:
+				result[name] = np.zeros((0, width) if width > 1 else 0, dtype=dtype)
+
+		return result
+
+	def query_days(self, product, table, start, end, columns=None):
+		"""
+		Same as query(), split by day so that every column is always a
+		slice of a memory mapped file. Processes querying the same range
+		share the pages they read instead of each holding a copy.
+
+		Parameters:
+			See query().
+
+		Returns:
+			parts: list
+				One dict of column name -> values per day recorded in the
+				range, in order. Days without rows in the range have empty
+				columns, so the parts of different tables line up by day.
+		"""
+
+		start_ns = to_ns(start)
+		end_ns = to_ns(end)
+		schema = self.schema(table, columns)
+
+		parts = []
+		for day in self.days(product):
+			day_start = to_ns(dt.datetime.combine(day, dt.time()))
+			if day_start >= end_ns or day_start + 86400 * 10 ** 9 <= start_ns:
+				continue
+
+			path = os.path.join(day_dir(self.root, product, day), table)
+			mapped = {
+				name: self.column(os.path.join(path, name), dtype, width)
+				for name, dtype, width in schema
+			}
+			rows = min(len(values) for values in mapped.values())
+			first, last = self.find_rows(path, mapped['time_ns'][:rows], start_ns, end_ns)
+			parts.append({name: values[first:last] for name, values in mapped.items()})
+
+		return parts
+
+	def schema(self, table, columns=None):
+		"""
+		Parameters:
+			table: string
+				Name of a table in TABLES.
+			columns: list
+				As passed to query().
+
+		Returns:
+			schema: list
+				(name, dtype, width) of the columns to read.
+		"""
+
+		return [
+			(name, dtype, self.levels if width == 'levels' else width)
+			for name, dtype, width in TABLES[table]
+			if columns is None or name == 'time_ns' or name in columns
+		]
+
+	def find_rows(self, path, times, start_ns, end_ns):
+		"""
+		Finds the rows of one day's table in a time range, touching the
+		time index and at most two strides of the time column.
+
+		Parameters:
+			path: string
+				Directory of the table.
+			times: numpy.memmap
+				The table's time_ns column.
+			start_ns, end_ns: int
+				Time range, start inclusive and end exclusive.
+
+		Returns:
+			first, last: int
+				Row range.
+		"""
+
+		index = self.column(os.path.join(path, 'time_index'), np.int64, 1)
+
+		def bound(t):
+			block = max(int(np.searchsorted(index, t, 'left')) - 1, 0)
+			lo = block * INDEX_STRIDE
+			hi = min((block + 2) * INDEX_STRIDE, len(times))
+			return lo + int(np.searchsorted(times[lo:hi], t, 'left'))
+
+		return bound(start_ns), bound(end_ns)
+
+
+def to_ns(when):
+	"""
+	Parameters:
+		when: datetime.datetime
+			Naive datetimes are taken to be UTC.
+
+	Returns:
+		time_ns: int
+			Nanoseconds since the epoch.
+	"""
+
+	if when.tzinfo is None:
+		when = when.replace(tzinfo=dt.timezone.utc)
+
+	return int(when.timestamp()) * 10 ** 9 + when.microsecond * 1000
@@ -0,0 +1,311 @@
+import math
+import threading
+import time
+
+
+class Timer:
+
+	def __init__(self, deadline, interval, callback, args):
+		"""
+		Handle for work scheduled on a TimerWheel. Pass it to
+		TimerWheel.cancel() or TimerWheel.reschedule().
+
+		Parameters:
+			deadline: int
+				Tick the timer fires on.
+			interval: int or None
+				Ticks between firings for repeating timers, None for one-shot
+				timers.
+			callback: function
+				Called as callback(*args) when the timer fires.
+			args: tuple
+				Arguments for callback.
+		"""
+
+		self.deadline = deadline
+		self.interval = interval
+		self.callback = callback
+		self.args = args
+		self.slot = None
+		self.active = False
+
+
+class TimerWheel:
+
+	def __init__(self, logger, tick=.01, num_slots=512):
+		"""
+		Hashed timer wheel that owns all of the bot's timed work. Timers are
+		kept in num_slots slots by the tick they are due on, so scheduling,
+		rescheduling and canceling are O(1) dict operations. A single thread
+		sleeps until the next slot that holds a timer, runs whatever is due
+		and goes back to sleep, so nothing wakes up just to check a clock.
+
+		Callbacks run on the wheel's thread and must not block. Anything
+		slow (e.g. REST calls) should be handed off to its own thread.
+
+		Parameters:
+			logger: Log
+				Used to log messages as needed.
+			tick: float
+				Resolution of the wheel in seconds.
+			num_slots: int
+				Number of slots. Timers further out than num_slots ticks share
+				slots with nearer ones and are skipped until they are due.
+		"""
+
+		self.logger = logger
+		self.tick = tick
+		self.num_slots = num_slots
+		self.slots = [{} for _ in range(num_slots)]
+		self.start_time = time.monotonic()
+		self.current_tick = 0
+		# Tick the thread will next wake on by itself, None if it's waiting
+		# to be notified
+		self.wake_tick = None
+		self.timer_cond = threading.Condition()
+		self.fired = 0
+		self.running = True
+		self.scheduler_thread = threading.Thread(target=self.run, name='scheduler')
+
+	def start(self):
+		"""
+		Launches the wheel's thread.
+
+		Returns:
+			None
+		"""
+
+		self.scheduler_thread.start()
+
+	def stop(self):
+		"""
+		Stops the wheel's thread once any callbacks running have returned.
+		Timers still pending never fire.
+
+		Returns:
+			None
+		"""
+
+		with self.timer_cond:
+			self.running = False
+			self.timer_cond.notify()
+		if threading.current_thread() is not self.scheduler_thread:
+			self.scheduler_thread.join()
+
+	def schedule(self, delay, callback, *args):
+		"""
+		Runs callback(*args) once, delay seconds from now.
+
+		Parameters:
+			delay: float
+				Seconds from now.
+			callback: function
+				Work to run.
+			args: tuple
+				Arguments for callback.
+
+		Returns:
+			timer: Timer
+				Handle for canceling or rescheduling.
+		"""
+
+		with self.timer_cond:
+			timer = Timer(self.deadline_after(delay), None, callback, args)
+			self.insert(timer)
+
+		return timer
+
+	def schedule_every(self, interval, callback, *args):
+		"""
+		Runs callback(*args) every interval seconds, starting interval
+		seconds from now.
+
+		Parameters:
+			interval: float
+				Seconds between runs.
+			callback: function
+				Work to run.
+			args: tuple
+				Arguments for callback.
+
+		Returns:
+			timer: Timer
+				Handle for canceling.
+		"""
+
+		interval_ticks = max(1, math.ceil(interval / self.tick))
+		with self.timer_cond:
+			timer = Timer(
+				self.current_tick + interval_ticks, interval_ticks, callback, args
+			)
+			self.insert(timer)
+
+		return timer
+
+	def reschedule(self, timer, delay):
+		"""
+		Moves a one-shot timer (which may already have fired or been
+		canceled) to delay seconds from now.
+
+		Parameters:
+			timer: Timer
+				Timer to move.
+			delay: float
+				Seconds from now.
+
+		Returns:
+			None
+		"""
+
+		with self.timer_cond:
+			self.remove(timer)
+			timer.deadline = self.deadline_after(delay)
+			self.insert(timer)
+
+	def cancel(self, timer):
+		"""
+		Stops a timer from firing. Canceling a timer that already fired or
+		was already canceled does nothing.
+
+		Parameters:
+			timer: Timer
+				Timer to cancel.
+
+		Returns:
+			None
+		"""
+
+		with self.timer_cond:
+			self.remove(timer)
+
+	def deadline_after(self, delay):
+		"""
+		Tick that is delay seconds from now, never earlier than the next
+		tick. Must hold timer_cond.
+
+		Parameters:
+			delay: float
+				Seconds from now.
+
+		Returns:
+			deadline: int
+		"""
+
+		deadline = math.ceil((time.monotonic() + delay - self.start_time) / self.tick)
+
+		return max(deadline, self.current_tick + 1)
+
+	def insert(self, timer):
+		"""
+		Puts a timer in its slot and wakes the wheel's thread if the timer
+		is due before the thread planned to wake up. Must hold
+		timer_cond.
+
+		Parameters:
+			timer: Timer
+				Timer to insert.
+
+		Returns:
+			None
+		"""
+
+		timer.slot = self.slots[timer.deadline % self.num_slots]
+		timer.slot[id(timer)] = timer
+		timer.active = True
+		if self.wake_tick is None or timer.deadline < self.wake_tick:
+			self.timer_cond.notify()
+
+	def remove(self, timer):
+		"""
+		Takes a timer out of its slot. Must hold timer_cond.
+
+		Parameters:
+			timer: Timer
+				Timer to remove.
+
+		Returns:
+			None
+		"""
+
+		if timer.active:
+			del timer.slot[id(timer)]
+			timer.active = False
+
+	def run(self):
+		"""
+		The wheel's thread. Collects due timers, runs them outside the lock,
+		then sleeps until the next occupied slot comes around.
+
+		Returns:
+			None
+		"""
+
+		while self.running:
+			with self.timer_cond:
+				if not self.running:
+					break
+				due = self.collect_due()
+				if not due:
+					self.timer_cond.wait(self.time_to_next_timer())
+					continue
+
+			for timer in due:
+				self.fired += 1
+				try:
+					timer.callback(*timer.args)
+				except Exception as e:
+					self.logger.add(f'Exception: {e} in timer callback {timer.callback}')
+
+	def collect_due(self):
+		"""
+		Advances current_tick to now and removes every timer that is due,
+		re-inserting repeating timers at their next deadline. Must hold
+		timer_cond.
+
+		Returns:
+			due: list
+				Timers to run, in deadline order.
+		"""
+
+		now_tick = int((time.monotonic() - self.start_time) / self.tick)
+		due = []
+		# Every slot has been visited once a full turn has passed
+		ticks = min(now_tick - self.current_tick, self.num_slots)
+		for offset in range(1, ticks + 1):
+			slot = self.slots[(self.current_tick + offset) % self.num_slots]
+			if slot:
+				for timer in [t for t in slot.values() if t.deadline <= now_tick]:
+					self.remove(timer)
+					due.append(timer)
+		self.current_tick = max(self.current_tick, now_tick)
+
+		due.sort(key=lambda t: t.deadline)
+		for timer in due:
+			if timer.interval is not None:
+				timer.deadline += timer.interval
+				if timer.deadline <= now_tick:
+					timer.deadline = now_tick + timer.interval
+				self.insert(timer)
+
+		return due
+
+	def time_to_next_timer(self):
+		"""
+		Seconds until the next occupied slot comes around. Must hold
+		timer_cond.
+
+		Returns:
+			wait: float or None
+				None if there are no timers at all.
+		"""
+
+		for offset in range(1, self.num_slots + 1):
+			if self.slots[(self.current_tick + offset) % self.num_slots]:
+				self.wake_tick = self.current_tick + offset
+				wake_time = self.start_time + self.wake_tick * self.tick
+
+				return max(0.0, wake_time - time.monotonic())
+
+		self.wake_tick = None
+
+		return None
@@ -0,0 +1,209 @@
+import math
+
+import numpy as np
+
+
+class TradeStats:
+
+	def __init__(self, windows=(10, 60, 300), capacity=1 << 16):
+		"""
+		Rolling statistics over recent trades, kept in fixed size NumPy ring
+		buffers. Every window keeps running sums over the trades inside it,
+		so a new trade adds itself to each window and evicts whatever has
+		aged out of it: O(1) per trade, however busy the market is. Between
+		trades, expire() evicts against the current time.
+
+		Readers use plain attributes, one entry per window:
+			vwap: numpy.ndarray
+				Volume weighted average price.
+			volatility: numpy.ndarray
+				Realized volatility, the square root of the sum of squared
+				log returns between consecutive trades.
+			trade_rate: numpy.ndarray
+				Trades per second.
+			imbalance: numpy.ndarray
+				(buyer initiated volume - seller initiated volume) / volume.
+				Between -1 (all sells) and 1 (all buys).
+		and the last trade as last_price, last_size and last_time.
+
+		Parameters:
+			windows: tuple
+				Window lengths in seconds.
+			capacity: int
+				Trades the buffers hold. A trade that is pushed out of the
+				buffers is evicted from every window even if it isn't old
+				enough yet.
+		"""
+
+		self.windows = np.array(windows, dtype=np.float64)
+		self.capacity = capacity
+		self.times = np.zeros(capacity)
+		self.prices = np.zeros(capacity)
+		self.sizes = np.zeros(capacity)
+		# Size signed by aggressor, + for buyer initiated
+		self.signed_sizes = np.zeros(capacity)
+		self.sq_returns = np.zeros(capacity)
+		# Trades ever added, and per window the oldest trade still inside it
+		self.count = 0
+		self.tails = [0] * len(windows)
+		# Per window running sums
+		self.num_trades = [0] * len(windows)
+		self.volume = [0.0] * len(windows)
+		self.notional = [0.0] * len(windows)
+		self.signed_volume = [0.0] * len(windows)
+		self.sum_sq_returns = [0.0] * len(windows)
+		self.last_price = 0.0
+		self.last_size = 0.0
+		self.last_time = 0.0
+		self.vwap = np.zeros(len(windows))
+		self.volatility = np.zeros(len(windows))
+		self.trade_rate = np.zeros(len(windows))
+		self.imbalance = np.zeros(len(windows))
+
+	def add(self, price, size, aggressor, trade_time):
+		"""
+		Adds a trade and updates every window.
+
+		Parameters:
+			price: float
+				Trade price.
+			size: float
+				Trade size.
+			aggressor: string
+				'buy' if the taker bought, 'sell' if the taker sold.
+			trade_time: float
+				time.monotonic() at which the trade arrived.
+
+		Returns:
+			None
+		"""
+
+		if self.count:
+			sq_return = math.log(price / self.last_price) ** 2
+		else:
+			sq_return = 0.0
+		signed_size = size if aggressor == 'buy' else -size
+
+		i = self.count % self.capacity
+		self.times[i] = trade_time
+		self.prices[i] = price
+		self.sizes[i] = size
+		self.signed_sizes[i] = signed_size
+		self.sq_returns[i] = sq_return
+		self.count += 1
+		self.last_price = price
+		self.last_size = size
+		self.last_time = trade_time
+
+		for w in range(len(self.tails)):
+			self.num_trades[w] += 1
+			self.volume[w] += size
+			self.notional[w] += price * size
+			self.signed_volume[w] += signed_size
+			self.sum_sq_returns[w] += sq_return
+			self.evict(w, trade_time - self.windows[w])
+
+		# Running sums drift as floats are added and subtracted, recompute
+		# them from the buffers once per lap
+		if self.count % self.capacity == 0:
+			self.resum()
+
+		self.combine()
+
+	def evict(self, w, cutoff):
+		"""
+		Removes trades older than cutoff, or about to be overwritten, from a
+		window's running sums.
+
+		Parameters:
+			w: int
+				Index of the window.
+			cutoff: float
+				Trades at or before this time are out of the window.
+
+		Returns:
+			None
+		"""
+
+		tail = self.tails[w]
+		while tail < self.count and (
+				self.times[tail % self.capacity] <= cutoff
+				or self.count - tail > self.capacity - 1):
+			j = tail % self.capacity
+			size = self.sizes[j]
+			self.num_trades[w] -= 1
+			self.volume[w] -= size
+			self.notional[w] -= self.prices[j] * size
+			self.signed_volume[w] -= self.signed_sizes[j]
+			self.sum_sq_returns[w] -= self.sq_returns[j]
+			tail += 1
+		self.tails[w] = tail
+		# An empty window has exactly nothing in it, whatever the floats
+		# drifted to
+		if tail == self.count:
+			self.num_trades[w] = 0
+			self.volume[w] = 0.0
+			self.notional[w] = 0.0
+			self.signed_volume[w] = 0.0
+			self.sum_sq_returns[w] = 0.0
+
+	def expire(self, now):
+		"""
+		Removes trades that have aged out of their windows by now. add()
+		only evicts when a trade arrives, so the book writer calls this on
+		every message to keep the statistics current while no trades print.
+
+		Parameters:
+			now: float
+				time.monotonic().
+
+		Returns:
+			None
+		"""
+
+		evicted = False
+		for w, tail in enumerate(self.tails):
+			self.evict(w, now - self.windows[w])
+			if self.tails[w] != tail:
+				evicted = True
+
+		if evicted:
+			self.combine()
+
+	def resum(self):
+		"""
+		Recomputes every window's running sums from the buffers.
+
+		Returns:
+			None
+		"""
+
+		for w, tail in enumerate(self.tails):
+			idx = np.arange(tail, self.count) % self.capacity
+			sizes = self.sizes[idx]
+			self.num_trades[w] = len(idx)
+			self.volume[w] = float(sizes.sum())
+			self.notional[w] = float(np.dot(self.prices[idx], sizes))
+			self.signed_volume[w] = float(self.signed_sizes[idx].sum())
+			self.sum_sq_returns[w] = float(self.sq_returns[idx].sum())
+
+	def combine(self):
+		"""
+		Recomputes the per window statistics from the running sums.
+
+		Returns:
+			None
+		"""
+
+		volume = np.array(self.volume)
+		has_volume = volume > 0
+		self.vwap = np.divide(
+			self.notional, volume, out=np.full(len(volume), self.last_price),
+			where=has_volume
+		)
+		self.imbalance = np.divide(
+			self.signed_volume, volume, out=np.zeros(len(volume)),
+			where=has_volume
+		)
+		self.volatility = np.sqrt(np.maximum(self.sum_sq_returns, 0.0))
+		self.trade_rate = np.array(self.num_trades) / self.windows
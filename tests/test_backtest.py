@@ -0,0 +1,63 @@
+import datetime as dt
+import os
+
+from src.backtest import Backtest, ReplayData, sweep
+from src.tick_store import SIDES, TABLES, TableWriter, day_dir, to_ns
+
+
+LEVELS = 2
+
+
+def write_day(root, day):
+	"""
+	One day of market data in which the volume side strategy places a
+	sell, has it acknowledged and then wants it canceled when a better ask
+	appears.
+	"""
+
+	start_ns = to_ns(dt.datetime.combine(day, dt.time()))
+	ms = 10 ** 6
+	rows = {
+		'depth': [(start_ns, [100.0, 99.0], [1.0, 1.0], [101.0, 102.0], [2.0, 1.0])],
+		'changes': [
+			(start_ns + ms, SIDES['buy'], 99.5, 1.0),
+			(start_ns + 100 * ms, SIDES['sell'], 100.9, 2.0),
+		],
+		'trades': [(start_ns + 300 * ms, 100.5, .1, SIDES['buy'], 1)],
+	}
+	for table, table_rows in rows.items():
+		writer = TableWriter(
+			os.path.join(day_dir(root, 'BTC-USD', day), table), TABLES[table], LEVELS
+		)
+		for row in table_rows:
+			writer.append(row)
+		writer.close()
+
+
+def test_backtest_cancels_acknowledged_order(tmp_path):
+	day = dt.date(2018, 5, 1)
+	write_day(str(tmp_path), day)
+	data = ReplayData(
+		str(tmp_path), 'BTC-USD', dt.datetime(2018, 5, 1), dt.datetime(2018, 5, 2), LEVELS
+	)
+
+	backtest = Backtest(data, btc=1.0)
+	result = backtest.run()
+
+	assert result['orders'] == 1
+	assert result['filled_orders'] == 0
+	assert not backtest.strategy.open_orders
+
+
+def test_sweep_replays_every_day(tmp_path):
+	for day in (dt.date(2018, 5, 1), dt.date(2018, 5, 2)):
+		write_day(str(tmp_path), day)
+
+	table = sweep(
+		str(tmp_path), 'BTC-USD', dt.datetime(2018, 5, 1), dt.datetime(2018, 5, 3),
+		{'depth': [10, 50]}, processes=1, levels=LEVELS, btc=1.0
+	)
+
+	assert [row['depth'] for row in table] == [10, 50]
+	# The second day is replayed too and places another sell
+	assert [row['orders'] for row in table] == [2, 2]
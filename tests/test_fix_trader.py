@@ -0,0 +1,164 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('gdax')
+
+from src.fix_simulator import FIXSimulator
+from src.fix_trader import FIXTrader
+from src.orderbook_ws import OrderBookWebSocket
+from src.reply_manager import reply_manager
+from src.session_journal import ORDER_CANCEL_REQUESTED, ORDER_CLOSED, ORDER_NEW, ORDER_OPEN
+from src.soak import SoakAccount
+from src.strategy import Strategy, StrategyEngine, cancel_intent, order_intent
+from src.timer_wheel import TimerWheel
+
+
+class NullLog:
+
+	def add(self, message):
+		pass
+
+	def flush(self):
+		pass
+
+
+class RecordingJournal:
+	"""
+	Stands in for a SessionJournal, remembering the order states recorded.
+	"""
+
+	def __init__(self):
+		self.records = []
+
+	def record_order(self, order, state):
+		self.records.append((order.client_order_id, state))
+
+	def record_outbound(self, seq_num):
+		pass
+
+	def record_inbound(self, seq_num):
+		pass
+
+	def states(self, order):
+		return [state for cl_oid, state in self.records if cl_oid == order.client_order_id]
+
+
+def wait_for(condition, timeout=5.0):
+	deadline = time.monotonic() + timeout
+	while not condition():
+		if time.monotonic() > deadline:
+			return False
+		time.sleep(.01)
+	return True
+
+
+@pytest.fixture
+def thread_errors(monkeypatch):
+	errors = []
+
+	def excepthook(args):
+		# Order threads exit through sys.exit()
+		if args.exc_type is not SystemExit:
+			errors.append(args)
+
+	monkeypatch.setattr(threading, 'excepthook', excepthook)
+	return errors
+
+
+@pytest.fixture
+def make_trader():
+	"""
+	FIXTrader logged on to the local FIX stand-in, trading against a book
+	built from a snapshot.
+	"""
+
+	simulator = FIXSimulator()
+	threading.Thread(target=simulator.serve_forever, daemon=True).start()
+	logger = NullLog()
+	scheduler = TimerWheel(logger)
+	scheduler.start()
+	traders = []
+
+	def make(**kwargs):
+		ob_updated_cond = threading.Condition()
+		book = OrderBookWebSocket(ob_updated_cond, logger)
+		book.on_message({
+			'type': 'snapshot',
+			'bids': [['100.0', '1.0']],
+			'asks': [['101.0', '1.0']],
+		})
+		# The stand-in doesn't check the signature, but it must be base64
+		trader = FIXTrader(
+			'key', 'c2VjcmV0', 'passphrase', SoakAccount(1000.0, 1.0), book,
+			ob_updated_cond, logger, scheduler, **kwargs
+		)
+		for session in trader.sessions:
+			threading.Thread(
+				target=reply_manager, args=(trader, logger),
+				kwargs={'session': session}, daemon=True
+			).start()
+		assert trader.logged_on.wait(5)
+		traders.append(trader)
+		return trader
+
+	yield make
+
+	for trader in traders:
+		trader.close()
+	scheduler.stop()
+	simulator.shutdown()
+	simulator.server_close()
+
+
+def test_rate_limited_order_is_rejected_cleanly(make_trader, thread_errors):
+	# The Logon takes the only token and new orders may not wait at all
+	trader = make_trader(rate_limit={'rate': 1e-9, 'burst': 1, 'max_order_wait': 0})
+	session = trader.sessions[0]
+
+	trader.organize_order('buy')
+
+	assert wait_for(lambda: not trader.order_tracker.orders_by_cl_oid)
+	assert session.fix_writer.dropped == 1
+	assert wait_for(lambda: session.live_orders == 0)
+	assert not trader.order_tracker.orders_by_oid
+	assert thread_errors == []
+
+
+def test_closing_order_releases_session_before_bookkeeping(make_trader, thread_errors):
+	trader = make_trader(rate_limit={'rate': 1e-9, 'burst': 1, 'max_order_wait': 0})
+	session = trader.sessions[0]
+
+	def on_close(order_type, price, remaining):
+		raise RuntimeError('risk gate failed')
+
+	trader.risk_gate.on_close = on_close
+	trader.organize_order('buy')
+
+	assert wait_for(lambda: thread_errors)
+	assert str(thread_errors[0].exc_value) == 'risk gate failed'
+	assert session.live_orders == 0
+	assert not trader.order_tracker.orders_by_cl_oid
+	assert not trader.order_tracker.orders_by_oid
+
+
+def test_strategy_cancel_is_journaled(make_trader, thread_errors):
+	trader = make_trader()
+	trader.journal = RecordingJournal()
+	engine = StrategyEngine(trader, NullLog())
+	strategy = Strategy(trader.account)
+	engine.add(strategy)
+	trader.strategy_engine = engine
+
+	engine.execute(strategy, [order_intent('buy', 100.0, 1.0)])
+	order = next(iter(strategy.open_orders))
+	assert wait_for(lambda: ORDER_OPEN in trader.journal.states(order))
+	engine.execute(strategy, [cancel_intent(order)])
+
+	assert wait_for(lambda: not trader.order_tracker.orders_by_cl_oid)
+	assert trader.journal.states(order) == [
+		ORDER_NEW, ORDER_OPEN, ORDER_CANCEL_REQUESTED, ORDER_CLOSED
+	]
+	assert not strategy.open_orders
+	assert thread_errors == []
@@ -0,0 +1,115 @@
+import time
+
+from src import fix_writer
+from src.fix_writer import FIXWriter
+
+
+class NullLog:
+
+	def add(self, message):
+		pass
+
+
+class FakeSocket:
+
+	def __init__(self):
+		self.sent = []
+
+	def sendmsg(self, buffers):
+		self.sent.extend(bytes(buffer) for buffer in buffers)
+		return sum(len(buffer) for buffer in buffers)
+
+
+class FakeTime:
+	"""
+	Stands in for the time module in fix_writer, with a clock that only
+	moves when told to.
+	"""
+
+	def __init__(self):
+		self.now = 1000.0
+
+	def perf_counter(self):
+		return self.now
+
+	def time(self):
+		return self.now
+
+
+def make_writer(monkeypatch, **kwargs):
+	clock = FakeTime()
+	monkeypatch.setattr(fix_writer, 'time', clock)
+	writer = FIXWriter(
+		FakeSocket(), lambda request_type, seq_num, **_: f'{seq_num}:{request_type}|'.encode(),
+		lambda msg: msg, NullLog(), **kwargs
+	)
+	return writer, clock
+
+
+def take(writer):
+	with writer.pending_cond:
+		batch, dropped, wait = writer.take()
+	return [request_type for _, request_type, _ in batch], dropped, wait
+
+
+def test_cancels_are_sent_ahead_of_queued_orders(monkeypatch):
+	writer, clock = make_writer(monkeypatch, rate=1.0, burst=2)
+	for _ in range(3):
+		writer.enqueue('order')
+	writer.enqueue('cancel')
+
+	batch, dropped, wait = take(writer)
+
+	assert batch == ['cancel', 'order']
+	assert dropped == []
+	assert wait == 1.0
+	assert writer.rate_limited == 1
+
+
+def test_tokens_come_back_at_rate(monkeypatch):
+	writer, clock = make_writer(monkeypatch, rate=2.0, burst=1)
+	writer.enqueue('order')
+	writer.enqueue('order')
+	assert take(writer)[0] == ['order']
+
+	clock.now += .25
+	assert take(writer)[0] == []
+	clock.now += .25
+	assert take(writer)[0] == ['order']
+
+
+def test_reserve_is_kept_for_priority_requests(monkeypatch):
+	writer, clock = make_writer(monkeypatch, rate=1.0, burst=3, priority_reserve=1)
+	for _ in range(3):
+		writer.enqueue('order')
+
+	batch, _, wait = take(writer)
+	assert batch == ['order', 'order']
+	# The last order waits for a token beyond the reserve
+	assert wait == 1.0
+
+	writer.enqueue('cancel')
+	assert take(writer)[0] == ['cancel']
+
+
+def test_stale_orders_are_dropped(monkeypatch):
+	writer, clock = make_writer(monkeypatch, rate=.1, burst=1, max_order_wait=.5)
+	dropped = []
+	writer.on_dropped = lambda request_type, kwargs: dropped.append((request_type, kwargs))
+	writer.enqueue('heartbeat')
+	writer.enqueue('order', client_order_id='a')
+	writer.enqueue('cancel', client_order_id='b')
+	clock.now += 1.0
+
+	writer.start()
+	deadline = time.monotonic() + 5
+	while len(writer.fix_socket.sent) < 1 or not dropped:
+		assert time.monotonic() < deadline
+		time.sleep(.01)
+	writer.stop()
+
+	# The only token went to the heartbeat, the cancel is still queued
+	assert dropped == [('order', {'client_order_id': 'a'})]
+	assert writer.fix_socket.sent == [b'0:heartbeat|']
+	assert writer.dropped == 1
+	assert [request_type for _, request_type, _ in writer.priority_pending] == ['cancel']
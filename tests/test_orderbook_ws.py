@@ -0,0 +1,112 @@
+import threading
+
+import numpy as np
+import pytest
+
+pytest.importorskip('gdax')
+
+from src.book_checksum import BookVerifier
+from src.md_bus import BookReset, TopOfBook
+from src.orderbook_ws import OrderBookWebSocket
+
+
+class NullLog:
+
+	def add(self, message):
+		pass
+
+
+def make_book():
+	book = OrderBookWebSocket(threading.Condition(), NullLog())
+	book.on_message({
+		'type': 'snapshot',
+		'bids': [['99.0', '1.0'], ['100.0', '2.0']],
+		'asks': [['101.0', '3.0'], ['102.0', '4.0']],
+	})
+	return book
+
+
+def test_snapshot_sets_top_of_book():
+	book = make_book()
+
+	assert book.ready.is_set()
+	assert (book.best_buy_price, book.best_buy_size) == (100.0, 2.0)
+	assert (book.best_sell_price, book.best_sell_size) == (101.0, 3.0)
+
+
+def test_multi_change_update_applies_every_change():
+	book = make_book()
+	book.on_message({
+		'type': 'l2update',
+		'changes': [
+			['buy', '100.5', '1.5'],
+			['sell', '101.0', '0'],
+			['sell', '100.8', '0.5'],
+			['buy', '100.0', '2.5'],
+		],
+	})
+
+	np.testing.assert_array_equal(book.ob_buys, [[99.0, 1.0], [100.0, 2.5], [100.5, 1.5]])
+	np.testing.assert_array_equal(book.ob_sells, [[100.8, 0.5], [102.0, 4.0]])
+	assert (book.best_buy_price, book.best_buy_size) == (100.5, 1.5)
+	assert (book.best_sell_price, book.best_sell_size) == (100.8, 0.5)
+
+
+def test_change_to_either_side_publishes_top_of_book():
+	book = make_book()
+	subscription = book.bus.subscribe('test', event_types=(TopOfBook,))
+	# Only the second change moves the top of the book
+	book.on_message({
+		'type': 'l2update',
+		'changes': [['buy', '99.0', '0.5'], ['sell', '101.0', '2.0']],
+	})
+
+	event = subscription.poll()
+	assert event is not None
+	assert (event.best_sell_price, event.best_sell_size) == (101.0, 2.0)
+	assert subscription.poll() is None
+
+
+def test_resync_is_applied_by_the_writer_thread():
+	book = make_book()
+	subscription = book.bus.subscribe('test', event_types=(BookReset,))
+	reference = {'bids': [['100.2', '1.0', 1]], 'asks': [['100.9', '1.0', 1]]}
+	verifier = BookVerifier(book, lambda: reference, NullLog(), slack=0, confirmations=1)
+
+	checker = threading.Thread(target=verifier.check)
+	checker.start()
+	checker.join()
+
+	# The verifier only hands the snapshot over
+	assert verifier.resyncs == 1
+	assert (book.best_buy_price, book.best_sell_price) == (100.0, 101.0)
+	assert subscription.poll() is None
+
+	book.on_message({'type': 'l2update', 'changes': [['sell', '101.5', '2.0']]})
+
+	assert subscription.poll() is not None
+	np.testing.assert_array_equal(book.ob_buys, [[100.2, 1.0]])
+	np.testing.assert_array_equal(book.ob_sells, [[100.9, 1.0], [101.5, 2.0]])
+	assert not book.pending_resync
+
+
+def test_failing_strategy_engine_releases_the_condition():
+	book = make_book()
+
+	class FailingEngine:
+
+		def on_book_update(self, book):
+			raise ValueError('bad plugin')
+
+	book.strategy_engine = FailingEngine()
+	with pytest.raises(ValueError):
+		book.on_message({'type': 'l2update', 'changes': [['buy', '100.0', '3.0']]})
+
+	# The condition's lock is reentrant, so try it from another thread
+	acquired = []
+	waiter = threading.Thread(
+		target=lambda: acquired.append(book.ob_updated_cond.acquire(timeout=1))
+	)
+	waiter.start()
+	waiter.join()
+	assert acquired == [True]
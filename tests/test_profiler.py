@@ -0,0 +1,23 @@
+import threading
+
+from src.profiler import record_thread_exit, thread_cpu_times
+
+
+def burn(iterations):
+	total = 0
+	for i in range(iterations):
+		total += i * i
+	record_thread_exit()
+
+
+def test_exited_threads_keep_counting():
+	name = 'test_profiler_worker'
+	before = thread_cpu_times().get(name, 0.0)
+	totals = []
+	for _ in range(3):
+		thread = threading.Thread(target=burn, args=(200000,), name=name)
+		thread.start()
+		thread.join()
+		totals.append(thread_cpu_times().get(name, 0.0))
+
+	assert before < totals[0] < totals[1] < totals[2]
@@ -0,0 +1,34 @@
+import numpy as np
+
+from src.queue_position import QueuePositionEstimator
+
+
+class Book:
+
+	def __init__(self, ob_buys, ob_sells):
+		self.ob_buys = np.array(ob_buys, dtype=np.float64)
+		self.ob_sells = np.array(ob_sells, dtype=np.float64)
+
+
+def test_kept_counts_each_order_once():
+	estimator = QueuePositionEstimator(keep_time=10.0)
+	estimator.add('a', 'buy', 100.0, 1.0, level_size=0.0, now=0.0, prior_rate=1.0)
+	# Outbid by a small order, with nothing ahead at its own price
+	book = Book([[100.0, 1.0], [100.5, .1]], [[101.0, 1.0]])
+
+	assert estimator.keep('a', book, 1.0)
+	assert estimator.keep('a', book, 2.0)
+	assert estimator.stats()['kept'] == 1
+
+	estimator.add('b', 'buy', 100.0, 1.0, level_size=0.0, now=2.0, prior_rate=1.0)
+	assert estimator.keep('b', book, 3.0)
+	assert estimator.stats()['kept'] == 2
+
+
+def test_order_expected_to_fill_late_is_not_kept():
+	estimator = QueuePositionEstimator(keep_time=1.0)
+	estimator.add('a', 'buy', 100.0, 1.0, level_size=50.0, now=0.0, prior_rate=1.0)
+	book = Book([[100.0, 51.0]], [[101.0, 1.0]])
+
+	assert not estimator.keep('a', book, 1.0)
+	assert estimator.stats()['kept'] == 0
@@ -0,0 +1,81 @@
+import os
+
+from src.session_journal import (
+	ORDER_CANCEL_REQUESTED, ORDER_CLOSED, ORDER_NEW, ORDER_OPEN, SessionJournal
+)
+
+
+class FakeOrder:
+
+	def __init__(self, client_order_id, order_type='buy', price=100.0, size=1.0):
+		self.client_order_id = client_order_id
+		self.order_type = order_type
+		self.price = price
+		self.size = size
+		self.cumulative_filled = 0.0
+		self.order_id = None
+
+
+def test_recover_after_reopen(tmp_path):
+	path = str(tmp_path / 'journal')
+	journal = SessionJournal(path, capacity=64)
+	a = FakeOrder('a')
+	b = FakeOrder('b', order_type='sell', price=101.0)
+	journal.record_order(a, ORDER_NEW)
+	journal.record_order(b, ORDER_NEW)
+	a.order_id = 'oid-a'
+	a.cumulative_filled = .25
+	journal.record_order(a, ORDER_OPEN)
+	journal.record_outbound(7)
+	journal.record_inbound(5)
+	journal.close()
+
+	journal = SessionJournal(path, capacity=64)
+	next_outbound_seq, last_inbound_seq, live_orders = journal.recover()
+	journal.close()
+
+	assert (next_outbound_seq, last_inbound_seq) == (8, 5)
+	assert live_orders == {
+		'a': ('buy', ORDER_OPEN, 100.0, 1.0, .25, 'oid-a'),
+		'b': ('sell', ORDER_NEW, 101.0, 1.0, 0.0, None),
+	}
+
+
+def test_closed_orders_are_not_recovered(tmp_path):
+	path = str(tmp_path / 'journal')
+	journal = SessionJournal(path, capacity=64)
+	a = FakeOrder('a')
+	journal.record_order(a, ORDER_NEW)
+	journal.record_order(a, ORDER_CANCEL_REQUESTED)
+	journal.record_order(a, ORDER_CLOSED)
+	journal.record_outbound(3)
+	journal.close()
+
+	journal = SessionJournal(path, capacity=64)
+	assert journal.recover() == (4, 0, {})
+	journal.close()
+
+
+def test_recover_after_compaction(tmp_path):
+	path = str(tmp_path / 'journal')
+	capacity = 8
+	journal = SessionJournal(path, capacity=capacity)
+	live = FakeOrder('live')
+	journal.record_order(live, ORDER_NEW)
+	# Enough records to fill the journal several times over
+	for seq_num in range(1, 4 * capacity):
+		journal.record_outbound(seq_num)
+		journal.record_inbound(seq_num)
+		closed = FakeOrder(f'closed-{seq_num}')
+		journal.record_order(closed, ORDER_NEW)
+		journal.record_order(closed, ORDER_CLOSED)
+	assert not os.path.exists(path + '.compact')
+	assert journal.count <= capacity
+	journal.close()
+
+	journal = SessionJournal(path, capacity=capacity)
+	next_outbound_seq, last_inbound_seq, live_orders = journal.recover()
+	journal.close()
+
+	assert (next_outbound_seq, last_inbound_seq) == (4 * capacity, 4 * capacity - 1)
+	assert live_orders == {'live': ('buy', ORDER_NEW, 100.0, 1.0, 0.0, None)}
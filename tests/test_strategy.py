@@ -0,0 +1,66 @@
+from src.strategy import Strategy, StrategyEngine
+
+
+class NullLog:
+
+	def __init__(self):
+		self.messages = []
+
+	def add(self, message):
+		self.messages.append(message)
+
+
+class FakeOrder:
+
+	def __init__(self, strategy):
+		self.strategy = strategy
+
+
+class FailingStrategy(Strategy):
+
+	def on_book_update(self, book):
+		raise ValueError('bad plugin')
+
+	def on_reject(self, order, msg):
+		raise ValueError('bad plugin')
+
+
+class CountingStrategy(Strategy):
+
+	def __init__(self, account):
+		super().__init__(account)
+		self.updates = 0
+
+	def on_book_update(self, book):
+		self.updates += 1
+		return []
+
+
+def test_failing_strategy_does_not_stop_the_others():
+	logger = NullLog()
+	engine = StrategyEngine(None, logger)
+	failing = FailingStrategy(None)
+	counting = CountingStrategy(None)
+	engine.add(failing)
+	engine.add(counting)
+
+	engine.on_book_update(None)
+	engine.on_book_update(None)
+
+	assert counting.updates == 2
+	assert engine.stats()[failing.name]['errors'] == 2
+	assert engine.stats()[counting.name]['errors'] == 0
+	assert any('bad plugin' in message for message in logger.messages)
+
+
+def test_failing_strategy_still_forgets_rejected_order():
+	engine = StrategyEngine(None, NullLog())
+	failing = FailingStrategy(None)
+	engine.add(failing)
+	order = FakeOrder(failing)
+	failing.open_orders.add(order)
+
+	engine.on_execution_report(order, {'OrdStatus': 'Rejected'})
+
+	assert not failing.open_orders
+	assert engine.stats()[failing.name]['errors'] == 1
@@ -0,0 +1,57 @@
+import datetime as dt
+import os
+
+import numpy as np
+
+from src.tick_store import INDEX_STRIDE, SIDES, TABLES, TableWriter, TickStore, day_dir, to_ns
+
+
+DAY = dt.date(2018, 5, 1)
+START_NS = to_ns(dt.datetime(2018, 5, 1))
+
+
+def write_trades(path, first, count):
+	writer = TableWriter(path, TABLES['trades'], 1)
+	for i in range(first, first + count):
+		writer.append((START_NS + i, 100.0 + i, 1.0, SIDES['buy'], i))
+	writer.close()
+
+
+def read_trades(root):
+	return TickStore(root).query(
+		'BTC-USD', 'trades', dt.datetime(2018, 5, 1), dt.datetime(2018, 5, 2)
+	)
+
+
+def test_writer_resumes_after_torn_flush(tmp_path):
+	root = str(tmp_path)
+	path = os.path.join(day_dir(root, 'BTC-USD', DAY), 'trades')
+	write_trades(path, 0, 2 * INDEX_STRIDE)
+	# A flush that wrote one column and the index, then stopped
+	with open(os.path.join(path, 'price'), 'ab') as f:
+		f.write(np.array([1e9], dtype=np.float64).tobytes())
+	with open(os.path.join(path, 'time_index'), 'ab') as f:
+		f.write(np.array([START_NS + 2 * INDEX_STRIDE], dtype=np.int64).tobytes())
+
+	write_trades(path, 2 * INDEX_STRIDE, 10)
+
+	trades = read_trades(root)
+	assert len(trades['time_ns']) == 2 * INDEX_STRIDE + 10
+	np.testing.assert_array_equal(trades['price'], 100.0 + (trades['time_ns'] - START_NS))
+	index = np.fromfile(os.path.join(path, 'time_index'), dtype=np.int64)
+	np.testing.assert_array_equal(index, trades['time_ns'][::INDEX_STRIDE])
+
+
+def test_writer_rebuilds_missing_index_entries(tmp_path):
+	root = str(tmp_path)
+	path = os.path.join(day_dir(root, 'BTC-USD', DAY), 'trades')
+	write_trades(path, 0, INDEX_STRIDE + 1)
+	# The columns were written but the index entry for the last row wasn't
+	os.truncate(os.path.join(path, 'time_index'), 8)
+
+	write_trades(path, INDEX_STRIDE + 1, 10)
+
+	trades = read_trades(root)
+	assert len(trades['time_ns']) == INDEX_STRIDE + 11
+	index = np.fromfile(os.path.join(path, 'time_index'), dtype=np.int64)
+	np.testing.assert_array_equal(index, trades['time_ns'][::INDEX_STRIDE])
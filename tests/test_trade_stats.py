@@ -0,0 +1,33 @@
+import pytest
+
+from src.trade_stats import TradeStats
+
+
+def test_add_updates_every_window():
+	stats = TradeStats(windows=(10, 60))
+	stats.add(100.0, 1.0, 'buy', 0.0)
+	stats.add(101.0, 3.0, 'sell', 5.0)
+
+	assert stats.num_trades == [2, 2]
+	assert stats.volume == [4.0, 4.0]
+	assert stats.vwap[0] == pytest.approx(100.75)
+	assert stats.imbalance[0] == pytest.approx(-.5)
+
+
+def test_expire_evicts_without_new_trades():
+	stats = TradeStats(windows=(10, 60))
+	stats.add(100.0, 1.0, 'buy', 0.0)
+	stats.add(101.0, 3.0, 'sell', 5.0)
+
+	stats.expire(12.0)
+	assert stats.num_trades == [1, 2]
+	assert stats.vwap[0] == pytest.approx(101.0)
+	assert stats.trade_rate[0] == pytest.approx(.1)
+
+	stats.expire(100.0)
+	assert stats.num_trades == [0, 0]
+	assert stats.volume == [0.0, 0.0]
+	assert list(stats.trade_rate) == [0.0, 0.0]
+	assert list(stats.volatility) == [0.0, 0.0]
+	# Nothing in the window, so the last price stands in
+	assert list(stats.vwap) == [101.0, 101.0]